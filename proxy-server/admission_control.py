@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from config import (
+    ADMISSION_MAX_QUEUE_SIZE,
+    ADMISSION_MAX_WAIT,
+    CLIENT_ID_HEADER,
+    MAX_CONCURRENT_UPSTREAM_REQUESTS,
+    PRIORITY_HEADER,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_RPS,
+)
+from fastapi import HTTPException, Request
+from metrics import admission_wait
+
+INTERACTIVE_PRIORITY = 0
+BATCH_PRIORITY = 1
+# Number of callers whose token buckets are kept in memory
+_MAX_TRACKED_CALLERS = 10000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Take a token, return 0 on success or seconds until a token is ready."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self.rejected_count = 0
+
+    def check(self, caller_id: str):
+        if self.rate <= 0:
+            return
+        if caller_id not in self.buckets:
+            self.buckets[caller_id] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > _MAX_TRACKED_CALLERS:
+                self.buckets.popitem(last=False)
+        self.buckets.move_to_end(caller_id)
+        retry_after = self.buckets[caller_id].try_acquire()
+        if retry_after > 0:
+            self.rejected_count += 1
+            raise _create_too_many_requests_exception(retry_after)
+
+
+class PriorityLimiter:
+    """
+    Concurrency limiter, waiting requests are served by priority
+    (lower first), then by arrival order.
+    """
+
+    def __init__(self, limit: int, max_wait: float, max_queue_size: int):
+        self.limit = limit
+        self.max_wait = max_wait
+        self.max_queue_size = max_queue_size
+        self.in_flight = 0
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.queue_depth = 0
+        self.sequence = itertools.count()
+        self.wait_count = 0
+        self.wait_time_sum = 0.0
+        self.rejected_count = 0
+
+    async def acquire(self, priority: int) -> Callable[[], None]:
+        """
+        Wait for a slot, return a function to release it.
+        The release function can safely be called more than once.
+        """
+        if self.limit <= 0:
+            return _noop
+        if self.in_flight < self.limit and self.queue_depth == 0:
+            self.in_flight += 1
+            return self._create_release_once()
+        if self.queue_depth >= self.max_queue_size:
+            self.rejected_count += 1
+            raise _create_too_many_requests_exception(self.max_wait)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), future))
+        self.queue_depth += 1
+        start_time = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected_count += 1
+            raise _create_too_many_requests_exception(self.max_wait)
+        except asyncio.CancelledError:
+            # The slot might have been handed over right before cancellation
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            wait_time = time.monotonic() - start_time
+            self.queue_depth -= 1
+            self.wait_count += 1
+            self.wait_time_sum += wait_time
+            admission_wait.observe(wait_time, (str(priority),))
+        return self._create_release_once()
+
+    def _create_release_once(self) -> Callable[[], None]:
+        is_released = False
+
+        def release_once():
+            nonlocal is_released
+            if not is_released:
+                is_released = True
+                self.release()
+
+        return release_once
+
+    def release(self):
+        while len(self.waiters) > 0:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # Hand the slot over, in_flight stays the same
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def get_stats(self) -> dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "wait_count": self.wait_count,
+            "wait_time_sum": self.wait_time_sum,
+            "rejected_count": self.rejected_count,
+        }
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_RPS, RATE_LIMIT_BURST)
+upstream_limiter = PriorityLimiter(
+    MAX_CONCURRENT_UPSTREAM_REQUESTS, ADMISSION_MAX_WAIT, ADMISSION_MAX_QUEUE_SIZE
+)
+
+
+def get_caller_id(request: Request) -> str:
+    caller = request.headers.get(CLIENT_ID_HEADER)
+    if caller is None:
+        caller = (
+            request.headers.get("X-Goog-Api-Key")
+            or request.query_params.get("key")
+            or request.headers.get("Authorization")
+            or (request.client.host if request.client else "")
+        )
+    # Never keep API keys in memory or logs
+    return hashlib.md5(caller.encode("utf-8")).hexdigest()
+
+
+def get_request_priority(request: Request, stream_enabled: bool) -> int:
+    priority = request.headers.get(PRIORITY_HEADER, "").lower()
+    if priority == "interactive":
+        return INTERACTIVE_PRIORITY
+    if priority == "batch":
+        return BATCH_PRIORITY
+    return INTERACTIVE_PRIORITY if stream_enabled else BATCH_PRIORITY
+
+
+def _noop():
+    pass
+
+
+def _create_too_many_requests_exception(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many requests",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
@@ -0,0 +1,126 @@
+"""
+Benchmark for transport compression.
+Send large non-streamed chat completion requests (long conversations) through
+the proxy to a mock upstream that gzips responses (`--gzip`). The client
+accepts gzip and, when compression is on, gzips its request bodies as well.
+Compare the bytes crossing the client link and latency with transport
+compression off and on. The mock response text is repetitive, so it
+compresses better than real model output.
+Run from `proxy-server` directory: `python -m benchmark.compression_bench`
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import time
+from typing import Any
+
+import httpx
+from benchmark.load_test import (
+    MOCK_PORT,
+    PROXY_PORT,
+    get_percentiles,
+    start_process,
+    wait_until_ready,
+)
+
+
+def create_chat_request(index: int) -> dict[str, Any]:
+    messages = []
+    for turn in range(200):
+        messages.append({"role": "user", "content": f"Session {index} step {turn}"})
+        messages.append(
+            {"role": "assistant", "content": f"Output {turn}: " + "lorem ipsum " * 50}
+        )
+    messages.append({"role": "user", "content": "What is next?"})
+    return {"model": "mock", "messages": messages}
+
+
+async def send_requests(
+    proxy_url: str, compression_enabled: bool, args: argparse.Namespace
+) -> dict[str, list[float]]:
+    result = {"latencies": [], "request_bytes": [], "response_bytes": []}
+    next_index = 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal next_index
+        while next_index < args.requests:
+            body = json.dumps(create_chat_request(next_index)).encode("utf-8")
+            next_index += 1
+            headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+            if compression_enabled:
+                body = gzip.compress(body, compresslevel=5)
+                headers["Content-Encoding"] = "gzip"
+            start_time = time.perf_counter()
+            response = await client.post(
+                "/v1/chat/completions", content=body, headers=headers
+            )
+            await response.aread()
+            result["latencies"].append(time.perf_counter() - start_time)
+            result["request_bytes"].append(len(body))
+            result["response_bytes"].append(response.num_bytes_downloaded)
+
+    async with httpx.AsyncClient(base_url=proxy_url, timeout=300) as client:
+        await asyncio.gather(*[worker(client) for _ in range(args.concurrency)])
+    return result
+
+
+async def measure(compression_enabled: bool, args: argparse.Namespace) -> dict:
+    mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+    proxy_url = f"http://127.0.0.1:{PROXY_PORT}"
+    processes = []
+    try:
+        mock_args = [
+            "-m",
+            "benchmark.mock_upstream",
+            f"--port={MOCK_PORT}",
+            f"--response-tokens={args.response_tokens}",
+            "--gzip",
+        ]
+        processes.append(start_process(mock_args, {}))
+        await wait_until_ready(mock_url)
+        proxy_env = {
+            "PROXY_HTTP_PORT": str(PROXY_PORT),
+            "PROXY_LLM_API_URL": mock_url,
+            "PROXY_LLM_API_KEY": "compression-bench",
+            "PROXY_SUMMARIZATION_TOKEN_THRESHOLD": "1000000",
+            "PROXY_TRANSPORT_COMPRESSION_ENABLED": "1" if compression_enabled else "0",
+        }
+        processes.append(start_process(["main.py"], proxy_env))
+        await wait_until_ready(proxy_url, path="/ready")
+        return await send_requests(proxy_url, compression_enabled, args)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+async def main(args: argparse.Namespace):
+    print(
+        f"{args.requests} requests, concurrency {args.concurrency}, "
+        f"{args.response_tokens} response tokens\n"
+        f"{'compression':>11} {'request KiB':>12} {'response KiB':>13} "
+        f"{'p50 (ms)':>9} {'p99 (ms)':>9}"
+    )
+    for name, compression_enabled in (("off", False), ("on", True)):
+        result = await measure(compression_enabled, args)
+        request_kib = sum(result["request_bytes"]) / len(result["request_bytes"]) / 1024
+        response_kib = (
+            sum(result["response_bytes"]) / len(result["response_bytes"]) / 1024
+        )
+        percentiles = get_percentiles(result["latencies"])
+        print(
+            f"{name:>11} {request_kib:>12.1f} {response_kib:>13.1f} "
+            f"{percentiles['p50'] * 1000:>9.1f} {percentiles['p99'] * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--response-tokens", type=int, default=20000)
+    asyncio.run(main(parser.parse_args()))
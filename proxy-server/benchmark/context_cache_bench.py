@@ -0,0 +1,134 @@
+"""
+Benchmark for upstream context caching.
+Replay several Gemini sessions sharing a large system instruction (e.g.,
+coding agent rules and tool declarations), every turn resends the whole
+history. The mock upstream implements the cachedContents API, takes time
+proportional to the uncached prompt size (`--prefill-rate` tokens per
+second), and reports cached prompt tokens.
+Compare uncached prompt tokens and latency with and without context cache.
+Run from `proxy-server` directory: `python -m benchmark.context_cache_bench`
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+import httpx
+from benchmark.load_test import (
+    MOCK_PORT,
+    PROXY_PORT,
+    get_percentiles,
+    start_process,
+    wait_until_ready,
+)
+
+
+def create_system_instruction(tokens: int) -> dict[str, Any]:
+    rules = [
+        f"Rule {index}: follow the coding guideline {index}"
+        for index in range(tokens // 10)
+    ]
+    return {"parts": [{"text": "\n".join(rules)}]}
+
+
+def create_turn_contents(session: int, turn: int) -> list[dict[str, Any]]:
+    return [
+        {"role": "user", "parts": [{"text": f"Session {session} step {turn}"}]},
+        {
+            "role": "model",
+            "parts": [{"text": f"Session {session} answer {turn}: " + "done " * 300}],
+        },
+    ]
+
+
+async def run_session(
+    client: httpx.AsyncClient, session: int, args: argparse.Namespace
+) -> dict[str, list[float]]:
+    system_instruction = create_system_instruction(args.system_tokens)
+    contents = []
+    result = {"latencies": [], "prompt_tokens": [], "cached_tokens": []}
+    for turn in range(args.turns):
+        contents += create_turn_contents(session, turn)
+        start_time = time.perf_counter()
+        response = await client.post(
+            "/v1beta/models/mock:generateContent",
+            json={
+                "systemInstruction": system_instruction,
+                "contents": [*contents, {"role": "user", "parts": [{"text": "Go"}]}],
+            },
+        )
+        result["latencies"].append(time.perf_counter() - start_time)
+        usage = response.json()["usageMetadata"]
+        result["prompt_tokens"].append(usage["promptTokenCount"])
+        result["cached_tokens"].append(usage["cachedContentTokenCount"])
+    return result
+
+
+async def measure(context_cache_enabled: bool, args: argparse.Namespace) -> dict:
+    mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+    proxy_url = f"http://127.0.0.1:{PROXY_PORT}"
+    processes = []
+    try:
+        mock_args = [
+            "-m",
+            "benchmark.mock_upstream",
+            f"--port={MOCK_PORT}",
+            f"--prefill-rate={args.prefill_rate}",
+        ]
+        processes.append(start_process(mock_args, {}))
+        await wait_until_ready(mock_url)
+        proxy_env = {
+            "PROXY_HTTP_PORT": str(PROXY_PORT),
+            "PROXY_LLM_API_URL": mock_url,
+            "PROXY_LLM_API_KEY": "context-cache-bench",
+            "PROXY_CONTEXT_CACHE_ENABLED": "1" if context_cache_enabled else "0",
+        }
+        processes.append(start_process(["main.py"], proxy_env))
+        await wait_until_ready(proxy_url, path="/ready")
+        async with httpx.AsyncClient(base_url=proxy_url, timeout=300) as client:
+            results = await asyncio.gather(
+                *[
+                    run_session(client, session, args)
+                    for session in range(args.sessions)
+                ]
+            )
+        return {
+            key: [value for result in results for value in result[key]]
+            for key in results[0]
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+async def main(args: argparse.Namespace):
+    print(
+        f"{args.sessions} sessions of {args.turns} turns, "
+        f"system instruction of {args.system_tokens} tokens, "
+        f"mock prefill rate {args.prefill_rate:.0f} tokens/s\n"
+        f"{'context cache':>13} {'prompt tokens':>14} {'cached tokens':>14} "
+        f"{'uncached tokens':>16} {'p50 (ms)':>9} {'p99 (ms)':>9}"
+    )
+    for name, context_cache_enabled in (("off", False), ("on", True)):
+        result = await measure(context_cache_enabled, args)
+        prompt_tokens = sum(result["prompt_tokens"])
+        cached_tokens = sum(result["cached_tokens"])
+        percentiles = get_percentiles(result["latencies"])
+        print(
+            f"{name:>13} {prompt_tokens:>14} {cached_tokens:>14} "
+            f"{prompt_tokens - cached_tokens:>16} {percentiles['p50'] * 1000:>9.1f} "
+            f"{percentiles['p99'] * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--system-tokens", type=int, default=12000)
+    parser.add_argument("--prefill-rate", type=float, default=20000)
+    asyncio.run(main(parser.parse_args()))
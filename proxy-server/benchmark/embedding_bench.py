@@ -0,0 +1,121 @@
+"""
+Benchmark for the v1/embeddings route.
+Start a serial mock embedding server (one request at a time, like a local
+Ollama), then send many concurrent single-input embedding requests through
+the proxy, with and without micro-batching.
+Run from `proxy-server` directory: `python -m benchmark.embedding_bench`
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+from benchmark.load_test import (
+    MOCK_PORT,
+    PROXY_PORT,
+    start_process,
+    wait_until_ready,
+)
+
+REQUEST_COUNT = 500
+CONCURRENCY = 50
+
+
+def create_inputs(repeat_ratio: float) -> list[str]:
+    rng = random.Random(0)
+    inputs = []
+    for index in range(REQUEST_COUNT):
+        if len(inputs) > 0 and rng.random() < repeat_ratio:
+            inputs.append(rng.choice(inputs))
+        else:
+            inputs.append(f"Document chunk {index}: " + "lorem ipsum " * 20)
+    return inputs
+
+
+async def send_requests(proxy_url: str, inputs: list[str]) -> tuple[float, int]:
+    next_index = 0
+    error_count = 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal next_index, error_count
+        while next_index < len(inputs):
+            text = inputs[next_index]
+            next_index += 1
+            response = await client.post(
+                "/v1/embeddings", json={"model": "nomic-embed-text", "input": text}
+            )
+            if response.status_code != 200:
+                error_count += 1
+
+    limits = httpx.Limits(max_connections=CONCURRENCY)
+    async with httpx.AsyncClient(
+        base_url=proxy_url, limits=limits, timeout=300
+    ) as client:
+        start_time = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(CONCURRENCY)])
+        return time.perf_counter() - start_time, error_count
+
+
+async def measure(batch_enabled: bool, args: argparse.Namespace) -> dict:
+    mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+    proxy_url = f"http://127.0.0.1:{PROXY_PORT}"
+    processes = []
+    try:
+        mock_args = [
+            "-m",
+            "benchmark.mock_upstream",
+            f"--port={MOCK_PORT}",
+            f"--latency={args.mock_latency}",
+            "--serial",
+        ]
+        processes.append(start_process(mock_args, {}))
+        await wait_until_ready(mock_url)
+        proxy_env = {
+            "PROXY_HTTP_PORT": str(PROXY_PORT),
+            "PROXY_EMBEDDING_API_URL": mock_url,
+            "PROXY_EMBEDDING_BATCH_ENABLED": "1" if batch_enabled else "0",
+        }
+        processes.append(start_process(["main.py"], proxy_env))
+        await wait_until_ready(proxy_url, path="/ready")
+        duration, error_count = await send_requests(
+            proxy_url, create_inputs(args.repeat_ratio)
+        )
+        async with httpx.AsyncClient() as client:
+            upstream_calls = (await client.get(f"{mock_url}/health")).json()[
+                "request_count"
+            ]
+        return {
+            "rps": REQUEST_COUNT / duration,
+            "upstream_calls": upstream_calls,
+            "error_count": error_count,
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+async def main(args: argparse.Namespace):
+    print(
+        f"{REQUEST_COUNT} requests, concurrency {CONCURRENCY}, "
+        f"upstream latency {args.mock_latency * 1000:.0f} ms (serial), "
+        f"repeat ratio {args.repeat_ratio}"
+    )
+    print(f"{'mode':>10} {'rps':>8} {'upstream calls':>15} {'errors':>7}")
+    for name, batch_enabled in (("direct", False), ("batched", True)):
+        result = await measure(batch_enabled, args)
+        print(
+            f"{name:>10} {result['rps']:>8.1f} {result['upstream_calls']:>15} "
+            f"{result['error_count']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mock-latency", type=float, default=0.05)
+    parser.add_argument("--repeat-ratio", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+"""
+Benchmark for hedged requests.
+The mock upstream stalls a small fraction of requests (`--stall-rate`) for
+`--stall-duration` seconds before sending response headers. Compare time to
+first byte with and without hedging, and count upstream requests to measure
+the load amplification.
+Run from `proxy-server` directory: `python -m benchmark.hedge_bench`
+"""
+
+import argparse
+import asyncio
+
+import httpx
+from benchmark.load_test import (
+    MOCK_PORT,
+    PROXY_PORT,
+    ProcessUsage,
+    Scenario,
+    create_short_chat_request,
+    create_stream_request,
+    run_scenario,
+    start_process,
+    wait_until_ready,
+)
+
+
+async def measure(
+    hedge_enabled: bool, scenario: Scenario, args: argparse.Namespace
+) -> dict:
+    mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+    proxy_url = f"http://127.0.0.1:{PROXY_PORT}"
+    processes = []
+    try:
+        mock_args = [
+            "-m",
+            "benchmark.mock_upstream",
+            f"--port={MOCK_PORT}",
+            f"--latency={args.mock_latency}",
+            f"--stall-rate={args.stall_rate}",
+            f"--stall-duration={args.stall_duration}",
+        ]
+        processes.append(start_process(mock_args, {}))
+        await wait_until_ready(mock_url)
+        proxy_env = {
+            "PROXY_HTTP_PORT": str(PROXY_PORT),
+            "PROXY_LLM_API_URL": mock_url,
+            "PROXY_LLM_API_KEY": "hedge-bench",
+            "PROXY_HEDGE_ENABLED": "1" if hedge_enabled else "0",
+        }
+        processes.append(start_process(["main.py"], proxy_env))
+        await wait_until_ready(proxy_url, path="/ready")
+        result = await run_scenario(proxy_url, scenario, ProcessUsage(None))
+        async with httpx.AsyncClient() as client:
+            response = await client.get(f"{mock_url}/health")
+        result["upstream_requests"] = response.json()["request_count"]
+        return result
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+async def main(args: argparse.Namespace):
+    print(
+        f"stall rate {args.stall_rate}, stall duration {args.stall_duration}s, "
+        f"mock latency {args.mock_latency}s\n"
+        f"{'scenario':>18} {'hedge':>6} {'requests':>9} {'upstream':>9} "
+        f"{'p50 ttfb (ms)':>14} {'p99 ttfb (ms)':>14} {'errors':>7}"
+    )
+    scenarios = [
+        Scenario(
+            "short_chat", args.requests, args.concurrency, create_short_chat_request
+        ),
+        Scenario("streams", args.requests, args.concurrency, create_stream_request),
+    ]
+    for scenario in scenarios:
+        for name, hedge_enabled in (("off", False), ("on", True)):
+            result = await measure(hedge_enabled, scenario, args)
+            print(
+                f"{scenario.name:>18} {name:>6} {scenario.request_count:>9} "
+                f"{result['upstream_requests']:>9} "
+                f"{result['ttfb']['p50'] * 1000:>14.1f} "
+                f"{result['ttfb']['p99'] * 1000:>14.1f} {result['error_count']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--mock-latency", type=float, default=0.05)
+    parser.add_argument("--stall-rate", type=float, default=0.02)
+    parser.add_argument("--stall-duration", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
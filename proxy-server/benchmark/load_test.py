@@ -0,0 +1,339 @@
+"""
+Load test for the proxy.
+Start a mock upstream and the proxy (`main.py`), drive them with concurrent
+clients, and report throughput, time to first byte, total latency, CPU time
+and memory of the proxy process for every scenario.
+Run from `proxy-server` directory:
+`python -m benchmark.load_test --output load-test.json`
+
+The mock upstream is the summarizer as well, so the long session scenario
+(chat completions with a system prompt) goes through summarization: hashing,
+token estimation, cache lookup, and summarizer calls. Every scenario starts
+once the proxy is ready (`/ready`), so warm-up is not measured. Use
+`--proxy-url` to drive a proxy that is already running with another
+configuration (CPU time and memory are not reported in that case).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+import httpx
+
+MOCK_PORT = 9201
+PROXY_PORT = 9200
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class Scenario:
+    def __init__(
+        self,
+        name: str,
+        request_count: int,
+        concurrency: int,
+        create_request: Callable[[int], tuple[str, dict[str, Any]]],
+    ):
+        self.name = name
+        self.request_count = request_count
+        self.concurrency = concurrency
+        # Request index -> (path, payload)
+        self.create_request = create_request
+
+
+def create_short_chat_request(index: int) -> tuple[str, dict[str, Any]]:
+    return "v1/chat/completions", {
+        "model": "mock",
+        "messages": [{"role": "user", "content": f"Short question {index}"}],
+    }
+
+
+def create_long_session_request(index: int) -> tuple[str, dict[str, Any]]:
+    messages = [{"role": "system", "content": "You are a coding assistant."}]
+    for turn in range(200):
+        messages.append({"role": "user", "content": f"Session {index} question {turn}"})
+        messages.append(
+            {
+                "role": "assistant",
+                "content": f"Tool output {turn}: " + "lorem ipsum " * 50,
+            }
+        )
+    messages.append({"role": "user", "content": "What is next?"})
+    return "v1/chat/completions", {"model": "mock", "messages": messages}
+
+
+def create_stream_request(index: int) -> tuple[str, dict[str, Any]]:
+    return "v1beta/models/gemini-2.0-flash:streamGenerateContent", {
+        "contents": [{"role": "user", "parts": [{"text": f"Stream {index}"}]}]
+    }
+
+
+SCENARIOS = [
+    Scenario("short_chat", 500, 20, create_short_chat_request),
+    Scenario("long_session", 100, 10, create_long_session_request),
+    Scenario("concurrent_streams", 500, 200, create_stream_request),
+]
+
+
+class ProcessUsage:
+    """Read CPU time and memory of a process from /proc (Linux only)."""
+
+    def __init__(self, pid: int | None):
+        self.pid = pid
+
+    def get_cpu_time(self) -> float | None:
+        stat = self._read(f"/proc/{self.pid}/stat")
+        if stat is None:
+            return None
+        # Fields after the command name, utime and stime are fields 14 and 15
+        fields = stat.rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+
+    def get_memory_kb(self) -> dict[str, int] | None:
+        status = self._read(f"/proc/{self.pid}/status")
+        if status is None:
+            return None
+        memory = {}
+        for line in status.splitlines():
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                memory[name] = int(value.split()[0])
+        return {"rss": memory.get("VmRSS"), "peak_rss": memory.get("VmHWM")}
+
+    def _read(self, path: str) -> str | None:
+        if self.pid is None:
+            return None
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            return None
+
+
+async def send_request(
+    client: httpx.AsyncClient, path: str, payload: dict[str, Any]
+) -> tuple[float, float, int]:
+    """Return time to first byte, total latency and status code."""
+    # Content-Length is forwarded as is for Gemini paths, keep the body intact
+    content = json.dumps(payload)
+    start_time = time.perf_counter()
+    ttfb = None
+    async with client.stream(
+        "POST",
+        f"/{path}",
+        content=content,
+        headers={"Content-Type": "application/json"},
+    ) as response:
+        async for _ in response.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start_time
+    latency = time.perf_counter() - start_time
+    return latency if ttfb is None else ttfb, latency, response.status_code
+
+
+async def run_scenario(
+    proxy_url: str, scenario: Scenario, usage: ProcessUsage
+) -> dict[str, Any]:
+    requests = [
+        scenario.create_request(index) for index in range(scenario.request_count)
+    ]
+    ttfbs: list[float] = []
+    latencies: list[float] = []
+    error_count = 0
+    next_index = 0
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal next_index, error_count
+        while next_index < len(requests):
+            path, payload = requests[next_index]
+            next_index += 1
+            try:
+                ttfb, latency, status_code = await send_request(client, path, payload)
+            except httpx.HTTPError:
+                error_count += 1
+                continue
+            if status_code >= 400:
+                error_count += 1
+                continue
+            ttfbs.append(ttfb)
+            latencies.append(latency)
+
+    limits = httpx.Limits(max_connections=scenario.concurrency)
+    async with httpx.AsyncClient(
+        base_url=proxy_url, limits=limits, timeout=120
+    ) as client:
+        cpu_start = usage.get_cpu_time()
+        start_time = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(scenario.concurrency)])
+        duration = time.perf_counter() - start_time
+        cpu_end = usage.get_cpu_time()
+    return {
+        "name": scenario.name,
+        "request_count": scenario.request_count,
+        "concurrency": scenario.concurrency,
+        "error_count": error_count,
+        "duration": duration,
+        "rps": len(latencies) / duration,
+        "ttfb": get_percentiles(ttfbs),
+        "latency": get_percentiles(latencies),
+        "cpu_time": None if cpu_start is None else cpu_end - cpu_start,
+        "memory_kb": usage.get_memory_kb(),
+    }
+
+
+def get_percentiles(values: list[float]) -> dict[str, float | None]:
+    if len(values) == 0:
+        return {"p50": None, "p95": None, "p99": None}
+    values = sorted(values)
+    return {
+        f"p{percentile}": values[min(len(values) - 1, len(values) * percentile // 100)]
+        for percentile in (50, 95, 99)
+    }
+
+
+def start_process(args: list[str], env: dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, *args],
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_ready(url: str, timeout: float = 30, path: str = "/health"):
+    """Poll path, the proxy's `/ready` tells when its warm-up is done."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                response = await client.get(f"{url}{path}")
+                if response.status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{url} is not ready")
+            await asyncio.sleep(0.2)
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: list[dict[str, Any]]):
+    print(
+        f"{'scenario':>20} {'rps':>8} {'ttfb p50/p95/p99 (ms)':>24} "
+        f"{'latency p50/p95/p99 (ms)':>27} {'cpu (s)':>8} {'rss (MB)':>9} "
+        f"{'errors':>7}"
+    )
+    for result in results:
+        cpu_time = result["cpu_time"]
+        memory_kb = result["memory_kb"]
+        rss_mb = None if memory_kb is None else memory_kb["rss"] / 1024
+        print(
+            f"{result['name']:>20} {result['rps']:>8.1f} "
+            f"{_format_percentiles(result['ttfb']):>24} "
+            f"{_format_percentiles(result['latency']):>27} "
+            f"{'-' if cpu_time is None else f'{cpu_time:.2f}':>8} "
+            f"{'-' if rss_mb is None else f'{rss_mb:.1f}':>9} "
+            f"{result['error_count']:>7}"
+        )
+
+
+def _format_percentiles(percentiles: dict[str, float | None]) -> str:
+    return "/".join(
+        "-" if value is None else f"{value * 1000:.0f}"
+        for value in percentiles.values()
+    )
+
+
+async def main(args: argparse.Namespace):
+    scenarios = [
+        scenario
+        for scenario in SCENARIOS
+        if len(args.scenario) == 0 or scenario.name in args.scenario
+    ]
+    processes = []
+    proxy_url = args.proxy_url
+    usage = ProcessUsage(None)
+    try:
+        if proxy_url is None:
+            mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+            proxy_url = f"http://127.0.0.1:{PROXY_PORT}"
+            mock_args = [
+                "-m",
+                "benchmark.mock_upstream",
+                f"--port={MOCK_PORT}",
+                f"--latency={args.mock_latency}",
+                f"--response-tokens={args.mock_response_tokens}",
+                f"--token-rate={args.mock_token_rate}",
+                f"--tokens-per-chunk={args.mock_tokens_per_chunk}",
+            ]
+            processes.append(start_process(mock_args, {}))
+            await wait_until_ready(mock_url)
+            cache_dir = tempfile.mkdtemp(prefix="proxy-load-test-")
+            proxy_env = {
+                "PROXY_HTTP_PORT": str(PROXY_PORT),
+                "PROXY_LLM_API_URL": mock_url,
+                "PROXY_LLM_API_KEY": "load-test",
+                # The mock answers summarization calls like chat completions
+                "PROXY_SUMMARIZATION_API_URL": mock_url,
+                "PROXY_EMBEDDING_API_URL": mock_url,
+                "PROXY_CACHE_DISK_PATH": os.path.join(cache_dir, "cache.db"),
+                "PROXY_SEMANTIC_CACHE_DIR": os.path.join(cache_dir, "semantic"),
+            }
+            proxy = start_process(["main.py"], proxy_env)
+            processes.append(proxy)
+            usage = ProcessUsage(proxy.pid)
+            await wait_until_ready(proxy_url, path="/ready")
+        results = []
+        for scenario in scenarios:
+            results.append(await run_scenario(proxy_url, scenario, usage))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+    print_results(results)
+    if args.output is not None:
+        report = {
+            "commit": get_commit(),
+            "timestamp": time.time(),
+            "mock": {
+                "latency": args.mock_latency,
+                "response_tokens": args.mock_response_tokens,
+                "token_rate": args.mock_token_rate,
+                "tokens_per_chunk": args.mock_tokens_per_chunk,
+            },
+            "scenarios": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        default=[],
+        choices=[scenario.name for scenario in SCENARIOS],
+    )
+    parser.add_argument("--proxy-url", default=None)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--mock-latency", type=float, default=0.05)
+    parser.add_argument("--mock-response-tokens", type=int, default=200)
+    parser.add_argument("--mock-token-rate", type=float, default=2000)
+    parser.add_argument("--mock-tokens-per-chunk", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
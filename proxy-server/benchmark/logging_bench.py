@@ -0,0 +1,80 @@
+"""
+Benchmark for the time logging takes on the event loop.
+Compare the legacy path (json.dumps on every call, formatting and writing on
+the caller thread) with LazyJson records handed to the logging thread.
+Run from `proxy-server` directory: `python -m benchmark.logging_bench`
+"""
+
+import json
+import logging
+import os
+import time
+
+from log_util import (
+    LazyJson,
+    RedactingFormatter,
+    handler,
+    logger,
+    queue_handler,
+    stop_log_listener,
+)
+
+CALL_COUNT = 2000
+TURNS = 100
+
+
+def create_payload() -> dict:
+    return {
+        "contents": [
+            {"role": "user", "parts": [{"text": f"Tool output {turn}: " + "x" * 500}]}
+            for turn in range(TURNS)
+        ]
+    }
+
+
+def measure(log_message, level: int) -> float:
+    logger.setLevel(level)
+    payload = create_payload()
+    start = time.perf_counter()
+    for _ in range(CALL_COUNT):
+        log_message(payload)
+    return (time.perf_counter() - start) / CALL_COUNT * 1_000_000
+
+
+def legacy_debug(payload: dict):
+    logger.debug(json.dumps({"event": "start_redirection", "data": payload}))
+
+
+def lazy_debug(payload: dict):
+    logger.debug(LazyJson({"event": "start_redirection", "data": payload}))
+
+
+def legacy_info(payload: dict):
+    logger.info(json.dumps({"event": "full_response_body", "data": payload}))
+
+
+def lazy_info(payload: dict):
+    logger.info(LazyJson({"event": "full_response_body", "data": payload}))
+
+
+if __name__ == "__main__":
+    with open(os.devnull, "w") as devnull:
+        handler.setStream(devnull)
+        legacy_handler = logging.StreamHandler(devnull)
+        legacy_handler.setFormatter(RedactingFormatter("%(message)s"))
+        print(f"{'case':>18} {'legacy (us/call)':>18} {'lazy (us/call)':>16}")
+        for case, level, legacy_fn, lazy_fn in (
+            ("debug, level INFO", logging.INFO, legacy_debug, lazy_debug),
+            ("info, level INFO", logging.INFO, legacy_info, lazy_info),
+        ):
+            # Legacy: synchronous handler on the caller thread
+            logger.removeHandler(queue_handler)
+            logger.addHandler(legacy_handler)
+            legacy_us = measure(legacy_fn, level)
+            logger.removeHandler(legacy_handler)
+            # Lazy: only enqueueing happens on the caller thread
+            logger.addHandler(queue_handler)
+            lazy_us = measure(lazy_fn, level)
+            print(f"{case:>18} {legacy_us:>18.1f} {lazy_us:>16.1f}")
+        # Write pending records before devnull is closed
+        stop_log_listener()
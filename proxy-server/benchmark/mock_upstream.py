@@ -0,0 +1,412 @@
+"""
+Local mock of Gemini/OpenAI compatible upstreams.
+It can inject latency, stalls and errors, and generate responses of a given size at
+a given token rate, so the proxy can be exercised without spending real API
+quota. Gemini cachedContents endpoints are implemented in memory. With `--gzip`,
+responses are compressed for clients accepting gzip. With `--trace`, requests
+take as long as the captured upstream took (see traffic_capture.py).
+Run from `proxy-server` directory:
+`python -m benchmark.mock_upstream --port 9001 --latency 0.2 --error-rate 0.1`
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import time
+from typing import Any
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+class TraceTimings:
+    """
+    Upstream timings of captured traffic, by route. A request gets the timings
+    of the captured request of the same route with the closest size, so
+    smaller (e.g., summarized) prompts get the timings of smaller prompts.
+    """
+
+    def __init__(self, records: list[dict[str, Any]]):
+        self.timings: dict[str, list[dict[str, Any]]] = {}
+        for record in records:
+            upstream = record.get("upstream")
+            if upstream is None and record.get("source") == "embedding_batch":
+                # Batches are not timed by request, the proxy duration is close
+                upstream = {
+                    "status_code": record["status_code"],
+                    "request_bytes": len(record["body"]),
+                    "ttfb": record["duration"],
+                    "duration": record["duration"],
+                }
+            if upstream is None or "duration" not in upstream:
+                continue
+            self.timings.setdefault(record["route"], []).append(upstream)
+        for timings in self.timings.values():
+            timings.sort(key=_get_request_bytes)
+        self.sizes = {
+            route: [_get_request_bytes(timing) for timing in timings]
+            for route, timings in self.timings.items()
+        }
+
+    def get(self, route: str, request_bytes: int) -> dict[str, Any] | None:
+        if route not in self.timings:
+            return None
+        sizes = self.sizes[route]
+        index = bisect.bisect_left(sizes, request_bytes)
+        if index == len(sizes) or (
+            index > 0
+            and request_bytes - sizes[index - 1] < sizes[index] - request_bytes
+        ):
+            index -= 1
+        return self.timings[route][index]
+
+
+class MockConfig:
+    def __init__(
+        self,
+        latency: float = 0,
+        error_rate: float = 0,
+        error_status: int = 500,
+        response_tokens: int = 4,
+        token_rate: float = 0,
+        tokens_per_chunk: int = 1,
+        serial: bool = False,
+        prefill_rate: float = 0,
+        stall_rate: float = 0,
+        stall_duration: float = 5,
+        gzip: bool = False,
+        trace_timings: TraceTimings | None = None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.response_tokens = response_tokens
+        # Streamed tokens per second, 0 means as fast as possible
+        self.token_rate = token_rate
+        self.tokens_per_chunk = tokens_per_chunk
+        # Handle one request at a time, like a local model server (e.g., Ollama)
+        self.serial = serial
+        # Prompt tokens processed per second, 0 means no prompt dependent delay
+        self.prefill_rate = prefill_rate
+        # Fraction of requests stalled for stall_duration seconds
+        self.stall_rate = stall_rate
+        self.stall_duration = stall_duration
+        self.gzip = gzip
+        self.trace_timings = trace_timings
+
+    def get_text(self) -> str:
+        words = ["Hello", "from", "mock", "upstream"]
+        return " ".join(words[i % len(words)] for i in range(self.response_tokens))
+
+    def get_chunks(self) -> list[str]:
+        words = self.get_text().split(" ")
+        step = max(self.tokens_per_chunk, 1)
+        return [
+            " ".join(words[start : start + step])
+            for start in range(0, len(words), step)
+        ]
+
+    async def wait_for_prefill(self, prompt_tokens: int):
+        if self.prefill_rate > 0:
+            await asyncio.sleep(prompt_tokens / self.prefill_rate)
+
+    async def wait_for_chunk(self, chunk: str, delay: float | None = None):
+        if delay is not None:
+            await asyncio.sleep(delay)
+        elif self.token_rate > 0:
+            await asyncio.sleep(len(chunk.split(" ")) / self.token_rate)
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI()
+    if config.gzip:
+        app.add_middleware(GZipMiddleware, minimum_size=500)
+    app.state.request_count = 0
+    # Uncached prompt tokens processed by generation requests
+    app.state.prompt_tokens = 0
+    # name -> {"payload_tokens": ..., "expire_time": ...}, cachedContents API
+    app.state.cached_contents = {}
+    serial_lock = asyncio.Lock()
+
+    async def maybe_fail() -> Response | None:
+        app.state.request_count += 1
+        if config.serial:
+            async with serial_lock:
+                await asyncio.sleep(config.latency)
+        elif config.latency > 0:
+            await asyncio.sleep(config.latency)
+        if random.random() < config.stall_rate:
+            await asyncio.sleep(config.stall_duration)
+        if random.random() >= config.error_rate:
+            return None
+        headers = {"Retry-After": "1"} if config.error_status == 429 else {}
+        return JSONResponse(
+            {"error": {"code": config.error_status, "message": "Injected error"}},
+            status_code=config.error_status,
+            headers=headers,
+        )
+
+    async def replay_trace(
+        route: str, request: Request, stream: bool
+    ) -> tuple[Response | None, float | None]:
+        """
+        Wait as long as the captured upstream took to answer (its first chunk
+        if streamed). Return the captured error response if any, and the delay
+        between streamed chunks. Return (None, None) if there is no timing.
+        """
+        if config.trace_timings is None:
+            return None, None
+        timing = config.trace_timings.get(route, len(await request.body()))
+        if timing is None:
+            return None, None
+        await asyncio.sleep(timing["ttfb"] if stream else timing["duration"])
+        if timing["status_code"] >= 400:
+            return (
+                JSONResponse(
+                    {"error": {"code": timing["status_code"], "message": "Captured"}},
+                    status_code=timing["status_code"],
+                ),
+                None,
+            )
+        stream_duration = max(timing["duration"] - timing["ttfb"], 0)
+        return None, stream_duration / max(len(config.get_chunks()), 1)
+
+    @app.get("/health")
+    async def get_health():
+        return JSONResponse(
+            {
+                "status": "ok",
+                "request_count": app.state.request_count,
+                "prompt_tokens": app.state.prompt_tokens,
+                "cached_content_count": len(app.state.cached_contents),
+            }
+        )
+
+    @app.post("/v1beta/models/{model_action}")
+    async def generate_content(model_action: str, request: Request):
+        error_response = await maybe_fail()
+        if error_response is not None:
+            return error_response
+        payload = await request.json()
+        cached_tokens = 0
+        if "cachedContent" in payload:
+            cached_content = _get_cached_content(payload["cachedContent"])
+            if cached_content is None:
+                return _cached_content_not_found()
+            cached_tokens = cached_content["token_count"]
+        # Cached tokens are already processed
+        prompt_tokens = len(json.dumps(payload)) // 4
+        app.state.prompt_tokens += prompt_tokens
+        stream = model_action.endswith(":streamGenerateContent")
+        trace_response, chunk_delay = await replay_trace(
+            model_action.rsplit(":", 1)[-1], request, stream
+        )
+        if trace_response is not None:
+            return trace_response
+        if chunk_delay is None:
+            await config.wait_for_prefill(prompt_tokens)
+        usage = {
+            "promptTokenCount": prompt_tokens + cached_tokens,
+            "cachedContentTokenCount": cached_tokens,
+            "candidatesTokenCount": config.response_tokens,
+            "totalTokenCount": prompt_tokens + cached_tokens + config.response_tokens,
+        }
+        if stream:
+
+            async def event_stream():
+                chunks = config.get_chunks()
+                for index, text in enumerate(chunks):
+                    await config.wait_for_chunk(text, chunk_delay)
+                    chunk = {"candidates": [{"content": _gemini_content(text)}]}
+                    if index == len(chunks) - 1:
+                        chunk["usageMetadata"] = usage
+                    yield f"data: {json.dumps(chunk)}\r\n\r\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+        text = config.get_text()
+        return JSONResponse(
+            {"candidates": [{"content": _gemini_content(text)}], "usageMetadata": usage}
+        )
+
+    def _get_cached_content(name: str) -> dict | None:
+        cached_content = app.state.cached_contents.get(name)
+        if cached_content is None or cached_content["expire_time"] < time.time():
+            app.state.cached_contents.pop(name, None)
+            return None
+        return cached_content
+
+    def _cached_content_not_found() -> JSONResponse:
+        return JSONResponse(
+            {
+                "error": {
+                    "code": 403,
+                    "message": "CachedContent not found (or permission denied)",
+                }
+            },
+            status_code=403,
+        )
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cached_content(request: Request):
+        payload = await request.json()
+        ttl = float(payload.pop("ttl", "3600s").rstrip("s"))
+        name = f"cachedContents/mock-{len(app.state.cached_contents)}-{time.time_ns()}"
+        token_count = len(json.dumps(payload)) // 4
+        app.state.cached_contents[name] = {
+            "token_count": token_count,
+            "expire_time": time.time() + ttl,
+        }
+        return JSONResponse(
+            {
+                "name": name,
+                "model": payload.get("model"),
+                "usageMetadata": {"totalTokenCount": token_count},
+            }
+        )
+
+    @app.patch("/v1beta/cachedContents/{cached_content_id}")
+    async def update_cached_content(cached_content_id: str, request: Request):
+        cached_content = _get_cached_content(f"cachedContents/{cached_content_id}")
+        if cached_content is None:
+            return _cached_content_not_found()
+        payload = await request.json()
+        ttl = float(payload.get("ttl", "3600s").rstrip("s"))
+        cached_content["expire_time"] = time.time() + ttl
+        return JSONResponse({"name": f"cachedContents/{cached_content_id}"})
+
+    @app.delete("/v1beta/cachedContents/{cached_content_id}")
+    async def delete_cached_content(cached_content_id: str):
+        name = f"cachedContents/{cached_content_id}"
+        if app.state.cached_contents.pop(name, None) is None:
+            return _cached_content_not_found()
+        return JSONResponse({})
+
+    @app.post("/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        error_response = await maybe_fail()
+        if error_response is not None:
+            return error_response
+        payload = await request.json()
+        prompt_tokens = len(json.dumps(payload)) // 4
+        app.state.prompt_tokens += prompt_tokens
+        stream = payload.get("stream", False)
+        trace_response, chunk_delay = await replay_trace(
+            "chat_completions_stream" if stream else "chat_completions",
+            request,
+            stream,
+        )
+        if trace_response is not None:
+            return trace_response
+        if chunk_delay is None:
+            await config.wait_for_prefill(prompt_tokens)
+        if stream:
+
+            async def event_stream():
+                for text in config.get_chunks():
+                    await config.wait_for_chunk(text, chunk_delay)
+                    chunk = {"choices": [{"index": 0, "delta": {"content": text}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(event_stream(), media_type="text/event-stream")
+        text = config.get_text()
+        return JSONResponse(
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "mock"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": config.response_tokens,
+                    "total_tokens": prompt_tokens + config.response_tokens,
+                },
+            }
+        )
+
+    @app.post("/embeddings")
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        error_response = await maybe_fail()
+        if error_response is not None:
+            return error_response
+        trace_response, _ = await replay_trace("embeddings", request, False)
+        if trace_response is not None:
+            return trace_response
+        payload = await request.json()
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return JSONResponse(
+            {
+                "data": [
+                    {"index": index, "embedding": _fake_embedding(text)}
+                    for index, text in enumerate(inputs)
+                ]
+            }
+        )
+
+    return app
+
+
+def _gemini_content(text: str) -> dict:
+    return {"role": "model", "parts": [{"text": text}]}
+
+
+def _get_request_bytes(timing: dict[str, Any]) -> int:
+    return timing["request_bytes"]
+
+
+def _fake_embedding(text: str) -> list[float]:
+    rng = random.Random(text)
+    return [rng.uniform(-1, 1) for _ in range(8)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--response-tokens", type=int, default=4)
+    parser.add_argument("--token-rate", type=float, default=0)
+    parser.add_argument("--tokens-per-chunk", type=int, default=1)
+    parser.add_argument("--serial", action="store_true")
+    parser.add_argument("--prefill-rate", type=float, default=0)
+    parser.add_argument("--stall-rate", type=float, default=0)
+    parser.add_argument("--stall-duration", type=float, default=5)
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--trace", help="Traffic capture file to take timings from")
+    args = parser.parse_args()
+    trace_timings = None
+    if args.trace is not None:
+        from traffic_capture import read_traffic_records
+
+        trace_timings = TraceTimings(read_traffic_records(args.trace))
+    mock_config = MockConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        response_tokens=args.response_tokens,
+        token_rate=args.token_rate,
+        tokens_per_chunk=args.tokens_per_chunk,
+        serial=args.serial,
+        prefill_rate=args.prefill_rate,
+        stall_rate=args.stall_rate,
+        stall_duration=args.stall_duration,
+        gzip=args.gzip,
+        trace_timings=trace_timings,
+    )
+    uvicorn.run(create_app(mock_config), host="0.0.0.0", port=args.port)
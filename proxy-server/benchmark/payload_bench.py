@@ -0,0 +1,88 @@
+"""
+Benchmark for the request payload pipeline.
+Compare the legacy pipeline (json parse, deepcopy, alteration, json.dumps)
+with the copy-on-write pipeline (json_util parse, shallow copy, alteration,
+json_util.dumps) and with raw-body passthrough (parse only, original bytes
+are forwarded).
+Run from `proxy-server` directory: `python -m benchmark.payload_bench`
+"""
+
+import json
+import time
+from copy import deepcopy
+
+import json_util
+from payload_util import maybe_inject_alignment
+
+PAYLOAD_SIZES = [100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+REPEAT = 5
+
+
+def create_body(size: int) -> bytes:
+    contents = []
+    turn = 0
+    while len(contents) * 1100 < size:
+        contents.append({"role": "user", "parts": [{"text": f"Question {turn}"}]})
+        contents.append(
+            {
+                "role": "model",
+                "parts": [{"text": f"Tool output {turn}: " + "lorem ipsum " * 85}],
+            }
+        )
+        turn += 1
+    payload = {
+        "systemInstruction": {"parts": [{"text": "You are a helpful assistant"}]},
+        "contents": contents,
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def legacy_pipeline(body: bytes) -> bytes:
+    payload = deepcopy(json.loads(body))
+    payload = maybe_inject_alignment(payload)
+    return json.dumps(payload).encode("utf-8")
+
+
+def copy_on_write_pipeline(body: bytes) -> bytes:
+    payload = dict(json_util.loads(body))
+    payload = maybe_inject_alignment(payload)
+    return json_util.dumps(payload)
+
+
+def passthrough_pipeline(body: bytes) -> bytes:
+    json_util.loads(body)
+    return body
+
+
+def measure(fn, body: bytes) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(body)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.0f} MB"
+    return f"{size / 1024:.0f} KB"
+
+
+if __name__ == "__main__":
+    codec = "orjson" if json_util.orjson is not None else "json"
+    print(f"JSON codec: {codec}")
+    print(
+        f"{'payload':>8} {'legacy (ms)':>12} {'copy-on-write (ms)':>19} "
+        f"{'passthrough (ms)':>17}"
+    )
+    pipelines = (legacy_pipeline, copy_on_write_pipeline, passthrough_pipeline)
+    for size in PAYLOAD_SIZES:
+        body = create_body(size)
+        legacy_ms, copy_on_write_ms, passthrough_ms = [
+            measure(pipeline, body) for pipeline in pipelines
+        ]
+        print(
+            f"{format_size(size):>8} {legacy_ms:>12.2f} {copy_on_write_ms:>19.2f} "
+            f"{passthrough_ms:>17.2f}"
+        )
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark for summary prefix lookup.
+Run from `proxy-server` directory: `python -m benchmark.prefix_index_bench`
+"""
+
+import hashlib
+import json
+import time
+from typing import Any
+
+from cache.lru_cache import LRUCache
+from prefix_index import PrefixIndex
+
+TURNS = [10, 100, 1000]
+REPEAT = 5
+
+
+def create_conversation(turns: int) -> list[dict[str, Any]]:
+    conversation = []
+    for index in range(turns):
+        conversation.append(
+            {"role": "user", "parts": [{"text": f"Question number {index}"}]}
+        )
+        conversation.append(
+            {
+                "role": "model",
+                "parts": [{"text": f"Tool output {index}: " + "lorem ipsum " * 50}],
+            }
+        )
+    return conversation
+
+
+def legacy_get_summarization_pivot(contents: list[Any], cache: LRUCache) -> int:
+    pivot = len(contents)
+    while pivot > 0:
+        content_str = json.dumps(contents[:pivot])
+        key = hashlib.md5(content_str.encode("utf-8")).hexdigest()
+        if cache.key_exists(key):
+            return pivot
+        pivot -= 1
+    return pivot
+
+
+def prefix_index_get_summarization_pivot(contents: list[Any], cache: LRUCache) -> int:
+    return PrefixIndex(contents).find_longest_cached_prefix(cache)
+
+
+def measure(fn, contents: list[Any], cache: LRUCache) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(contents, cache)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+if __name__ == "__main__":
+    # Empty cache is the worst case: every prefix has to be checked.
+    cache = LRUCache(100)
+    print(f"{'turns':>6} {'legacy (ms)':>14} {'prefix index (ms)':>18}")
+    for turns in TURNS:
+        contents = create_conversation(turns)
+        legacy_ms = measure(legacy_get_summarization_pivot, contents, cache)
+        indexed_ms = measure(prefix_index_get_summarization_pivot, contents, cache)
+        print(f"{turns:>6} {legacy_ms:>14.3f} {indexed_ms:>18.3f}")
@@ -0,0 +1,197 @@
+"""
+Benchmark for proxy cold start.
+Measure how long `import main` takes in fresh interpreters, and list the
+slowest imports. Then start the proxy in front of a mock upstream several
+times, and measure how long after spawning it answers /health (liveness),
+/ready (caches and upstream connections warm), and serves a first chat
+completion request.
+Exit with an error when the import time exceeds `--import-budget`, so the
+benchmark can guard against heavy imports creeping back into the startup.
+Run from `proxy-server` directory: `python -m benchmark.startup_bench`
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from benchmark.load_test import (
+    MOCK_PORT,
+    PROXY_PORT,
+    get_commit,
+    get_percentiles,
+    start_process,
+    wait_until_ready,
+)
+
+_MOCK_URL = f"http://127.0.0.1:{MOCK_PORT}"
+_PROXY_URL = f"http://127.0.0.1:{PROXY_PORT}"
+_POLL_INTERVAL = 0.01
+
+
+def get_proxy_env(cache_dir: str) -> dict[str, str]:
+    return {
+        "PROXY_HTTP_PORT": str(PROXY_PORT),
+        "PROXY_LLM_API_URL": _MOCK_URL,
+        "PROXY_LLM_API_KEY": "startup-bench",
+        "PROXY_EMBEDDING_API_URL": _MOCK_URL,
+        "PROXY_CACHE_DISK_PATH": os.path.join(cache_dir, "cache.db"),
+        "PROXY_SEMANTIC_CACHE_DIR": os.path.join(cache_dir, "semantic"),
+    }
+
+
+def measure_import_time(env: dict[str, str]) -> float:
+    code = (
+        "import time\n"
+        "start_time = time.perf_counter()\n"
+        "import main\n"
+        "print(time.perf_counter() - start_time)\n"
+    )
+    output = subprocess.check_output(
+        [sys.executable, "-c", code],
+        env={**os.environ, **env},
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return float(output.strip().splitlines()[-1])
+
+
+def get_slowest_imports(env: dict[str, str], count: int) -> list[tuple[str, float]]:
+    """
+    Packages by cumulative import time (`python -X importtime`), a package
+    includes the packages it imports first (e.g., fastapi includes pydantic).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if "." not in name and name != "main":
+            imports.append((name, int(parts[1]) / 1_000_000))
+    imports.sort(key=_get_duration, reverse=True)
+    return imports[:count]
+
+
+async def wait_for(
+    client: httpx.AsyncClient, method: str, path: str, start_time: float, **kwargs
+) -> float:
+    """Return seconds from start_time until the request succeeds."""
+    while True:
+        try:
+            response = await client.request(method, f"{_PROXY_URL}{path}", **kwargs)
+            if response.status_code == 200:
+                return time.perf_counter() - start_time
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(_POLL_INTERVAL)
+
+
+async def measure_startup(env: dict[str, str]) -> dict[str, float]:
+    chat_request = {
+        "model": "mock",
+        "messages": [{"role": "user", "content": "Hello"}],
+    }
+    async with httpx.AsyncClient(timeout=30) as client:
+        start_time = time.perf_counter()
+        process = start_process(["main.py"], env)
+        try:
+            health, ready, first_request = await asyncio.wait_for(
+                asyncio.gather(
+                    wait_for(client, "GET", "/health", start_time),
+                    wait_for(client, "GET", "/ready", start_time),
+                    wait_for(
+                        client,
+                        "POST",
+                        "/v1/chat/completions",
+                        start_time,
+                        json=chat_request,
+                    ),
+                ),
+                60,
+            )
+        finally:
+            process.terminate()
+            process.wait()
+    return {"health": health, "ready": ready, "first_request": first_request}
+
+
+def _get_duration(item: tuple[str, float]) -> float:
+    return item[1]
+
+
+def _format_percentiles(values: list[float]) -> str:
+    percentiles = get_percentiles(values)
+    return f"{percentiles['p50'] * 1000:.0f}/{percentiles['p99'] * 1000:.0f}"
+
+
+async def main(args: argparse.Namespace) -> int:
+    cache_dir = tempfile.mkdtemp(prefix="proxy-startup-bench-")
+    env = get_proxy_env(cache_dir)
+    import_times = [measure_import_time(env) for _ in range(args.imports)]
+    import_time = get_percentiles(import_times)["p50"]
+    print(f"import main p50/p99 (ms): {_format_percentiles(import_times)}")
+    print("Slowest imports (ms):")
+    for name, duration in get_slowest_imports(env, args.top):
+        print(f"{duration * 1000:>8.0f} {name}")
+    mock_args = ["-m", "benchmark.mock_upstream", f"--port={MOCK_PORT}"]
+    mock_process = start_process(mock_args, {})
+    try:
+        await wait_until_ready(_MOCK_URL)
+        startups = [await measure_startup(env) for _ in range(args.starts)]
+    finally:
+        mock_process.terminate()
+        mock_process.wait()
+    print(f"{args.starts} starts, p50/p99 (ms) from spawn")
+    for key in ("health", "ready", "first_request"):
+        values = [startup[key] for startup in startups]
+        print(f"{key:>14} {_format_percentiles(values):>12}")
+    if args.output is not None:
+        report = {
+            "commit": get_commit(),
+            "timestamp": time.time(),
+            "import_time": get_percentiles(import_times),
+            "startup": {
+                key: get_percentiles([startup[key] for startup in startups])
+                for key in ("health", "ready", "first_request")
+            },
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.import_budget > 0 and import_time > args.import_budget:
+        print(
+            f"import main took {import_time * 1000:.0f} ms, "
+            f"over the {args.import_budget * 1000:.0f} ms budget"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--imports", type=int, default=5)
+    parser.add_argument("--starts", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=0,
+        help="Maximum seconds of `import main`, 0 means no budget",
+    )
+    parser.add_argument("--output")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,91 @@
+"""
+Benchmark for streamed response forwarding.
+Compare the legacy text streaming path (10 characters per chunk, string
+concatenation, disconnection check on every chunk) with the byte-level path
+in response_util.create_streamed_response.
+Run from `proxy-server` directory: `python -m benchmark.streaming_bench`
+"""
+
+import asyncio
+import json
+import logging
+import time
+import tracemalloc
+
+import httpx
+from log_util import logger
+from response_util import create_streamed_response
+
+EVENT_COUNT = 2000
+EVENT_SIZE = 500
+NETWORK_CHUNK_SIZE = 4096
+
+
+class FakeRequest:
+    async def is_disconnected(self) -> bool:
+        await asyncio.sleep(0)
+        return False
+
+
+class UpstreamStream(httpx.AsyncByteStream):
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def __aiter__(self):
+        for start in range(0, len(self.body), NETWORK_CHUNK_SIZE):
+            yield self.body[start : start + NETWORK_CHUNK_SIZE]
+
+
+def create_upstream_response() -> httpx.Response:
+    event = json.dumps({"text": "x" * EVENT_SIZE})
+    body = "".join(f"data: {event}\r\n\r\n" for _ in range(EVENT_COUNT)).encode()
+    return httpx.Response(
+        200,
+        headers={"Content-Type": "text/event-stream"},
+        stream=UpstreamStream(body),
+    )
+
+
+async def legacy_stream(request: FakeRequest, original_response: httpx.Response):
+    full_content = ""
+    async for chunk in original_response.aiter_text(chunk_size=10):
+        yield chunk
+        full_content += chunk
+        if await request.is_disconnected():
+            break
+    await original_response.aclose()
+
+
+async def byte_stream(request: FakeRequest, original_response: httpx.Response):
+    response = await create_streamed_response(request, original_response)
+    async for chunk in response.body_iterator:
+        yield chunk
+
+
+async def measure(stream_factory) -> tuple[float, float, int]:
+    # Upstream body is not part of the measurement
+    upstream_response = create_upstream_response()
+    tracemalloc.start()
+    cpu_start = time.process_time()
+    write_count = 0
+    async for _ in stream_factory(FakeRequest(), upstream_response):
+        write_count += 1
+    cpu_time = time.process_time() - cpu_start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_time * 1000, peak_memory / 1024, write_count
+
+
+async def main():
+    # Keep the benchmark output readable
+    logger.setLevel(logging.WARNING)
+    size_kb = EVENT_COUNT * EVENT_SIZE / 1024
+    print(f"Stream of {EVENT_COUNT} events (~{size_kb:.0f} KB)")
+    print(f"{'path':>8} {'cpu (ms)':>10} {'peak memory (KB)':>18} {'writes':>8}")
+    for name, stream_factory in (("legacy", legacy_stream), ("bytes", byte_stream)):
+        cpu_ms, peak_kb, write_count = await measure(stream_factory)
+        print(f"{name:>8} {cpu_ms:>10.1f} {peak_kb:>18.1f} {write_count:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+"""
+Benchmark for conversation summarization.
+The summarizer is the mock upstream (OpenAI compatible), its latency grows
+with the prompt size (`--prefill-rate` prompt tokens per second).
+1. Cold: summarize sessions of growing length from scratch.
+2. Incremental: grow one session and summarize it every `--gap` messages.
+Compare the flat scheme (previous summary and the whole unsummarized block
+in one call) with SummaryTree (segments summarized in parallel, then merged).
+3. Coalesced: concurrent requests sharing a prefix but not their last turn
+share one summarization and keep their own last turn, exit with an error
+otherwise.
+Run from `proxy-server` directory: `python -m benchmark.summary_bench`
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any
+
+from benchmark.load_test import MOCK_PORT, start_process, wait_until_ready
+
+SESSION_LENGTHS = [50, 200, 800]
+INCREMENTAL_SESSION_LENGTH = 400
+
+
+def create_session(name: str, length: int) -> list[dict[str, Any]]:
+    contents = []
+    for index in range(length // 2):
+        contents.append(
+            {"role": "user", "parts": [{"text": f"{name} question {index}"}]}
+        )
+        contents.append(
+            {
+                "role": "model",
+                "parts": [{"text": f"{name} tool output {index}: " + "lorem " * 150}],
+            }
+        )
+    return contents
+
+
+async def summarize_flat(
+    previous_summary: str, conversation: list[dict[str, Any]]
+) -> tuple[str, dict[str, int]]:
+    from summarizer import get_summarizer
+
+    conversation_str = json.dumps(conversation)
+    summary, usage = await get_summarizer().summarize(
+        (
+            f"Previous conversation: {previous_summary}",
+            f"Recent conversation: {conversation_str}",
+            "Summarize the conversation into a single paragraph",
+        ),
+        conversation_str,
+    )
+    return summary, {
+        "calls": 1,
+        "request_tokens": usage["request_tokens"],
+        "max_call_request_tokens": usage["request_tokens"],
+    }
+
+
+async def summarize_tree(
+    previous_summary: str, conversation: list[dict[str, Any]], start: int, end: int
+) -> tuple[str, dict[str, int]]:
+    from config import (
+        SUMMARIZATION_MAX_PARALLEL_CALLS,
+        SUMMARIZATION_MERGE_FANOUT,
+        SUMMARIZATION_SEGMENT_TOKENS,
+    )
+    from prefix_index import PrefixIndex
+    from summary_tree import SummaryTree
+
+    summary_tree = SummaryTree(
+        PrefixIndex(conversation[:end]),
+        SUMMARIZATION_SEGMENT_TOKENS,
+        SUMMARIZATION_MERGE_FANOUT,
+        SUMMARIZATION_MAX_PARALLEL_CALLS,
+    )
+    summary, _ = await summary_tree.summarize(previous_summary, start, end)
+    return summary, summary_tree.usage
+
+
+def print_row(name: str, scheme: str, usage: dict[str, int], duration: float):
+    print(
+        f"{name:>14} {scheme:>6} {usage['calls']:>6} "
+        f"{usage['max_call_request_tokens']:>16} {usage['request_tokens']:>15} "
+        f"{duration:>9.2f}"
+    )
+
+
+async def run_cold():
+    for length in SESSION_LENGTHS:
+        name = f"cold {length}"
+        start = time.perf_counter()
+        _, usage = await summarize_flat("<Empty>", create_session("flat", length))
+        print_row(name, "flat", usage, time.perf_counter() - start)
+        start = time.perf_counter()
+        _, usage = await summarize_tree(
+            "<Empty>", create_session("tree", length), 0, length
+        )
+        print_row(name, "tree", usage, time.perf_counter() - start)
+
+
+async def run_incremental(gap: int):
+    for scheme in ("flat", "tree"):
+        conversation = create_session(f"gap {gap} {scheme}", INCREMENTAL_SESSION_LENGTH)
+        summary = "<Empty>"
+        total = {"calls": 0, "request_tokens": 0, "max_call_request_tokens": 0}
+        start = time.perf_counter()
+        for end in range(gap, len(conversation) + 1, gap):
+            if scheme == "flat":
+                summary, usage = await summarize_flat(
+                    summary, conversation[end - gap : end]
+                )
+            else:
+                summary, usage = await summarize_tree(
+                    summary, conversation, end - gap, end
+                )
+            total["calls"] += usage["calls"]
+            total["request_tokens"] += usage["request_tokens"]
+            total["max_call_request_tokens"] = max(
+                total["max_call_request_tokens"], usage["max_call_request_tokens"]
+            )
+        print_row(f"gap {gap}", scheme, total, time.perf_counter() - start)
+
+
+async def check_coalesced_tails() -> bool:
+    from payload_util import summarization_flight, summarize_and_store
+    from prefix_index import PrefixIndex
+
+    prefix = create_session("coalesced", 50)
+    conversations = [
+        [*prefix, {"role": "user", "parts": [{"text": f"Question {name}"}]}]
+        for name in ("A", "B")
+    ]
+    calls = summarization_flight.calls
+    results = await asyncio.gather(
+        *[
+            summarize_and_store("<Empty>", conversation, PrefixIndex(conversation))
+            for conversation in conversations
+        ]
+    )
+    is_tail_kept = all(
+        retained_conversation[-1] is conversation[-1]
+        for conversation, (_, retained_conversation) in zip(conversations, results)
+    )
+    calls = summarization_flight.calls - calls
+    print(f"coalesced: {calls} summarization(s), tails kept: {is_tail_kept}")
+    return is_tail_kept and calls == 1
+
+
+async def main(args: argparse.Namespace) -> int:
+    mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+    # Summarizer settings are read when config is imported
+    os.environ["PROXY_SUMMARIZATION_API_URL"] = mock_url
+    os.environ["PROXY_SUMMARIZATION_API_KEY"] = "summary-bench"
+    os.environ["PROXY_CACHE_BACKEND"] = "lru"
+    mock_args = [
+        "-m",
+        "benchmark.mock_upstream",
+        f"--port={MOCK_PORT}",
+        f"--latency={args.mock_latency}",
+        f"--prefill-rate={args.prefill_rate}",
+    ]
+    process = start_process(mock_args, {})
+    try:
+        await wait_until_ready(mock_url)
+        print(
+            f"{'session':>14} {'scheme':>6} {'calls':>6} "
+            f"{'max call tokens':>16} {'total tokens':>15} {'time (s)':>9}"
+        )
+        await run_cold()
+        for gap in args.gap:
+            await run_incremental(gap)
+        is_coalesced = await check_coalesced_tails()
+    finally:
+        process.terminate()
+        process.wait()
+    return 0 if is_coalesced else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mock-latency", type=float, default=0.05)
+    parser.add_argument("--prefill-rate", type=float, default=20000)
+    parser.add_argument("--gap", type=int, nargs="+", default=[4, 20, 100])
+    sys.exit(asyncio.run(main(parser.parse_args())))
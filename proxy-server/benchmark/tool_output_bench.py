@@ -0,0 +1,129 @@
+"""
+Benchmark for tool output compression.
+Replay an agentic session on v1/chat/completions: every turn calls a tool
+that returns a large file dump or test log, and the whole history is sent
+again. The mock upstream takes time proportional to the prompt size
+(`--prefill-rate` prompt tokens per second) and reports prompt tokens.
+Compare prompt tokens and latency with and without compression.
+Run from `proxy-server` directory: `python -m benchmark.tool_output_bench`
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+import httpx
+from benchmark.load_test import (
+    MOCK_PORT,
+    PROXY_PORT,
+    get_percentiles,
+    start_process,
+    wait_until_ready,
+)
+
+
+def create_tool_output(turn: int) -> str:
+    if turn % 2 == 0:
+        return "\n".join(
+            f"{line:>4} | def function_{turn}_{line}(value): return value * {line}"
+            for line in range(400)
+        )
+    log_lines = [
+        f"tests/test_{turn}.py::test_case_{index} PASSED" for index in range(300)
+    ]
+    log_lines += ["WARNING: deprecated call"] * 100
+    log_lines.append(f"FAILED tests/test_{turn}.py::test_edge - AssertionError")
+    return "\n".join(log_lines)
+
+
+def create_turn_messages(turn: int) -> list[dict[str, Any]]:
+    call_id = f"call_{turn}"
+    return [
+        {"role": "user", "content": f"Continue with step {turn}"},
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": call_id,
+                    "type": "function",
+                    "function": {"name": "run_tool", "arguments": "{}"},
+                }
+            ],
+        },
+        {"role": "tool", "tool_call_id": call_id, "content": create_tool_output(turn)},
+    ]
+
+
+async def run_session(proxy_url: str, turn_count: int) -> dict[str, Any]:
+    messages = [{"role": "system", "content": "You are a coding agent"}]
+    latencies = []
+    prompt_tokens = []
+    async with httpx.AsyncClient(base_url=proxy_url, timeout=300) as client:
+        for turn in range(turn_count):
+            messages += create_turn_messages(turn)
+            start_time = time.perf_counter()
+            response = await client.post(
+                "/v1/chat/completions", json={"model": "mock", "messages": messages}
+            )
+            latencies.append(time.perf_counter() - start_time)
+            prompt_tokens.append(response.json()["usage"]["prompt_tokens"])
+    return {"latencies": latencies, "prompt_tokens": prompt_tokens}
+
+
+async def measure(compression_enabled: bool, args: argparse.Namespace) -> dict:
+    mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+    proxy_url = f"http://127.0.0.1:{PROXY_PORT}"
+    processes = []
+    try:
+        mock_args = [
+            "-m",
+            "benchmark.mock_upstream",
+            f"--port={MOCK_PORT}",
+            f"--prefill-rate={args.prefill_rate}",
+        ]
+        processes.append(start_process(mock_args, {}))
+        await wait_until_ready(mock_url)
+        proxy_env = {
+            "PROXY_HTTP_PORT": str(PROXY_PORT),
+            "PROXY_LLM_API_URL": mock_url,
+            "PROXY_LLM_API_KEY": "tool-output-bench",
+            # Measure compression alone, before summarization kicks in
+            "PROXY_SUMMARIZATION_TOKEN_THRESHOLD": "100000000",
+            "PROXY_TOOL_OUTPUT_COMPRESSION_ENABLED": (
+                "1" if compression_enabled else "0"
+            ),
+        }
+        processes.append(start_process(["main.py"], proxy_env))
+        await wait_until_ready(proxy_url, path="/ready")
+        return await run_session(proxy_url, args.turns)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+async def main(args: argparse.Namespace):
+    print(
+        f"{args.turns} turns, mock prefill rate {args.prefill_rate:.0f} tokens/s\n"
+        f"{'compression':>12} {'total prompt tokens':>20} {'last prompt tokens':>19} "
+        f"{'p50 (ms)':>9} {'p99 (ms)':>9} {'last (ms)':>10}"
+    )
+    for name, compression_enabled in (("off", False), ("on", True)):
+        result = await measure(compression_enabled, args)
+        percentiles = get_percentiles(result["latencies"])
+        print(
+            f"{name:>12} {sum(result['prompt_tokens']):>20} "
+            f"{result['prompt_tokens'][-1]:>19} {percentiles['p50'] * 1000:>9.1f} "
+            f"{percentiles['p99'] * 1000:>9.1f} {result['latencies'][-1] * 1000:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--prefill-rate", type=float, default=20000)
+    asyncio.run(main(parser.parse_args()))
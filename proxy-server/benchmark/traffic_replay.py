@@ -0,0 +1,254 @@
+"""
+Replay captured traffic (`PROXY_TRAFFIC_CAPTURE_PATH`) through the proxy.
+Requests are sent at their captured arrival times, sped up by `--speed`,
+without waiting for previous responses, so bursts and concurrent sessions
+are reproduced. By default, start a mock upstream taking as long as the
+captured upstream did for requests of the same route and size (`--trace`),
+and the proxy in front of it, with extra `--proxy-env` settings.
+Report latency and errors by route next to the captured ones, throughput,
+how late requests were sent, and prompt tokens processed by the upstream.
+Run from `proxy-server` directory:
+`python -m benchmark.traffic_replay traffic.gz --speed 4`
+`python -m benchmark.traffic_replay traffic.gz --proxy-env PROXY_HEDGE_ENABLED=1`
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any
+
+import httpx
+from benchmark.load_test import (
+    MOCK_PORT,
+    PROXY_PORT,
+    get_commit,
+    get_percentiles,
+    start_process,
+    wait_until_ready,
+)
+
+
+async def replay_request(
+    client: httpx.AsyncClient, record: dict[str, Any], lag: float
+) -> dict[str, Any]:
+    start_time = time.perf_counter()
+    ttfb = None
+    try:
+        async with client.stream(
+            record["method"],
+            f"/{record['path']}",
+            params=record["query_params"],
+            headers=record["headers"],
+            content=record["body"].encode("utf-8"),
+        ) as response:
+            async for _ in response.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start_time
+        status_code = response.status_code
+    except httpx.HTTPError:
+        status_code = 0
+    latency = time.perf_counter() - start_time
+    return {
+        "route": record["route"],
+        "status_code": status_code,
+        "ttfb": latency if ttfb is None else ttfb,
+        "latency": latency,
+        "lag": lag,
+    }
+
+
+async def replay(
+    proxy_url: str, records: list[dict[str, Any]], speed: float
+) -> tuple[list[dict[str, Any]], float]:
+    """Return results in captured order, and the replay duration."""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(
+        base_url=proxy_url, limits=limits, timeout=300
+    ) as client:
+        tasks = []
+        first_time = records[0]["time"]
+        start_time = time.perf_counter()
+        for record in records:
+            send_time = start_time + (record["time"] - first_time) / speed
+            delay = send_time - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(
+                asyncio.create_task(replay_request(client, record, max(-delay, 0)))
+            )
+        results = await asyncio.gather(*tasks)
+        return results, time.perf_counter() - start_time
+
+
+async def get_upstream_prompt_tokens(mock_url: str | None) -> int | None:
+    if mock_url is None:
+        return None
+    async with httpx.AsyncClient() as client:
+        response = await client.get(f"{mock_url}/health")
+        return response.json()["prompt_tokens"]
+
+
+def summarize(
+    records: list[dict[str, Any]], results: list[dict[str, Any]]
+) -> dict[str, dict[str, Any]]:
+    routes: dict[str, dict[str, Any]] = {}
+    for record, result in zip(records, results):
+        route = routes.setdefault(
+            record["route"],
+            {"count": 0, "errors": 0, "captured": [], "ttfb": [], "latency": []},
+        )
+        route["count"] += 1
+        if not 0 < result["status_code"] < 400:
+            route["errors"] += 1
+            continue
+        if record["duration"] is not None and record["status_code"] < 400:
+            route["captured"].append(record["duration"])
+        route["ttfb"].append(result["ttfb"])
+        route["latency"].append(result["latency"])
+    return {
+        name: {
+            "count": route["count"],
+            "errors": route["errors"],
+            "captured_latency": get_percentiles(route["captured"]),
+            "ttfb": get_percentiles(route["ttfb"]),
+            "latency": get_percentiles(route["latency"]),
+        }
+        for name, route in sorted(routes.items())
+    }
+
+
+def print_summary(summary: dict[str, dict[str, Any]]):
+    print(
+        f"{'route':>24} {'count':>6} {'errors':>7} "
+        f"{'captured p50/p99 (ms)':>22} {'ttfb p50/p99 (ms)':>18} "
+        f"{'latency p50/p99 (ms)':>21}"
+    )
+    for name, route in summary.items():
+        print(
+            f"{name:>24} {route['count']:>6} {route['errors']:>7} "
+            f"{_format_percentiles(route['captured_latency']):>22} "
+            f"{_format_percentiles(route['ttfb']):>18} "
+            f"{_format_percentiles(route['latency']):>21}"
+        )
+
+
+def _format_percentiles(percentiles: dict[str, float | None]) -> str:
+    return "/".join(
+        "-" if percentiles[key] is None else f"{percentiles[key] * 1000:.0f}"
+        for key in ("p50", "p99")
+    )
+
+
+def _get_proxy_env(mock_url: str, cache_dir: str, items: list[str]) -> dict:
+    proxy_env = {
+        "PROXY_HTTP_PORT": str(PROXY_PORT),
+        "PROXY_LLM_API_URL": mock_url,
+        "PROXY_LLM_API_KEY": "traffic-replay",
+        "PROXY_EMBEDDING_API_URL": mock_url,
+        "PROXY_CACHE_DISK_PATH": os.path.join(cache_dir, "cache.db"),
+        "PROXY_SEMANTIC_CACHE_DIR": os.path.join(cache_dir, "semantic"),
+        # Never capture the replay into the trace being replayed
+        "PROXY_TRAFFIC_CAPTURE_PATH": "",
+    }
+    for item in items:
+        key, _, value = item.partition("=")
+        proxy_env[key] = value
+    return proxy_env
+
+
+async def main(args: argparse.Namespace):
+    # Proxy modules configure the root logger, keep replay output readable
+    from traffic_capture import read_traffic_records
+
+    logging.getLogger().setLevel(logging.WARNING)
+    records = read_traffic_records(args.trace)
+    if args.limit > 0:
+        records = records[: args.limit]
+    if len(records) == 0:
+        print("No captured request")
+        return
+    processes = []
+    proxy_url = args.proxy_url
+    mock_url = None
+    try:
+        if proxy_url is None:
+            mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+            proxy_url = f"http://127.0.0.1:{PROXY_PORT}"
+            mock_args = [
+                "-m",
+                "benchmark.mock_upstream",
+                f"--port={MOCK_PORT}",
+                f"--trace={args.trace}",
+            ]
+            processes.append(start_process(mock_args, {}))
+            await wait_until_ready(mock_url)
+            cache_dir = tempfile.mkdtemp(prefix="proxy-traffic-replay-")
+            proxy_env = _get_proxy_env(mock_url, cache_dir, args.proxy_env)
+            processes.append(start_process(["main.py"], proxy_env))
+            await wait_until_ready(proxy_url, path="/ready")
+        prompt_tokens_start = await get_upstream_prompt_tokens(mock_url)
+        results, duration = await replay(proxy_url, records, args.speed)
+        prompt_tokens_end = await get_upstream_prompt_tokens(mock_url)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+    summary = summarize(records, results)
+    captured_duration = (records[-1]["time"] - records[0]["time"]) / args.speed
+    lag = get_percentiles([result["lag"] for result in results])
+    captured_prompt_tokens = sum(
+        record["upstream"]["request_bytes"] // 4
+        for record in records
+        if record["upstream"] is not None
+    )
+    upstream_prompt_tokens = (
+        None if mock_url is None else prompt_tokens_end - prompt_tokens_start
+    )
+    print(
+        f"{len(records)} requests at {args.speed:g}x speed, "
+        f"{duration:.1f} s (captured {captured_duration:.1f} s), "
+        f"{len(records) / duration:.1f} requests/s, "
+        f"send lag p99 {lag['p99'] * 1000:.0f} ms\n"
+        f"Upstream prompt tokens: captured ~{captured_prompt_tokens}, "
+        f"replayed {'-' if upstream_prompt_tokens is None else upstream_prompt_tokens}"
+    )
+    print_summary(summary)
+    if args.output is not None:
+        report = {
+            "commit": get_commit(),
+            "timestamp": time.time(),
+            "trace": args.trace,
+            "speed": args.speed,
+            "proxy_env": args.proxy_env,
+            "duration": duration,
+            "lag": lag,
+            "captured_prompt_tokens": captured_prompt_tokens,
+            "upstream_prompt_tokens": upstream_prompt_tokens,
+            "routes": summary,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("trace", help="Traffic capture file")
+    parser.add_argument("--speed", type=float, default=1)
+    parser.add_argument("--limit", type=int, default=0, help="0 means all requests")
+    parser.add_argument(
+        "--proxy-env",
+        action="append",
+        default=[],
+        help="KEY=VALUE setting of the started proxy, can be repeated",
+    )
+    parser.add_argument(
+        "--proxy-url", help="Replay through a running proxy instead of starting one"
+    )
+    parser.add_argument("--output")
+    asyncio.run(main(parser.parse_args()))
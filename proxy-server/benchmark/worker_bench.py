@@ -0,0 +1,180 @@
+"""
+Benchmark for multi-worker mode.
+1. Throughput: start the proxy with 1 to N workers (PROXY_WORKERS) against
+   the mock upstream and measure requests per second.
+2. Summary cache hit rate: simulate sessions whose turns are spread round
+   robin over N worker processes. Every turn looks up the summary of the
+   previous turn and stores its own, like the proxy does. A process-local
+   cache (lru) loses hits as workers are added, a shared SQLite file does not.
+Run from `proxy-server` directory: `python -m benchmark.worker_bench`
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Any
+
+from benchmark.load_test import (
+    MOCK_PORT,
+    PROXY_PORT,
+    SCENARIOS,
+    ProcessUsage,
+    run_scenario,
+    start_process,
+    wait_until_ready,
+)
+from cache.any_cache import AnyCache
+from cache.lru_cache import LRUCache
+from cache.sqlite_cache import SQLiteCache
+from prefix_index import PrefixIndex
+
+SESSION_COUNT = 40
+TURN_COUNT = 20
+
+
+async def measure_throughput(worker_count: int, scenario_names: list[str]) -> dict:
+    mock_url = f"http://127.0.0.1:{MOCK_PORT}"
+    proxy_url = f"http://127.0.0.1:{PROXY_PORT}"
+    cache_dir = tempfile.mkdtemp(prefix="proxy-worker-bench-")
+    processes = []
+    try:
+        processes.append(
+            start_process(["-m", "benchmark.mock_upstream", f"--port={MOCK_PORT}"], {})
+        )
+        await wait_until_ready(mock_url)
+        proxy_env = {
+            "PROXY_HTTP_PORT": str(PROXY_PORT),
+            "PROXY_LLM_API_URL": mock_url,
+            "PROXY_LLM_API_KEY": "worker-bench",
+            "PROXY_WORKERS": str(worker_count),
+            "PROXY_CACHE_DISK_PATH": os.path.join(cache_dir, "cache.db"),
+        }
+        processes.append(start_process(["main.py"], proxy_env))
+        await wait_until_ready(proxy_url, path="/ready")
+        result = {}
+        for scenario in SCENARIOS:
+            if scenario.name in scenario_names:
+                scenario_result = await run_scenario(
+                    proxy_url, scenario, ProcessUsage(None)
+                )
+                result[scenario.name] = scenario_result["rps"]
+        return result
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def create_session_turn(session: int, turn: int) -> list[dict[str, Any]]:
+    contents = []
+    for index in range(turn + 1):
+        contents.append(
+            {"role": "user", "parts": [{"text": f"Session {session} turn {index}"}]}
+        )
+        contents.append({"role": "model", "parts": [{"text": "lorem ipsum " * 20}]})
+    return contents
+
+
+def create_cache(backend: str, path: str) -> AnyCache:
+    if backend == "sqlite":
+        return SQLiteCache(path, 1024 * 1024 * 1024)
+    return LRUCache(1000)
+
+
+def run_worker(
+    backend: str, path: str, worker_index: int, worker_count: int, barrier, results
+):
+    cache = create_cache(backend, path)
+    lookup_count = 0
+    hit_count = 0
+    for turn in range(TURN_COUNT):
+        # Turn N of every session is served by worker (session + N) % workers
+        for session in range(SESSION_COUNT):
+            if (session + turn) % worker_count != worker_index:
+                continue
+            prefix_index = PrefixIndex(create_session_turn(session, turn))
+            pivot = prefix_index.find_longest_cached_prefix(cache)
+            if turn > 0:
+                # Only the summary of the previous turn counts as a hit
+                lookup_count += 1
+                hit_count += 1 if pivot == len(prefix_index) - 2 else 0
+            cache.set(prefix_index.get_key(len(prefix_index)), f"Summary {turn}")
+        # Next turn starts once the previous one is answered
+        barrier.wait()
+    results.put((lookup_count, hit_count))
+
+
+def measure_hit_rate(backend: str, worker_count: int) -> float:
+    path = os.path.join(tempfile.mkdtemp(prefix="proxy-worker-bench-"), "cache.db")
+    if backend == "sqlite":
+        # Create the table before workers start
+        create_cache(backend, path)
+    barrier = multiprocessing.Barrier(worker_count)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(backend, path, worker_index, worker_count, barrier, results),
+        )
+        for worker_index in range(worker_count)
+    ]
+    for process in processes:
+        process.start()
+    counts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    lookup_count = sum(count[0] for count in counts)
+    hit_count = sum(count[1] for count in counts)
+    return hit_count / lookup_count
+
+
+async def main(args: argparse.Namespace):
+    worker_counts = [
+        worker_count
+        for worker_count in (1, 2, 4, 8, 16)
+        if worker_count <= args.max_workers
+    ]
+    report: dict[str, Any] = {"cpu_count": os.cpu_count(), "workers": []}
+    print(f"CPU count: {os.cpu_count()}")
+    print(
+        f"{'workers':>8} {'short_chat rps':>15} {'long_session rps':>17} "
+        f"{'lru hit rate':>13} {'sqlite hit rate':>16}"
+    )
+    for worker_count in worker_counts:
+        start = time.perf_counter()
+        throughput = await measure_throughput(
+            worker_count, ["short_chat", "long_session"]
+        )
+        hit_rates = {
+            backend: measure_hit_rate(backend, worker_count)
+            for backend in ("lru", "sqlite")
+        }
+        report["workers"].append(
+            {
+                "worker_count": worker_count,
+                "rps": throughput,
+                "hit_rate": hit_rates,
+                "duration": time.perf_counter() - start,
+            }
+        )
+        print(
+            f"{worker_count:>8} {throughput['short_chat']:>15.1f} "
+            f"{throughput['long_session']:>17.1f} {hit_rates['lru']:>13.2f} "
+            f"{hit_rates['sqlite']:>16.2f}"
+        )
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,22 @@
+from abc import ABC, abstractmethod
+from typing import Any
+
+
+class AnyAsyncCache(ABC):
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, val: Any):
+        pass
+
+    @abstractmethod
+    async def key_exists(self, key: str) -> bool:
+        pass
+
+    async def key_exists_many(self, keys: list[str]) -> list[bool]:
+        return [await self.key_exists(key) for key in keys]
+
+    async def get_stats(self) -> dict[str, int]:
+        return {}
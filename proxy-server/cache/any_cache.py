@@ -14,3 +14,9 @@ class AnyCache(ABC):
     @abstractmethod
     def key_exists(self, key: str) -> bool:
         pass
+
+    def key_exists_many(self, keys: list[str]) -> list[bool]:
+        return [self.key_exists(key) for key in keys]
+
+    def get_stats(self) -> dict[str, int]:
+        return {}
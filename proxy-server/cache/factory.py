@@ -1,11 +1,68 @@
+import threading
+
+from config import (
+    CACHE_BACKEND,
+    CACHE_CAPACITY,
+    CACHE_DISK_MAX_BYTES,
+    CACHE_DISK_PATH,
+    CACHE_EVICTION_POLICY,
+    CACHE_MEMORY_MAX_BYTES,
+    CACHE_TTL,
+    WORKERS,
+)
+from log_util import LazyJson, logger
+
+from .any_async_cache import AnyAsyncCache
 from .any_cache import AnyCache
 from .lru_cache import LRUCache
+from .memory_cache import MemoryCache
+from .sqlite_cache import SQLiteCache
+from .threaded_async_cache import ThreadedAsyncCache
+from .tiered_cache import TieredCache
 
 _cache_instance: AnyCache | None = None
+_async_cache_instance: AnyAsyncCache | None = None
+# The warm-up creates the cache in a worker thread while requests may need it
+_cache_lock = threading.Lock()
 
 
 def get_cache() -> AnyCache:
     global _cache_instance
     if _cache_instance is None:
-        _cache_instance = LRUCache(100)
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = _create_cache()
     return _cache_instance
+
+
+def get_async_cache() -> AnyAsyncCache:
+    global _async_cache_instance
+    if _async_cache_instance is None:
+        _async_cache_instance = ThreadedAsyncCache(get_cache())
+    return _async_cache_instance
+
+
+def _create_cache() -> AnyCache:
+    if WORKERS > 1 and CACHE_BACKEND in ("lru", "memory"):
+        logger.warning(
+            LazyJson(
+                {
+                    "event": "process_local_cache",
+                    "data": {"backend": CACHE_BACKEND, "workers": WORKERS},
+                }
+            )
+        )
+    if CACHE_BACKEND == "memory":
+        return MemoryCache(CACHE_MEMORY_MAX_BYTES, CACHE_TTL, CACHE_EVICTION_POLICY)
+    if CACHE_BACKEND == "sqlite":
+        return SQLiteCache(
+            CACHE_DISK_PATH, CACHE_DISK_MAX_BYTES, CACHE_TTL, CACHE_EVICTION_POLICY
+        )
+    if CACHE_BACKEND == "tiered":
+        return TieredCache(
+            MemoryCache(CACHE_MEMORY_MAX_BYTES, CACHE_TTL, CACHE_EVICTION_POLICY),
+            SQLiteCache(
+                CACHE_DISK_PATH, CACHE_DISK_MAX_BYTES, CACHE_TTL, CACHE_EVICTION_POLICY
+            ),
+        )
+    return LRUCache(CACHE_CAPACITY)
@@ -8,13 +8,18 @@ class LRUCache(AnyCache):
     def __init__(self, capacity: int):
         self.capacity = capacity
         self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def get(self, key: str) -> Any:
         try:
             value = self.cache.pop(key)
             self.cache[key] = value
+            self.hits += 1
             return value
         except KeyError:
+            self.misses += 1
             return None
 
     def set(self, key: str, val: Any):
@@ -22,7 +27,16 @@ class LRUCache(AnyCache):
             self.cache.pop(key)
         elif len(self.cache) >= self.capacity:
             self.cache.popitem(last=False)
+            self.evictions += 1
         self.cache[key] = val
 
     def key_exists(self, key):
         return key in self.cache
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.cache),
+        }
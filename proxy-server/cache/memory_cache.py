@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from typing import Any
+
+from cache.any_cache import AnyCache
+from cache.size_util import get_size
+
+
+class MemoryCache(AnyCache):
+    """
+    In-memory cache bounded by the total size of its values (in bytes).
+    eviction_policy is either "lru" (least recently used) or "fifo".
+    ttl is in seconds, 0 means entries never expire.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 0, eviction_policy: str = "lru"):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.eviction_policy = eviction_policy
+        self.cache: OrderedDict[str, tuple[Any, int, float]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        if not self.key_exists(key):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.eviction_policy == "lru":
+            self.cache.move_to_end(key)
+        return self.cache[key][0]
+
+    def set(self, key: str, val: Any):
+        size = get_size(val)
+        if key in self.cache:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        while self.size + size > self.max_bytes:
+            oldest_key = next(iter(self.cache))
+            self._remove(oldest_key)
+            self.evictions += 1
+        expires_at = time.time() + self.ttl if self.ttl > 0 else 0
+        self.cache[key] = (val, size, expires_at)
+        self.size += size
+
+    def key_exists(self, key: str) -> bool:
+        if key not in self.cache:
+            return False
+        expires_at = self.cache[key][2]
+        if expires_at > 0 and expires_at < time.time():
+            self._remove(key)
+            self.evictions += 1
+            return False
+        return True
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.cache),
+            "bytes": self.size,
+        }
+
+    def _remove(self, key: str):
+        _, size, _ = self.cache.pop(key)
+        self.size -= size
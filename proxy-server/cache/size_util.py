@@ -0,0 +1,10 @@
+import json
+from typing import Any
+
+
+def get_size(val: Any) -> int:
+    if isinstance(val, bytes):
+        return len(val)
+    if isinstance(val, str):
+        return len(val.encode("utf-8"))
+    return len(json.dumps(val).encode("utf-8"))
@@ -0,0 +1,217 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any
+
+from cache.any_cache import AnyCache
+from cache.size_util import get_size
+
+# SQLite limits the number of host parameters in a single statement.
+_MAX_QUERY_PARAMS = 500
+# Milliseconds to wait for another process holding the write lock
+_BUSY_TIMEOUT = 5000
+
+
+class SQLiteCache(AnyCache):
+    """
+    Persistent cache stored in a local SQLite file.
+    Values must be JSON serializable.
+    The file is bounded by the total size of its values (in bytes),
+    eviction_policy is either "lru" (least recently used) or "fifo".
+    ttl is in seconds, 0 means entries never expire.
+    The file can be shared by several processes: it uses WAL mode so
+    readers never wait for writers, and writes take the database write
+    lock before reading anything.
+    The entry count and total size are kept up to date by triggers in a
+    one-row table, so neither writes nor stats scan the cache table.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int,
+        ttl: float = 0,
+        eviction_policy: str = "lru",
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.eviction_policy = eviction_policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Autocommit mode, transactions are started explicitly
+        self.connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=_BUSY_TIMEOUT / 1000,
+        )
+        self.connection.execute(f"PRAGMA busy_timeout = {_BUSY_TIMEOUT}")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+        # Expired and eviction candidates are found without a table scan
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)"
+        )
+        self.connection.execute(
+            f"CREATE INDEX IF NOT EXISTS cache_{self._get_order_column()} "
+            f"ON cache ({self._get_order_column()})"
+        )
+        self._create_size_table()
+
+    def get(self, key: str) -> Any:
+        now = time.time()
+        row = self.connection.execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or self._is_expired(row[1], now):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.eviction_policy == "lru":
+            self.connection.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, val: Any):
+        value = json.dumps(val)
+        size = get_size(value)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl > 0 else 0
+        # Take the write lock first, so eviction sees writes of other processes
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute(
+                """
+                INSERT INTO cache
+                (key, value, size, created_at, accessed_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                value = excluded.value,
+                size = excluded.size,
+                created_at = excluded.created_at,
+                accessed_at = excluded.accessed_at,
+                expires_at = excluded.expires_at
+                """,
+                (key, value, size, now, now, expires_at),
+            )
+            self._evict(now)
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def key_exists(self, key: str) -> bool:
+        return self.key_exists_many([key])[0]
+
+    def key_exists_many(self, keys: list[str]) -> list[bool]:
+        now = time.time()
+        existing_keys = set()
+        for start in range(0, len(keys), _MAX_QUERY_PARAMS):
+            chunk = keys[start : start + _MAX_QUERY_PARAMS]
+            placeholders = ", ".join("?" for _ in chunk)
+            rows = self.connection.execute(
+                f"SELECT key, expires_at FROM cache WHERE key IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            existing_keys.update(
+                key for key, expires_at in rows if not self._is_expired(expires_at, now)
+            )
+        return [key in existing_keys for key in keys]
+
+    def get_stats(self) -> dict[str, int]:
+        entries, size = self.connection.execute(
+            "SELECT entries, bytes FROM cache_size"
+        ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def _evict(self, now: float):
+        cursor = self.connection.execute(
+            "DELETE FROM cache WHERE expires_at > 0 AND expires_at < ?", (now,)
+        )
+        self.evictions += cursor.rowcount
+        total_size = self.connection.execute("SELECT bytes FROM cache_size").fetchone()[
+            0
+        ]
+        if total_size <= self.max_bytes:
+            return
+        rows = self.connection.execute(
+            f"SELECT key, size FROM cache ORDER BY {self._get_order_column()} ASC"
+        )
+        evicted_keys = []
+        for key, size in rows:
+            if total_size <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        self.connection.executemany("DELETE FROM cache WHERE key = ?", evicted_keys)
+        self.evictions += len(evicted_keys)
+
+    def _get_order_column(self) -> str:
+        return "accessed_at" if self.eviction_policy == "lru" else "created_at"
+
+    def _create_size_table(self):
+        # Seeded once from the existing entries, then kept by the triggers
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS cache_size (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    entries INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL
+                )
+                """)
+            self.connection.execute("""
+                INSERT OR IGNORE INTO cache_size (id, entries, bytes)
+                SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM cache
+                """)
+            self.connection.execute("""
+                CREATE TRIGGER IF NOT EXISTS cache_size_insert
+                AFTER INSERT ON cache BEGIN
+                    UPDATE cache_size
+                    SET entries = entries + 1, bytes = bytes + NEW.size;
+                END
+                """)
+            self.connection.execute("""
+                CREATE TRIGGER IF NOT EXISTS cache_size_update
+                AFTER UPDATE OF size ON cache BEGIN
+                    UPDATE cache_size SET bytes = bytes + NEW.size - OLD.size;
+                END
+                """)
+            self.connection.execute("""
+                CREATE TRIGGER IF NOT EXISTS cache_size_delete
+                AFTER DELETE ON cache BEGIN
+                    UPDATE cache_size
+                    SET entries = entries - 1, bytes = bytes - OLD.size;
+                END
+                """)
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def _is_expired(self, expires_at: float, now: float) -> bool:
+        return expires_at > 0 and expires_at < now
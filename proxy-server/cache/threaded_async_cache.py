@@ -0,0 +1,38 @@
+import asyncio
+import threading
+from typing import Any
+
+from cache.any_async_cache import AnyAsyncCache
+from cache.any_cache import AnyCache
+
+
+class ThreadedAsyncCache(AnyAsyncCache):
+    """
+    Async facade over a synchronous cache.
+    Every operation runs in a worker thread so disk I/O never blocks
+    the event loop.
+    """
+
+    def __init__(self, cache: AnyCache):
+        self.cache = cache
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Any:
+        return await asyncio.to_thread(self._run, self.cache.get, key)
+
+    async def set(self, key: str, val: Any):
+        await asyncio.to_thread(self._run, self.cache.set, key, val)
+
+    async def key_exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._run, self.cache.key_exists, key)
+
+    async def key_exists_many(self, keys: list[str]) -> list[bool]:
+        return await asyncio.to_thread(self._run, self.cache.key_exists_many, keys)
+
+    async def get_stats(self) -> dict[str, int]:
+        # Stats may query the disk, like any other operation
+        return await asyncio.to_thread(self._run, self.cache.get_stats)
+
+    def _run(self, fn, *args):
+        with self._lock:
+            return fn(*args)
@@ -0,0 +1,52 @@
+from typing import Any
+
+from cache.any_cache import AnyCache
+
+
+class TieredCache(AnyCache):
+    """
+    Two level cache: a fast memory tier in front of a persistent disk tier.
+    Writes go to both tiers, disk hits are promoted to the memory tier.
+    """
+
+    def __init__(self, memory_cache: AnyCache, disk_cache: AnyCache):
+        self.memory_cache = memory_cache
+        self.disk_cache = disk_cache
+
+    def get(self, key: str) -> Any:
+        val = self.memory_cache.get(key)
+        if val is not None:
+            return val
+        val = self.disk_cache.get(key)
+        if val is not None:
+            self.memory_cache.set(key, val)
+        return val
+
+    def set(self, key: str, val: Any):
+        self.memory_cache.set(key, val)
+        self.disk_cache.set(key, val)
+
+    def key_exists(self, key: str) -> bool:
+        return self.memory_cache.key_exists(key) or self.disk_cache.key_exists(key)
+
+    def key_exists_many(self, keys: list[str]) -> list[bool]:
+        result = self.memory_cache.key_exists_many(keys)
+        missing_indexes = [index for index, exists in enumerate(result) if not exists]
+        if len(missing_indexes) == 0:
+            return result
+        disk_result = self.disk_cache.key_exists_many(
+            [keys[index] for index in missing_indexes]
+        )
+        for index, exists in zip(missing_indexes, disk_result):
+            result[index] = exists
+        return result
+
+    def get_stats(self) -> dict[str, int]:
+        stats = {}
+        for tier, cache in (("memory", self.memory_cache), ("disk", self.disk_cache)):
+            for name, value in cache.get_stats().items():
+                stats[f"{tier}_{name}"] = value
+        # Memory misses fall through to the disk tier
+        stats["hits"] = stats.get("memory_hits", 0) + stats.get("disk_hits", 0)
+        stats["misses"] = stats.get("disk_misses", 0)
+        return stats
@@ -0,0 +1,124 @@
+import gzip
+import zlib
+from typing import Any
+
+from config import TRANSPORT_COMPRESSION_ENABLED
+from fastapi import HTTPException
+
+# zstandard is optional, zstd is only negotiated and decoded when it is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUPPORTED_ENCODINGS = ("gzip", "zstd") if zstandard is not None else ("gzip",)
+# Compressed request bodies are small, their decoded size is bounded as well
+_MAX_DECODED_BODY_BYTES = 256 * 1024 * 1024
+# Fast compression, the proxy sits on the request path
+_COMPRESS_LEVEL = 5
+
+
+class ContentDecoder:
+    """Incremental decoder of a compressed body (e.g., a stream)."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.decompressor: Any = None
+        if encoding == "gzip":
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        elif encoding == "zstd" and zstandard is not None:
+            self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decode(self, chunk: bytes) -> bytes:
+        # Unknown encodings (e.g., passthrough routes) are forwarded undecoded
+        if self.decompressor is None:
+            raise ValueError(f"Unsupported content encoding: {self.encoding}")
+        return self.decompressor.decompress(chunk)
+
+
+def get_content_encoding(headers: Any) -> str:
+    return headers.get("Content-Encoding", "identity").strip().lower() or "identity"
+
+
+def get_accept_encoding(headers: Any) -> str:
+    """
+    Encodings to accept from the upstream: the ones the client accepts
+    (so compressed bytes can be forwarded as they are), and the proxy can
+    decode (for logging and caching).
+    """
+    if not TRANSPORT_COMPRESSION_ENABLED:
+        return "identity"
+    accepted = set()
+    for item in headers.get("Accept-Encoding", "").split(","):
+        encoding, _, parameters = item.strip().lower().partition(";")
+        if parameters.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(encoding.strip())
+    encodings = [
+        encoding
+        for encoding in SUPPORTED_ENCODINGS
+        if encoding in accepted or "*" in accepted
+    ]
+    return ", ".join(encodings) if len(encodings) > 0 else "identity"
+
+
+def encode_content(content: bytes, headers: Any) -> tuple[bytes, dict[str, str]]:
+    """
+    Compress content built by the proxy (e.g., batched embeddings) if the
+    client accepts gzip. Return the content and its headers.
+    """
+    if "gzip" not in get_accept_encoding(headers).split(", "):
+        return content, {}
+    return gzip.compress(content, compresslevel=_COMPRESS_LEVEL), {
+        "Content-Encoding": "gzip",
+        "Vary": "Accept-Encoding",
+    }
+
+
+def decode_content(content: bytes, encoding: str) -> bytes:
+    if encoding == "identity":
+        return content
+    return ContentDecoder(encoding).decode(content)
+
+
+def decode_content_prefix(content: bytes, encoding: str, max_bytes: int) -> bytes:
+    """Decode at most max_bytes (e.g., for logging)."""
+    if encoding == "identity":
+        return content[:max_bytes]
+    try:
+        return _decode_at_most(content, encoding, max_bytes)
+    except Exception as e:
+        return f"<Undecodable {encoding} content: {e}>".encode("utf-8")
+
+
+def decode_request_body(body: bytes, headers: Any) -> bytes:
+    """Decode gzip or zstd compressed request body."""
+    encoding = get_content_encoding(headers)
+    if encoding == "identity" or len(body) == 0:
+        return body
+    if encoding not in SUPPORTED_ENCODINGS:
+        raise HTTPException(
+            status_code=415, detail=f"Unsupported content encoding: {encoding}"
+        )
+    try:
+        decoded_body = _decode_at_most(body, encoding, _MAX_DECODED_BODY_BYTES + 1)
+    except Exception:
+        raise HTTPException(status_code=400, detail=f"Invalid {encoding} body")
+    if len(decoded_body) > _MAX_DECODED_BODY_BYTES:
+        raise HTTPException(status_code=413, detail="Decoded body is too large")
+    return decoded_body
+
+
+def _decode_at_most(content: bytes, encoding: str, max_bytes: int) -> bytes:
+    if encoding == "gzip":
+        return zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(content, max_bytes)
+    if encoding == "zstd" and zstandard is not None:
+        reader = zstandard.ZstdDecompressor().stream_reader(content)
+        decoded = bytearray()
+        while len(decoded) < max_bytes:
+            chunk = reader.read(max_bytes - len(decoded))
+            if len(chunk) == 0:
+                break
+            decoded += chunk
+        return bytes(decoded)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
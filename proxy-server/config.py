@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 
@@ -7,8 +8,21 @@ load_dotenv()
 
 LOG_LEVEL_STR = os.getenv("PROXY_LOG_LEVEL", "INFO").upper()
 LOG_LEVEL = getattr(logging, LOG_LEVEL_STR, logging.INFO)
+# Logged strings and bodies longer than this are truncated
+LOG_PAYLOAD_MAX_BYTES = int(os.getenv("PROXY_LOG_PAYLOAD_MAX_BYTES", "4096"))
+# Records waiting for the logging thread, new records are dropped when full
+LOG_QUEUE_SIZE = int(os.getenv("PROXY_LOG_QUEUE_SIZE", "10000"))
 
 HTTP_PORT = int(os.getenv("PROXY_HTTP_PORT", "8000"))
+# Number of uvicorn worker processes
+WORKERS = int(os.getenv("PROXY_WORKERS", "1"))
+# Accept compressed upstream responses and forward them as they are to
+# clients accepting the same encoding (gzip, or zstd if zstandard is installed)
+TRANSPORT_COMPRESSION_ENABLED = (
+    int(os.getenv("PROXY_TRANSPORT_COMPRESSION_ENABLED", "0")) == 1
+)
+# Seconds idle upstream connections are kept open for reuse
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("PROXY_HTTP_KEEPALIVE_EXPIRY", "60"))
 ALLOW_CUSTOM_LLM = int(os.getenv("PROXY_ALLOW_CUSTOM_LLM", "0")) == 1
 
 EMBEDDING_API_URL = os.getenv(
@@ -21,6 +35,41 @@ LLM_API_URL = os.getenv(
     "PROXY_LLM_API_URL", "https://generativelanguage.googleapis.com/v1beta"
 ).rstrip("/")
 LLM_MODEL = os.getenv("PROXY_LLM_MODEL", "gemini-2.5-flash-preview-04-17")
+# Upstream pool, JSON list of {"url": ..., "api_key": ..., "weight": ...}
+# PROXY_LLM_API_KEYS (comma separated) creates a key pool on LLM_API_URL.
+# When neither is set, the pool only contains LLM_API_URL and LLM_API_KEY.
+LLM_UPSTREAMS = json.loads(os.getenv("PROXY_LLM_UPSTREAMS", "[]"))
+if len(LLM_UPSTREAMS) == 0:
+    LLM_UPSTREAMS = [
+        {"url": LLM_API_URL, "api_key": api_key.strip()}
+        for api_key in os.getenv("PROXY_LLM_API_KEYS", "").split(",")
+        if api_key.strip() != ""
+    ]
+if len(LLM_UPSTREAMS) == 0:
+    LLM_UPSTREAMS = [{"url": LLM_API_URL, "api_key": LLM_API_KEY}]
+# least_latency or weighted
+UPSTREAM_SELECTION_STRATEGY = os.getenv(
+    "PROXY_UPSTREAM_SELECTION_STRATEGY", "least_latency"
+).lower()
+# Consecutive failures before an upstream is taken out of rotation
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("PROXY_UPSTREAM_FAILURE_THRESHOLD", "5"))
+# Seconds before an unhealthy upstream is tried again
+UPSTREAM_COOLDOWN = float(os.getenv("PROXY_UPSTREAM_COOLDOWN", "30"))
+# Retries of non-streamed idempotent requests (read-only methods, and
+# generateContent, countTokens, and chat completions) on another upstream
+UPSTREAM_MAX_RETRIES = int(os.getenv("PROXY_UPSTREAM_MAX_RETRIES", "2"))
+# Send a duplicate of generation requests that are slower than usual to
+# another upstream (or the same one), and use whichever answers first
+HEDGE_ENABLED = int(os.getenv("PROXY_HEDGE_ENABLED", "0")) == 1
+# Hedge delay is this percentile of recent times to first byte of the route
+HEDGE_PERCENTILE = float(os.getenv("PROXY_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("PROXY_HEDGE_MIN_DELAY", "0.1"))
+# Requests of a route are not hedged until this many samples are collected
+HEDGE_MIN_SAMPLES = int(os.getenv("PROXY_HEDGE_MIN_SAMPLES", "20"))
+# Hedges per request of a route, i.e., maximum load amplification
+HEDGE_BUDGET_RATIO = float(os.getenv("PROXY_HEDGE_BUDGET_RATIO", "0.05"))
+# Unused hedges saved for bursts of slow requests
+HEDGE_MAX_BURST = float(os.getenv("PROXY_HEDGE_MAX_BURST", "5"))
 _DEFAULT_LLM_ALIGNMENT = """
 Nilai luhur Bank Arasaka:
 Integritas, Sikap Positif, Komitmen, Penyempurnaan Berkelanjutan, Inovatif, dan Loyal
@@ -32,7 +81,37 @@ SUMMARIZATION_API_URL = os.getenv("PROXY_SUMMARIZATION_API_URL", LLM_API_URL).rs
 )
 SUMMARIZATION_API_KEY = os.getenv("PROXY_SUMMARIZATION_API_KEY", LLM_API_KEY)
 SUMMARIZATION_MODEL = os.getenv("PROXY_SUMMARIZATION_API_MODEL", LLM_MODEL)
+# Deprecated: character based threshold, only used to derive the token threshold
 SUMMARIZATION_THRESHOLD = int(os.getenv("PROXY_SUMMARIZATION_THRESHOLD", "1000"))
+# Summarize once the unsummarized conversation reaches this many tokens
+SUMMARIZATION_TOKEN_THRESHOLD = int(
+    os.getenv("PROXY_SUMMARIZATION_TOKEN_THRESHOLD", str(SUMMARIZATION_THRESHOLD // 4))
+)
+# Minimum tokens of recent conversation kept verbatim after summarization
+SUMMARIZATION_RETAINED_TOKENS = int(
+    os.getenv("PROXY_SUMMARIZATION_RETAINED_TOKENS", "0")
+)
+# inline: summarize before forwarding the request
+# background: forward with the cached summary, summarize for the next turn
+SUMMARIZATION_MODE = os.getenv("PROXY_SUMMARIZATION_MODE", "inline").lower()
+# Conversation is summarized in segments of this many tokens, then groups of
+# PROXY_SUMMARIZATION_MERGE_FANOUT segment summaries are merged into one
+SUMMARIZATION_SEGMENT_TOKENS = int(
+    os.getenv("PROXY_SUMMARIZATION_SEGMENT_TOKENS", "2000")
+)
+SUMMARIZATION_MERGE_FANOUT = int(os.getenv("PROXY_SUMMARIZATION_MERGE_FANOUT", "4"))
+# Concurrent summarizer calls of a single summarization
+SUMMARIZATION_MAX_PARALLEL_CALLS = int(
+    os.getenv("PROXY_SUMMARIZATION_MAX_PARALLEL_CALLS", "4")
+)
+# Concurrent calls of the (long-lived) summarizer agent
+SUMMARIZER_MAX_CONCURRENCY = int(os.getenv("PROXY_SUMMARIZER_MAX_CONCURRENCY", "4"))
+# Seconds a summarizer call (waiting for a slot included) may take, an
+# extractive summary of PROXY_SUMMARIZER_FALLBACK_TOKENS is used afterward
+SUMMARIZER_TIMEOUT = float(os.getenv("PROXY_SUMMARIZER_TIMEOUT", "10"))
+SUMMARIZER_FALLBACK_TOKENS = int(os.getenv("PROXY_SUMMARIZER_FALLBACK_TOKENS", "500"))
+SUMMARIZATION_QUEUE_SIZE = int(os.getenv("PROXY_SUMMARIZATION_QUEUE_SIZE", "100"))
+SUMMARIZATION_WORKER_COUNT = int(os.getenv("PROXY_SUMMARIZATION_WORKER_COUNT", "2"))
 
 _DEFAULT_SUMMARIZATION_PROMPT = """
 You are a summarization assistant.
@@ -48,3 +127,123 @@ Output *only* the updated summary text.
 SUMMARIZATION_SYSTEM_PROMPT = os.getenv(
     "PROXY_SUMMARIZATION_SYSTEM_PROMPT", _DEFAULT_SUMMARIZATION_PROMPT
 )
+
+TOOL_OUTPUT_COMPRESSION_ENABLED = (
+    int(os.getenv("PROXY_TOOL_OUTPUT_COMPRESSION_ENABLED", "0")) == 1
+)
+# extractive: keep first and last lines, collapse repeated lines
+# summarizer: let the summarization model write the digest
+TOOL_OUTPUT_COMPRESSION_MODE = os.getenv(
+    "PROXY_TOOL_OUTPUT_COMPRESSION_MODE", "extractive"
+).lower()
+# Tool outputs longer than this (4 characters per token) are compressed
+TOOL_OUTPUT_MAX_TOKENS = int(os.getenv("PROXY_TOOL_OUTPUT_MAX_TOKENS", "1000"))
+TOOL_OUTPUT_DIGEST_TOKENS = int(os.getenv("PROXY_TOOL_OUTPUT_DIGEST_TOKENS", "250"))
+# Most recent tool outputs are always forwarded verbatim
+TOOL_OUTPUT_KEEP_RECENT = int(os.getenv("PROXY_TOOL_OUTPUT_KEEP_RECENT", "3"))
+
+# Register recurring prompt prefixes as Gemini cached contents (cachedContents
+# API), requests then reference them instead of resending their tokens
+CONTEXT_CACHE_ENABLED = int(os.getenv("PROXY_CONTEXT_CACHE_ENABLED", "0")) == 1
+# Seconds cached contents live upstream, renewed while they are used
+CONTEXT_CACHE_TTL = float(os.getenv("PROXY_CONTEXT_CACHE_TTL", "300"))
+# Smaller prefixes are not cached (the upstream enforces its own minimum)
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("PROXY_CONTEXT_CACHE_MIN_TOKENS", "4096"))
+# Conversation prefixes end every PROXY_CONTEXT_CACHE_PREFIX_STEP_TOKENS tokens
+CONTEXT_CACHE_PREFIX_STEP_TOKENS = int(
+    os.getenv("PROXY_CONTEXT_CACHE_PREFIX_STEP_TOKENS", "8192")
+)
+# Number of requests sharing a prefix before it is cached
+CONTEXT_CACHE_MIN_HITS = int(os.getenv("PROXY_CONTEXT_CACHE_MIN_HITS", "2"))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("PROXY_CONTEXT_CACHE_MAX_ENTRIES", "20"))
+
+# Workers only share summaries through the SQLite file (sqlite or tiered)
+CACHE_BACKEND = os.getenv(
+    "PROXY_CACHE_BACKEND", "lru" if WORKERS == 1 else "tiered"
+).lower()
+CACHE_CAPACITY = int(os.getenv("PROXY_CACHE_CAPACITY", "100"))
+CACHE_MEMORY_MAX_BYTES = int(
+    os.getenv("PROXY_CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024))
+)
+CACHE_DISK_PATH = os.getenv("PROXY_CACHE_DISK_PATH", ".cache/proxy-cache.db")
+CACHE_DISK_MAX_BYTES = int(
+    os.getenv("PROXY_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+CACHE_TTL = float(os.getenv("PROXY_CACHE_TTL", "0"))
+CACHE_EVICTION_POLICY = os.getenv("PROXY_CACHE_EVICTION_POLICY", "lru").lower()
+
+RESPONSE_CACHE_ENABLED = int(os.getenv("PROXY_RESPONSE_CACHE_ENABLED", "0")) == 1
+RESPONSE_CACHE_GENERATE_TTL = float(
+    os.getenv("PROXY_RESPONSE_CACHE_GENERATE_TTL", "300")
+)
+RESPONSE_CACHE_GENERATE_MAX_BYTES = int(
+    os.getenv("PROXY_RESPONSE_CACHE_GENERATE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+RESPONSE_CACHE_STREAM_TTL = float(os.getenv("PROXY_RESPONSE_CACHE_STREAM_TTL", "300"))
+RESPONSE_CACHE_STREAM_MAX_BYTES = int(
+    os.getenv("PROXY_RESPONSE_CACHE_STREAM_MAX_BYTES", str(64 * 1024 * 1024))
+)
+# Replay cached streams with the original delay between chunks
+RESPONSE_CACHE_REPLAY_PACING = (
+    int(os.getenv("PROXY_RESPONSE_CACHE_REPLAY_PACING", "0")) == 1
+)
+
+SEMANTIC_CACHE_ENABLED = int(os.getenv("PROXY_SEMANTIC_CACHE_ENABLED", "0")) == 1
+SEMANTIC_CACHE_EMBEDDING_MODEL = os.getenv(
+    "PROXY_SEMANTIC_CACHE_EMBEDDING_MODEL", "nomic-embed-text"
+)
+# Minimum cosine similarity for a prompt to be considered a repeat
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("PROXY_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("PROXY_SEMANTIC_CACHE_CAPACITY", "10000"))
+# Set to empty string to keep the semantic cache in memory only
+SEMANTIC_CACHE_DIR = os.getenv("PROXY_SEMANTIC_CACHE_DIR", ".cache/semantic-cache")
+
+# Coalesce v1/embeddings requests into batched upstream calls
+EMBEDDING_BATCH_ENABLED = int(os.getenv("PROXY_EMBEDDING_BATCH_ENABLED", "0")) == 1
+# Seconds to wait for more inputs before a batch is sent
+EMBEDDING_BATCH_WINDOW = float(os.getenv("PROXY_EMBEDDING_BATCH_WINDOW", "0.01"))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("PROXY_EMBEDDING_BATCH_MAX_SIZE", "64"))
+# Batches of the same model sent at once, new inputs wait for the next batch
+EMBEDDING_BATCH_MAX_CONCURRENCY = int(
+    os.getenv("PROXY_EMBEDDING_BATCH_MAX_CONCURRENCY", "2")
+)
+# Number of embeddings cached by input content
+EMBEDDING_CACHE_CAPACITY = int(os.getenv("PROXY_EMBEDDING_CACHE_CAPACITY", "10000"))
+
+# Seconds between client disconnection checks while streaming
+STREAM_DISCONNECT_CHECK_INTERVAL = float(
+    os.getenv("PROXY_STREAM_DISCONNECT_CHECK_INTERVAL", "0.5")
+)
+# Maximum streamed body bytes kept for logging, 0 means no body is logged
+STREAM_LOG_MAX_BYTES = int(os.getenv("PROXY_STREAM_LOG_MAX_BYTES", "65536"))
+
+# Requests per second allowed for every caller, 0 means no rate limit
+RATE_LIMIT_RPS = float(os.getenv("PROXY_RATE_LIMIT_RPS", "0"))
+RATE_LIMIT_BURST = float(os.getenv("PROXY_RATE_LIMIT_BURST", "10"))
+# Header identifying a caller, API key is used when the header is absent
+CLIENT_ID_HEADER = os.getenv("PROXY_CLIENT_ID_HEADER", "X-Client-Id")
+# Header to set request priority (interactive or batch), by default
+# streamed requests are interactive and the others are batch
+PRIORITY_HEADER = os.getenv("PROXY_PRIORITY_HEADER", "X-Proxy-Priority")
+# Maximum concurrent upstream requests, 0 means unlimited
+MAX_CONCURRENT_UPSTREAM_REQUESTS = int(
+    os.getenv("PROXY_MAX_CONCURRENT_UPSTREAM_REQUESTS", "0")
+)
+ADMISSION_MAX_WAIT = float(os.getenv("PROXY_ADMISSION_MAX_WAIT", "30"))
+ADMISSION_MAX_QUEUE_SIZE = int(os.getenv("PROXY_ADMISSION_MAX_QUEUE_SIZE", "1000"))
+
+METRICS_ENABLED = int(os.getenv("PROXY_METRICS_ENABLED", "1")) == 1
+
+# Seconds a warm-up step (e.g., connecting to upstreams) may take, /ready
+# reports ready afterward even if the step has not finished
+WARM_UP_TIMEOUT = float(os.getenv("PROXY_WARM_UP_TIMEOUT", "10"))
+
+# Append captured requests to this file (gzipped JSON lines), empty means no
+# capture. Replay the file with benchmark/traffic_replay.py
+TRAFFIC_CAPTURE_PATH = os.getenv("PROXY_TRAFFIC_CAPTURE_PATH", "")
+# Seconds between writes of captured requests
+TRAFFIC_CAPTURE_FLUSH_INTERVAL = float(
+    os.getenv("PROXY_TRAFFIC_CAPTURE_FLUSH_INTERVAL", "5")
+)
+# Captured requests waiting to be written, new ones are dropped when full
+TRAFFIC_CAPTURE_QUEUE_SIZE = int(os.getenv("PROXY_TRAFFIC_CAPTURE_QUEUE_SIZE", "1000"))
@@ -0,0 +1,444 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable
+
+import httpx
+import json_util
+from config import (
+    CONTEXT_CACHE_ENABLED,
+    CONTEXT_CACHE_MAX_ENTRIES,
+    CONTEXT_CACHE_MIN_HITS,
+    CONTEXT_CACHE_MIN_TOKENS,
+    CONTEXT_CACHE_PREFIX_STEP_TOKENS,
+    CONTEXT_CACHE_TTL,
+)
+from log_util import LazyJson, logger
+from metrics import context_cache_tokens
+from prefix_index import PrefixIndex, get_message_digest, get_prefix_index
+from token_util import estimate_message_tokens
+from upstream_pool import Upstream
+
+# Request fields that are moved into the cached content
+_STABLE_KEYS = ("systemInstruction", "tools", "toolConfig")
+# Cached contents about to expire are not referenced anymore
+_EXPIRY_MARGIN = 10
+# Number of prefixes whose occurrences are counted
+_CANDIDATE_CAPACITY = 10000
+
+
+class CachedContent:
+    def __init__(
+        self,
+        name: str,
+        upstream: Upstream,
+        api_url: str,
+        token_count: int,
+        expire_time: float,
+    ):
+        self.name = name
+        self.upstream = upstream
+        self.api_url = api_url
+        self.token_count = token_count
+        self.expire_time = expire_time
+        # Requests in flight referencing this cached content
+        self.ref_count = 0
+        self.is_renewing = False
+
+
+class ContextCacheLease:
+    """Rewritten payload, the cached content is kept until release()."""
+
+    def __init__(
+        self,
+        manager: "ContextCacheManager",
+        key: str,
+        entry: CachedContent,
+        payload: dict[str, Any],
+    ):
+        self.manager = manager
+        self.key = key
+        self.entry = entry
+        self.payload = payload
+        self.is_released = False
+
+    def release(self):
+        if not self.is_released:
+            self.is_released = True
+            self.entry.ref_count -= 1
+
+    def release_on_close(self, response: httpx.Response):
+        """Keep the cached content until a streamed response is closed."""
+        response.stream = _ReleasingStream(response.stream, self.release)
+
+    def invalidate(self):
+        """The upstream rejected the cached content (e.g., expired early)."""
+        self.release()
+        self.manager.forget(self.key, self.entry)
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: Any, on_close: Callable[[], None]):
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self.on_close()
+
+
+class ContextCacheManager:
+    """
+    Register recurring prompt prefixes of Gemini requests as upstream
+    cached contents (cachedContents API), and make requests reference them
+    instead of resending their tokens.
+    Candidate prefixes are the stable fields (systemInstruction, tools,
+    toolConfig) alone, shared across conversations, and the stable fields
+    with the conversation up to the last boundary. Boundaries are placed
+    every prefix_step_tokens tokens, so they do not move as the
+    conversation grows. A candidate is registered (in the background) once
+    it has been seen min_hits times and has at least min_tokens tokens.
+    Cached contents belong to an upstream (i.e., its API key), their TTL is
+    renewed while they are used, and the least recently used ones are
+    deleted beyond max_entries, unless a request still references them.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        min_tokens: int,
+        prefix_step_tokens: int,
+        min_hits: int,
+        max_entries: int,
+    ):
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.prefix_step_tokens = max(prefix_step_tokens, 1)
+        self.min_hits = max(min_hits, 1)
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, CachedContent] = OrderedDict()
+        self.candidate_hits: OrderedDict[str, int] = OrderedDict()
+        self.pending: set[str] = set()
+        self.tasks: set[asyncio.Task] = set()
+        self.hits = 0
+        self.created = 0
+        self.renewed = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def acquire(
+        self,
+        client: httpx.AsyncClient,
+        upstream: Upstream,
+        url: str,
+        payload: Any,
+    ) -> ContextCacheLease | None:
+        """
+        Return a lease on the longest cached prefix of the request, or None
+        if the request should be sent as it is.
+        Prefixes seen often enough are registered for the next requests.
+        """
+        if not is_context_cacheable(url, payload):
+            return None
+        model = _get_model(url)
+        stable = {key: payload[key] for key in _STABLE_KEYS if key in payload}
+        contents = payload["contents"]
+        prefix_index = get_prefix_index(contents)
+        # Serialized once, the estimated tokens are memoized by its digest
+        stable_digest = get_message_digest(stable)
+        stable_key = _get_stable_key(upstream, model, stable_digest)
+        stable_tokens = 0
+        if len(stable) > 0:
+            stable_tokens = estimate_message_tokens(stable, stable_digest)
+        candidates = self._get_candidates(prefix_index, stable_tokens)
+        if len(candidates) == 0:
+            return None
+        now = time.monotonic()
+        for length in reversed(candidates):
+            key = _get_prefix_key(stable_key, prefix_index, length)
+            entry = self._get_entry(key, now)
+            if entry is not None:
+                break
+        else:
+            key, length, entry = None, 0, None
+        # The longest prefix, and the stable fields shared by other conversations
+        for candidate_length in {candidates[-1], 0} & set(candidates):
+            if candidate_length <= length and entry is not None:
+                continue
+            candidate_key = _get_prefix_key(stable_key, prefix_index, candidate_length)
+            if self._should_register(candidate_key):
+                cached_payload = dict(stable)
+                if candidate_length > 0:
+                    cached_payload["contents"] = contents[:candidate_length]
+                self._run_in_background(
+                    self._register(
+                        client, upstream, url, model, candidate_key, cached_payload
+                    )
+                )
+        if entry is None:
+            return None
+        self.hits += 1
+        entry.ref_count += 1
+        self.entries.move_to_end(key)
+        if entry.expire_time - now < self.ttl / 2 and not entry.is_renewing:
+            self._run_in_background(self._renew(client, entry))
+        new_payload = {
+            field: value for field, value in payload.items() if field not in stable
+        }
+        new_payload["contents"] = contents[length:]
+        new_payload["cachedContent"] = entry.name
+        sent_tokens = prefix_index.get_token_count(length)
+        context_cache_tokens.inc(entry.token_count, ("cached",))
+        context_cache_tokens.inc(sent_tokens, ("sent",))
+        logger.info(
+            LazyJson(
+                {
+                    "event": "context_cache_hit",
+                    "data": {
+                        "cached_content": entry.name,
+                        "cached_messages": length,
+                        "cached_tokens": entry.token_count,
+                        "sent_tokens": sent_tokens,
+                    },
+                }
+            )
+        )
+        return ContextCacheLease(self, key, entry, new_payload)
+
+    def forget(self, key: str, entry: CachedContent):
+        if self.entries.get(key) is entry:
+            del self.entries[key]
+
+    async def delete_all(self, client: httpx.AsyncClient):
+        """Delete cached contents on shutdown, instead of waiting for their TTL."""
+        for task in list(self.tasks):
+            task.cancel()
+        entries = list(self.entries.values())
+        self.entries.clear()
+        await asyncio.gather(*[self._delete(client, entry) for entry in entries])
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "created": self.created,
+            "renewed": self.renewed,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+
+    def _get_candidates(
+        self, prefix_index: PrefixIndex, stable_tokens: int
+    ) -> list[int]:
+        """
+        Candidate prefix lengths, the stable fields alone first. The last
+        message is never cached, it is the new turn.
+        """
+        candidates = []
+        step = self.prefix_step_tokens
+        previous_tokens = -1
+        for length in range(len(prefix_index)):
+            tokens = stable_tokens + prefix_index.get_token_count(0, length)
+            is_boundary = length == 0 or tokens // step > previous_tokens // step
+            if is_boundary and tokens >= self.min_tokens:
+                candidates.append(length)
+            previous_tokens = tokens
+        return candidates
+
+    def _get_entry(self, key: str, now: float) -> CachedContent | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expire_time - now < _EXPIRY_MARGIN:
+            # Expired upstream, nothing to delete
+            del self.entries[key]
+            return None
+        return entry
+
+    def _should_register(self, key: str) -> bool:
+        if key in self.entries or key in self.pending:
+            return False
+        hits = self.candidate_hits.pop(key, 0) + 1
+        if hits < self.min_hits:
+            self.candidate_hits[key] = hits
+            if len(self.candidate_hits) > _CANDIDATE_CAPACITY:
+                self.candidate_hits.popitem(last=False)
+            return False
+        return True
+
+    def _run_in_background(self, coroutine: Any):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _register(
+        self,
+        client: httpx.AsyncClient,
+        upstream: Upstream,
+        url: str,
+        model: str,
+        key: str,
+        cached_payload: dict[str, Any],
+    ):
+        self.pending.add(key)
+        try:
+            api_url = _get_api_url(url)
+            response = await client.post(
+                f"{api_url}/cachedContents",
+                content=json_util.dumps(
+                    {
+                        "model": f"models/{model}",
+                        **cached_payload,
+                        "ttl": f"{self.ttl:.0f}s",
+                    }
+                ),
+                headers=_get_headers(upstream),
+            )
+            if response.status_code >= 400:
+                raise httpx.HTTPStatusError(
+                    response.text, request=response.request, response=response
+                )
+            data = json_util.loads(response.content)
+            token_count = data.get("usageMetadata", {}).get(
+                "totalTokenCount", estimate_message_tokens(cached_payload)
+            )
+            self.entries[key] = CachedContent(
+                data["name"],
+                upstream,
+                api_url,
+                token_count,
+                time.monotonic() + self.ttl,
+            )
+            self.created += 1
+            logger.info(
+                LazyJson(
+                    {
+                        "event": "context_cache_created",
+                        "data": {"name": data["name"], "token_count": token_count},
+                    }
+                )
+            )
+            await self._evict(client)
+        except (httpx.HTTPError, KeyError, TypeError, ValueError) as e:
+            self.errors += 1
+            logger.warning(
+                LazyJson({"event": "context_cache_error", "data": {"error": str(e)}})
+            )
+        finally:
+            self.pending.discard(key)
+
+    async def _renew(self, client: httpx.AsyncClient, entry: CachedContent):
+        entry.is_renewing = True
+        try:
+            response = await client.patch(
+                f"{entry.api_url}/{entry.name}",
+                params={"updateMask": "ttl"},
+                content=json_util.dumps({"ttl": f"{self.ttl:.0f}s"}),
+                headers=_get_headers(entry.upstream),
+            )
+            if response.status_code < 400:
+                entry.expire_time = time.monotonic() + self.ttl
+                self.renewed += 1
+                return
+            self.errors += 1
+            logger.warning(
+                LazyJson(
+                    {
+                        "event": "context_cache_error",
+                        "data": {"name": entry.name, "error": response.text},
+                    }
+                )
+            )
+        except httpx.HTTPError as e:
+            self.errors += 1
+            logger.warning(
+                LazyJson({"event": "context_cache_error", "data": {"error": str(e)}})
+            )
+        finally:
+            entry.is_renewing = False
+
+    async def _evict(self, client: httpx.AsyncClient):
+        while len(self.entries) > self.max_entries:
+            # Least recently used first, referenced entries are kept
+            key = next(
+                (key for key, entry in self.entries.items() if entry.ref_count == 0),
+                None,
+            )
+            if key is None:
+                return
+            entry = self.entries.pop(key)
+            self.evicted += 1
+            await self._delete(client, entry)
+
+    async def _delete(self, client: httpx.AsyncClient, entry: CachedContent):
+        try:
+            await client.delete(
+                f"{entry.api_url}/{entry.name}", headers=_get_headers(entry.upstream)
+            )
+        except httpx.HTTPError as e:
+            logger.warning(
+                LazyJson({"event": "context_cache_error", "data": {"error": str(e)}})
+            )
+
+
+_context_cache_manager: ContextCacheManager | None = None
+
+
+def get_context_cache_manager() -> ContextCacheManager:
+    global _context_cache_manager
+    if _context_cache_manager is None:
+        _context_cache_manager = ContextCacheManager(
+            CONTEXT_CACHE_TTL,
+            CONTEXT_CACHE_MIN_TOKENS,
+            CONTEXT_CACHE_PREFIX_STEP_TOKENS,
+            CONTEXT_CACHE_MIN_HITS,
+            CONTEXT_CACHE_MAX_ENTRIES,
+        )
+    return _context_cache_manager
+
+
+def is_context_cacheable(url: str, payload: Any) -> bool:
+    if not CONTEXT_CACHE_ENABLED or "/models/" not in url:
+        return False
+    if ":generateContent" not in url and ":streamGenerateContent" not in url:
+        return False
+    if not isinstance(payload, dict) or "cachedContent" in payload:
+        return False
+    contents = payload.get("contents")
+    return isinstance(contents, list) and len(contents) > 1
+
+
+def _get_model(url: str) -> str:
+    # .../v1beta/models/<model-name>:generateContent?...
+    return url.rsplit("/models/", 1)[1].split(":", 1)[0]
+
+
+def _get_api_url(url: str) -> str:
+    # .../v1beta/models/<model-name>:generateContent -> .../v1beta
+    return url.rsplit("/models/", 1)[0]
+
+
+def _get_headers(upstream: Upstream) -> dict[str, str]:
+    return {
+        "Content-Type": "application/json",
+        "Accept-Encoding": "identity",
+        "X-Goog-Api-Key": upstream.api_key or "",
+    }
+
+
+def _get_stable_key(upstream: Upstream, model: str, stable_digest: bytes) -> str:
+    # Cached contents are only visible to the API key that created them
+    data = json.dumps([upstream.url, upstream.api_key, model, stable_digest.hex()])
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+def _get_prefix_key(stable_key: str, prefix_index: PrefixIndex, length: int) -> str:
+    return f"{stable_key}:{prefix_index.get_key(length)}"
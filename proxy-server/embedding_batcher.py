@@ -0,0 +1,286 @@
+import asyncio
+import hashlib
+import itertools
+from typing import Any
+
+import httpx
+import json_util
+from admission_control import BATCH_PRIORITY, upstream_limiter
+from cache.lru_cache import LRUCache
+from compression_util import encode_content
+from config import (
+    EMBEDDING_API_URL,
+    EMBEDDING_BATCH_ENABLED,
+    EMBEDDING_BATCH_MAX_CONCURRENCY,
+    EMBEDDING_BATCH_MAX_SIZE,
+    EMBEDDING_BATCH_WINDOW,
+    EMBEDDING_CACHE_CAPACITY,
+    TRANSPORT_COMPRESSION_ENABLED,
+)
+from fastapi import HTTPException
+from fastapi.responses import Response
+from log_util import LazyJson, logger
+from token_util import estimate_text_tokens
+
+# Requests with other fields (e.g., dimensions) are forwarded as they are
+_BATCHABLE_KEYS = {"model", "input", "encoding_format", "user"}
+
+
+class EmbeddingError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class EmbeddingBatcher:
+    """
+    Coalesce concurrent embedding requests of the same model into batched
+    upstream calls. A batch is sent once it has max_batch_size distinct
+    inputs, or `window` seconds after its first input arrived.
+    When max_concurrency batches of a model are already being sent, new
+    inputs keep accumulating and are sent as soon as one of them finishes.
+    Embeddings are cached by model and input content.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        max_batch_size: int,
+        max_concurrency: int,
+        cache_capacity: int,
+    ):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.cache = LRUCache(cache_capacity)
+        # model -> input -> future of its embedding
+        self.pending: dict[str, dict[str, asyncio.Future]] = {}
+        self.timers: dict[str, asyncio.TimerHandle] = {}
+        self.in_flight: dict[str, int] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.upstream_calls = 0
+        self.batched_inputs = 0
+
+    async def embed(
+        self, client: httpx.AsyncClient, model: str, texts: list[str]
+    ) -> list[list[float]]:
+        futures = []
+        for text in texts:
+            embedding = self.cache.get(_get_cache_key(model, text))
+            if embedding is None:
+                futures.append(self._enqueue(client, model, text))
+                continue
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(embedding)
+            futures.append(future)
+        # Futures are shared by callers, one cancelled caller must not cancel them
+        return await asyncio.gather(*[asyncio.shield(future) for future in futures])
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            **self.cache.get_stats(),
+            "upstream_calls": self.upstream_calls,
+            "batched_inputs": self.batched_inputs,
+        }
+
+    def _enqueue(
+        self, client: httpx.AsyncClient, model: str, text: str
+    ) -> asyncio.Future:
+        pending = self.pending.setdefault(model, {})
+        if text in pending:
+            return pending[text]
+        future = asyncio.get_running_loop().create_future()
+        pending[text] = future
+        if len(pending) >= self.max_batch_size:
+            self._flush(client, model)
+        elif model not in self.timers:
+            self.timers[model] = asyncio.get_running_loop().call_later(
+                self.window, self._flush, client, model
+            )
+        return future
+
+    def _flush(self, client: httpx.AsyncClient, model: str):
+        timer = self.timers.pop(model, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self.pending.get(model, {})
+        while len(pending) > 0 and self.in_flight.get(model, 0) < self.max_concurrency:
+            texts = list(itertools.islice(pending, self.max_batch_size))
+            batch = {text: pending.pop(text) for text in texts}
+            self.in_flight[model] = self.in_flight.get(model, 0) + 1
+            task = asyncio.ensure_future(self._send(client, model, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        if len(pending) == 0:
+            self.pending.pop(model, None)
+
+    async def _send(
+        self,
+        client: httpx.AsyncClient,
+        model: str,
+        batch: dict[str, asyncio.Future],
+    ):
+        try:
+            await self._send_batch(client, model, batch)
+        except Exception as e:
+            # E.g., a bug or a cache failure, callers get an error response
+            logger.error(
+                LazyJson({"event": "embedding_batch_error", "data": {"error": str(e)}})
+            )
+            _fail(batch, EmbeddingError(500, f"Embedding batch failed: {e}"))
+        finally:
+            # Cancelled (e.g., on shutdown) batches must not leave callers waiting
+            _fail(batch, EmbeddingError(503, "Embedding batch cancelled"))
+            self.in_flight[model] -= 1
+            # Inputs that arrived in the meantime
+            self._flush(client, model)
+
+    async def _send_batch(
+        self,
+        client: httpx.AsyncClient,
+        model: str,
+        batch: dict[str, asyncio.Future],
+    ):
+        texts = list(batch)
+        # Batches count against the concurrency limit of upstream requests
+        try:
+            release_upstream_slot = await upstream_limiter.acquire(BATCH_PRIORITY)
+        except HTTPException as e:
+            _fail(batch, EmbeddingError(e.status_code, e.detail))
+            return
+        self.upstream_calls += 1
+        self.batched_inputs += len(texts)
+        try:
+            embeddings = await _request_embeddings(client, model, texts)
+        except EmbeddingError as e:
+            logger.warning(
+                LazyJson(
+                    {
+                        "event": "embedding_batch_error",
+                        "data": {"status_code": e.status_code, "error": e.message},
+                    }
+                )
+            )
+            _fail(batch, e)
+            return
+        finally:
+            release_upstream_slot()
+        for text, embedding in zip(texts, embeddings):
+            self.cache.set(_get_cache_key(model, text), embedding)
+            future = batch[text]
+            if not future.done():
+                future.set_result(embedding)
+
+
+_embedding_batcher: EmbeddingBatcher | None = None
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    global _embedding_batcher
+    if _embedding_batcher is None:
+        _embedding_batcher = EmbeddingBatcher(
+            EMBEDDING_BATCH_WINDOW,
+            EMBEDDING_BATCH_MAX_SIZE,
+            EMBEDDING_BATCH_MAX_CONCURRENCY,
+            EMBEDDING_CACHE_CAPACITY,
+        )
+    return _embedding_batcher
+
+
+def is_batchable_embedding_request(method: str, path: str, payload: Any) -> bool:
+    if not EMBEDDING_BATCH_ENABLED or method != "POST":
+        return False
+    if not path.startswith("v1/embeddings") or not isinstance(payload, dict):
+        return False
+    if not isinstance(payload.get("model"), str):
+        return False
+    if any(key not in _BATCHABLE_KEYS for key in payload):
+        return False
+    if payload.get("encoding_format", "float") != "float":
+        return False
+    inputs = payload.get("input")
+    if isinstance(inputs, str):
+        return True
+    return (
+        isinstance(inputs, list)
+        and len(inputs) > 0
+        and all(isinstance(text, str) for text in inputs)
+    )
+
+
+async def create_embedding_response(
+    client: httpx.AsyncClient, payload: dict[str, Any], request_headers: Any
+) -> Response:
+    """
+    Serve an OpenAI compatible embedding request through the batcher.
+    The response is compressed if the client accepts it.
+    """
+    model = payload["model"]
+    texts = payload["input"]
+    if isinstance(texts, str):
+        texts = [texts]
+    try:
+        embeddings = await get_embedding_batcher().embed(client, model, texts)
+    except EmbeddingError as e:
+        content = {"error": {"code": e.status_code, "message": e.message}}
+        return Response(
+            content=json_util.dumps(content),
+            status_code=e.status_code,
+            media_type="application/json",
+        )
+    token_count = sum(estimate_text_tokens(text) for text in texts)
+    content = {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": index, "embedding": embedding}
+            for index, embedding in enumerate(embeddings)
+        ],
+        "model": model,
+        "usage": {"prompt_tokens": token_count, "total_tokens": token_count},
+    }
+    content, headers = encode_content(json_util.dumps(content), request_headers)
+    return Response(content=content, headers=headers, media_type="application/json")
+
+
+async def _request_embeddings(
+    client: httpx.AsyncClient, model: str, texts: list[str]
+) -> list[list[float]]:
+    try:
+        response = await client.post(
+            f"{EMBEDDING_API_URL}/embeddings",
+            content=json_util.dumps({"model": model, "input": texts}),
+            headers={
+                "Content-Type": "application/json",
+                # Embeddings compress well, httpx decodes the response
+                "Accept-Encoding": (
+                    "gzip" if TRANSPORT_COMPRESSION_ENABLED else "identity"
+                ),
+            },
+        )
+    except httpx.HTTPError as e:
+        raise EmbeddingError(503, str(e))
+    if response.status_code >= 400:
+        raise EmbeddingError(response.status_code, response.text)
+    try:
+        data = sorted(json_util.loads(response.content)["data"], key=_get_index)
+        embeddings = [item["embedding"] for item in data]
+    except (KeyError, TypeError, ValueError) as e:
+        raise EmbeddingError(502, f"Invalid embedding response: {e}")
+    if len(embeddings) != len(texts):
+        raise EmbeddingError(502, "Invalid embedding response: wrong number of items")
+    return embeddings
+
+
+def _fail(batch: dict[str, asyncio.Future], error: EmbeddingError):
+    for future in batch.values():
+        if not future.done():
+            future.set_exception(error)
+
+
+def _get_index(item: dict[str, Any]) -> int:
+    return item["index"]
+
+
+def _get_cache_key(model: str, text: str) -> str:
+    return hashlib.md5(f"{model}\n{text}".encode("utf-8")).hexdigest()
@@ -0,0 +1,124 @@
+from collections import deque
+from typing import Any
+
+from config import (
+    HEDGE_BUDGET_RATIO,
+    HEDGE_ENABLED,
+    HEDGE_MAX_BURST,
+    HEDGE_MIN_DELAY,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+)
+
+# Recent time to first byte samples per route
+_WINDOW_SIZE = 1000
+# The delay is computed again after this many new samples
+_REFRESH_INTERVAL = 20
+
+
+class RouteHedgePolicy:
+    """
+    When to hedge requests of a route, and whether the budget allows it.
+    The hedge delay is the `percentile` of recent times to first byte.
+    Every request earns budget_ratio hedges (at most max_burst are saved),
+    so hedges never amplify the upstream load by more than budget_ratio.
+    """
+
+    def __init__(
+        self,
+        percentile: float,
+        min_delay: float,
+        min_samples: int,
+        budget_ratio: float,
+        max_burst: float,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio
+        self.max_burst = max_burst
+        self.samples: deque[float] = deque(maxlen=_WINDOW_SIZE)
+        self.new_sample_count = 0
+        self.delay: float | None = None
+        self.budget = 0.0
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self.rejected = 0
+
+    def get_delay(self) -> float | None:
+        """Return the hedge delay, None if there are not enough samples yet."""
+        self.requests += 1
+        self.budget = min(self.budget + self.budget_ratio, self.max_burst)
+        return self.delay
+
+    def try_fire(self) -> bool:
+        if self.budget < 1:
+            self.rejected += 1
+            return False
+        self.budget -= 1
+        self.fired += 1
+        return True
+
+    def record_first_byte(self, duration: float):
+        self.samples.append(duration)
+        self.new_sample_count += 1
+        if len(self.samples) < self.min_samples:
+            return
+        if self.delay is None or self.new_sample_count >= _REFRESH_INTERVAL:
+            self.new_sample_count = 0
+            samples = sorted(self.samples)
+            index = min(int(len(samples) * self.percentile), len(samples) - 1)
+            self.delay = max(samples[index], self.min_delay)
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "delay": self.delay or 0,
+            "requests": self.requests,
+            "fired": self.fired,
+            "won": self.won,
+            "rejected": self.rejected,
+        }
+
+
+_route_hedge_policies: dict[str, RouteHedgePolicy] = {}
+
+
+def get_route_hedge_policy(path: str, stream: bool) -> RouteHedgePolicy | None:
+    """Return the hedge policy of the request route, None if it is not hedged."""
+    if not HEDGE_ENABLED:
+        return None
+    route = get_hedge_route(path, stream)
+    if route is None:
+        return None
+    if route not in _route_hedge_policies:
+        _route_hedge_policies[route] = RouteHedgePolicy(
+            HEDGE_PERCENTILE,
+            HEDGE_MIN_DELAY,
+            HEDGE_MIN_SAMPLES,
+            HEDGE_BUDGET_RATIO,
+            HEDGE_MAX_BURST,
+        )
+    return _route_hedge_policies[route]
+
+
+def get_hedge_stats() -> dict[str, dict[str, Any]]:
+    return {
+        route: policy.get_stats() for route, policy in _route_hedge_policies.items()
+    }
+
+
+def get_hedge_route(path: str, stream: bool) -> str | None:
+    """
+    Only generation requests are hedged. Streams are hedged on their first
+    chunk, other requests on the whole response, so they are separate routes.
+    """
+    if path.startswith("v1beta/models/") and ":" in path:
+        # v1beta/models/<model-name>:streamGenerateContent
+        action = path.rsplit(":", 1)[1]
+        if action in ("generateContent", "streamGenerateContent"):
+            return action
+        return None
+    if path.startswith("v1/chat/completions"):
+        return "chat_completions_stream" if stream else "chat_completions"
+    return None
@@ -0,0 +1,24 @@
+import json
+from typing import Any
+
+# orjson is optional, it parses and serializes large payloads several times faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            # e.g., non-string keys or integers beyond 64 bits
+            pass
+    return json.dumps(value).encode("utf-8")
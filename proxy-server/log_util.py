@@ -1,19 +1,147 @@
+import atexit
+import json
 import logging
+import queue
+import re
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
 
-from config import LLM_API_KEY, LOG_LEVEL
+from config import (
+    LLM_API_KEY,
+    LLM_UPSTREAMS,
+    LOG_LEVEL,
+    LOG_PAYLOAD_MAX_BYTES,
+    LOG_QUEUE_SIZE,
+)
+
+_SECRETS = [
+    secret
+    for secret in {
+        LLM_API_KEY,
+        *[upstream.get("api_key") for upstream in LLM_UPSTREAMS],
+    }
+    if secret
+]
+# Longer secrets first, so a secret containing another one is fully redacted
+_SECRET_PATTERN = (
+    re.compile(
+        "|".join(re.escape(secret) for secret in sorted(_SECRETS, key=len)[::-1])
+    )
+    if len(_SECRETS) > 0
+    else None
+)
+# Values of these keys (headers, query params, payload fields) are never logged
+_REDACTED_KEYS = {"authorization", "x-goog-api-key", "api_key", "api-key", "key"}
+_REDACTED_VALUE = "***Redacted***"
+# Long lists are sampled: only first and last items are logged
+_MAX_LOGGED_LIST_ITEMS = 20
+
+
+class LazyJson:
+    """
+    Log message serialized as JSON only when the record is written, on the
+    logging thread. Long strings and bytes are truncated to
+    LOG_PAYLOAD_MAX_BYTES, long lists are sampled, and secret keys are
+    redacted. Data must not be mutated after it is logged.
+    """
+
+    def __init__(self, data: Any):
+        self.data = data
+
+    def __str__(self) -> str:
+        return json.dumps(_limit(self.data), default=str)
 
 
 class RedactingFormatter(logging.Formatter):
 
     def format(self, record):
-        formatted_message = super().format(record)
-        return formatted_message.replace(LLM_API_KEY, "***Redacted***")
+        return redact_secrets(super().format(record))
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Hand records to the logging thread without formatting them, so lazy
+    messages are never built on the event loop. Records are dropped when
+    the queue is full instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 
+def redact_secrets(text: str) -> str:
+    """Replace configured API keys found in text."""
+    if _SECRET_PATTERN is None:
+        return text
+    return _SECRET_PATTERN.sub(_REDACTED_VALUE, text)
 
-# Configure logger
+
+def is_redacted_key(key: str) -> bool:
+    return key.lower() in _REDACTED_KEYS
+
+
+def _limit(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            key: (
+                _REDACTED_VALUE
+                if isinstance(key, str) and is_redacted_key(key)
+                else _limit(item)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        if len(value) <= _MAX_LOGGED_LIST_ITEMS:
+            return [_limit(item) for item in value]
+        half = _MAX_LOGGED_LIST_ITEMS // 2
+        return [
+            *[_limit(item) for item in value[:half]],
+            f"...({len(value) - 2 * half} items omitted)",
+            *[_limit(item) for item in value[-half:]],
+        ]
+    if isinstance(value, (bytes, bytearray)):
+        text = bytes(value[:LOG_PAYLOAD_MAX_BYTES]).decode("utf-8", errors="replace")
+        return _add_truncation_note(text, len(value))
+    if isinstance(value, str) and len(value) > LOG_PAYLOAD_MAX_BYTES:
+        return _add_truncation_note(value[:LOG_PAYLOAD_MAX_BYTES], len(value))
+    return value
+
+
+def _add_truncation_note(text: str, original_length: int) -> str:
+    if original_length <= LOG_PAYLOAD_MAX_BYTES:
+        return text
+    return f"{text}...({original_length - LOG_PAYLOAD_MAX_BYTES} truncated)"
+
+
+# Configure logger, records are written by a background thread
 logger = logging.getLogger()
 handler = logging.StreamHandler()
 formatter = RedactingFormatter("%(asctime)s - %(levelname)s - %(message)s")
 handler.setFormatter(formatter)
-logger.addHandler(handler)
+queue_handler = DeferredQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+logger.addHandler(queue_handler)
 logger.setLevel(LOG_LEVEL)
+log_listener = QueueListener(queue_handler.queue, handler)
+log_listener.start()
+_is_log_listener_running = True
+
+
+def stop_log_listener():
+    """Write pending records and stop the logging thread, safe to call twice."""
+    global _is_log_listener_running
+    if _is_log_listener_running:
+        _is_log_listener_running = False
+        log_listener.stop()
+
+
+atexit.register(stop_log_listener)
@@ -1,12 +1,30 @@
-import json
+import asyncio
+import logging
+import time
 from contextlib import asynccontextmanager
 
 import httpx
+import json_util
 import uvicorn
-from config import HTTP_PORT
+from admission_control import (
+    get_caller_id,
+    get_request_priority,
+    rate_limiter,
+    upstream_limiter,
+)
+from cache.factory import get_cache
+from compression_util import decode_request_body
+from config import HTTP_KEEPALIVE_EXPIRY, HTTP_PORT, METRICS_ENABLED, WORKERS
+from context_cache import get_context_cache_manager
+from embedding_batcher import (
+    create_embedding_response,
+    is_batchable_embedding_request,
+)
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from log_util import logger
+from fastapi.responses import JSONResponse, PlainTextResponse
+from log_util import LazyJson, logger
+from metrics import observe_stage, render_metrics
+from metrics_collector import collect_cache_stats, register_collectors
 from payload_util import alter_payload
 from request_util import (
     get_incoming_payload,
@@ -15,16 +33,73 @@ from request_util import (
     get_outgoing_url,
     should_stream,
 )
+from response_cache import (
+    get_cached_response,
+    get_response_cache_key,
+    store_streamed_response,
+    store_unstreamed_response,
+)
 from response_util import create_streamed_response, create_unstreamed_response
+from semantic_cache import (
+    get_semantic_cache_query,
+    get_semantic_cached_response,
+    save_semantic_cache,
+    store_semantic_streamed_response,
+    store_semantic_unstreamed_response,
+    warm_up_semantic_cache,
+)
+from starlette.background import BackgroundTask
+from summarization_queue import get_summarization_queue
+from summarizer import create_summarizer
+from traffic_capture import (
+    capture_traffic,
+    capture_upstream_traffic,
+    create_traffic_record,
+    get_traffic_capture,
+)
+from upstream_router import send_upstream_request, warm_up_upstreams
+from warm_up import get_warm_up
 
-app = FastAPI()
-client = httpx.AsyncClient(timeout=30)
+# Upstream and summarizer requests share the same connection pool
+transport = httpx.AsyncHTTPTransport(
+    limits=httpx.Limits(
+        max_connections=100,
+        max_keepalive_connections=20,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+)
+client = httpx.AsyncClient(timeout=30, transport=transport)
+register_collectors()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    summarization_queue = get_summarization_queue()
+    summarization_queue.start()
+    traffic_capture = get_traffic_capture()
+    traffic_capture.start()
+    summarizer = create_summarizer(transport)
+    # Served requests do not wait for the warm-up, /ready tells when it is done
+    warm_up_task = asyncio.create_task(
+        get_warm_up().run(
+            {
+                "summarizer": summarizer.warm_up,
+                "upstreams": lambda: warm_up_upstreams(client),
+                "summary_cache": lambda: asyncio.to_thread(get_cache),
+                "semantic_cache": warm_up_semantic_cache,
+            }
+        )
+    )
     yield
-    await client.alclose()
+    warm_up_task.cancel()
+    await summarization_queue.stop()
+    save_semantic_cache()
+    await get_context_cache_manager().delete_all(client)
+    await client.aclose()
+    traffic_capture.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.get("/health")
@@ -32,49 +107,141 @@ async def get_health():
     return JSONResponse({"status": "ok"})
 
 
+@app.get("/ready")
+async def get_readiness():
+    warm_up = get_warm_up()
+    status_code = 200 if warm_up.is_ready() else 503
+    return JSONResponse(warm_up.get_status(), status_code=status_code)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    if not METRICS_ENABLED:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    await collect_cache_stats()
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.api_route(
     "/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"]
 )
 async def proxy(path: str, request: Request):
+    stage_start_time = time.perf_counter()
+    rate_limiter.check(get_caller_id(request))
     outgoing_url = get_outgoing_url(path)
     outgoing_headers = get_outgoing_request_header(path, request)
-    incoming_payload = await get_incoming_payload(request)
+    incoming_body = decode_request_body(await request.body(), request.headers)
+    incoming_payload = get_incoming_payload(incoming_body)
+    traffic_record = create_traffic_record(
+        request, path, incoming_body, should_stream(path, incoming_payload)
+    )
+    stage_start_time = observe_stage("parse_request", stage_start_time)
+    if is_batchable_embedding_request(request.method, path, incoming_payload):
+        embedding_response = await create_embedding_response(
+            client, incoming_payload, request.headers
+        )
+        capture_traffic(
+            traffic_record, "embedding_batch", embedding_response.status_code
+        )
+        return embedding_response
     outgoing_payload = await alter_payload(path, incoming_payload)
+    stage_start_time = observe_stage("alter_payload", stage_start_time)
     stream_enabled = should_stream(outgoing_url, incoming_payload)
     outgoing_query_params = get_outgoing_query_params(request, path)
-    logger.debug(
-        json.dumps(
-            {
-                "event": "start_redirection",
-                "data": {
-                    "incoming_path": path,
-                    "outgoing_url": outgoing_url,
-                    "incoming_headers": dict(request.headers),
-                    "outgoing_headers": outgoing_headers,
-                    "incoming_payload": incoming_payload,
-                    "outgoing_payload": outgoing_payload,
-                    "incoming_query_params": dict(request.query_params),
-                    "outgoing_query_params": outgoing_query_params,
-                },
-            }
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            LazyJson(
+                {
+                    "event": "start_redirection",
+                    "data": {
+                        "incoming_path": path,
+                        "outgoing_url": outgoing_url,
+                        "incoming_headers": dict(request.headers),
+                        "outgoing_headers": outgoing_headers,
+                        "incoming_payload": incoming_payload,
+                        "outgoing_payload": outgoing_payload,
+                        "incoming_query_params": dict(request.query_params),
+                        "outgoing_query_params": dict(outgoing_query_params),
+                    },
+                }
+            )
+        )
+    response_cache_key = get_response_cache_key(
+        request.method, outgoing_url, outgoing_query_params, outgoing_payload
+    )
+    cached_response = get_cached_response(response_cache_key)
+    semantic_cache_query = None
+    if cached_response is None:
+        semantic_cache_query = await get_semantic_cache_query(
+            client, request.method, outgoing_url, outgoing_payload
         )
+        cached_response = get_semantic_cached_response(semantic_cache_query)
+    stage_start_time = observe_stage("cache_lookup", stage_start_time)
+    if cached_response is not None:
+        capture_traffic(traffic_record, "cache", cached_response.status_code)
+        if stream_enabled:
+            return await create_streamed_response(request, cached_response)
+        return await create_unstreamed_response(cached_response)
+    try:
+        release_upstream_slot = await upstream_limiter.acquire(
+            get_request_priority(request, stream_enabled)
+        )
+    except HTTPException as e:
+        capture_traffic(traffic_record, "rejected", e.status_code)
+        raise
+    stage_start_time = observe_stage("admission", stage_start_time)
+    # Forward the original bytes when the payload is not altered
+    outgoing_body = (
+        incoming_body
+        if outgoing_payload is incoming_payload
+        else json_util.dumps(outgoing_payload)
     )
     try:
-        req = client.build_request(
-            method=request.method,
-            url=outgoing_url,
-            headers=outgoing_headers,
-            content=json.dumps(outgoing_payload),
-            params=outgoing_query_params,
+        response = await send_upstream_request(
+            client, request, path, outgoing_body, stream_enabled, outgoing_payload
         )
-        response = await client.send(req, stream=stream_enabled)
-    except httpx.ConnectError:
-        raise HTTPException(status_code=503, detail="Service unavailable")
+    except BaseException as e:
+        release_upstream_slot()
+        capture_traffic(traffic_record, "error", getattr(e, "status_code", 500))
+        raise
+    capture_upstream_traffic(
+        traffic_record, response, len(outgoing_body), stage_start_time
+    )
+    observe_stage("upstream_ttfb", stage_start_time)
+    is_cacheable = response_cache_key is not None or semantic_cache_query is not None
+
+    def on_stream_complete(chunks: list[tuple[float, bytes]]):
+        store_streamed_response(response_cache_key, response, chunks)
+        store_semantic_streamed_response(semantic_cache_query, response, chunks)
+
+    def on_complete(content: bytes):
+        store_unstreamed_response(response_cache_key, response, content)
+        store_semantic_unstreamed_response(semantic_cache_query, response, content)
+
     if stream_enabled:
-        return await create_streamed_response(request, response)
+        streamed_response = await create_streamed_response(
+            request,
+            response,
+            on_complete=on_stream_complete if is_cacheable else None,
+            on_close=release_upstream_slot,
+        )
+        # In case the stream is never consumed
+        streamed_response.background = BackgroundTask(release_upstream_slot)
+        return streamed_response
     else:
-        return await create_unstreamed_response(response)
+        try:
+            return await create_unstreamed_response(
+                response, on_complete=on_complete if is_cacheable else None
+            )
+        finally:
+            release_upstream_slot()
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=HTTP_PORT)
+    if WORKERS > 1:
+        # Every worker imports the app by itself
+        uvicorn.run("main:app", host="0.0.0.0", port=HTTP_PORT, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=HTTP_PORT)
@@ -0,0 +1,225 @@
+from abc import ABC, abstractmethod
+from typing import Any
+
+from config import LLM_API_URL
+
+
+class MessageAdapter(ABC):
+    """
+    Access the conversation and system prompt of a request payload.
+    Setters never mutate nested values in place: the payload is a shallow
+    copy of the incoming one, altered parts are replaced.
+    """
+
+    @abstractmethod
+    def get_conversation(self, payload: dict[str, Any]) -> list[Any] | None:
+        pass
+
+    @abstractmethod
+    def set_conversation(self, payload: dict[str, Any], conversation: list[Any]):
+        pass
+
+    @abstractmethod
+    def is_user_turn(self, message: Any) -> bool:
+        """
+        Whether the retained conversation can start at this message.
+        Tool (function) responses are never a user turn, so a tool call is
+        always kept together with its responses.
+        """
+        pass
+
+    @abstractmethod
+    def inject_system_prompt(
+        self, payload: dict[str, Any], data: str, create: bool = False
+    ):
+        """
+        Append data to the system prompt. If the payload has none (or one that
+        can not hold text), a system prompt is created only when create is
+        set (e.g., a summary replacing a dropped conversation), otherwise the
+        payload is left as it is.
+        """
+        pass
+
+    @abstractmethod
+    def get_tool_outputs(self, message: Any) -> list[Any]:
+        pass
+
+    @abstractmethod
+    def set_tool_outputs(self, message: Any, outputs: list[Any]) -> Any:
+        """Return a copy of the message with its tool outputs replaced."""
+        pass
+
+
+class GeminiAdapter(MessageAdapter):
+    """
+    Gemini generateContent payload:
+    {"systemInstruction": {"parts": [...]}, "contents": [...]}
+    """
+
+    def get_conversation(self, payload: dict[str, Any]) -> list[Any] | None:
+        contents = payload.get("contents")
+        return contents if isinstance(contents, list) else None
+
+    def set_conversation(self, payload: dict[str, Any], conversation: list[Any]):
+        payload["contents"] = conversation
+
+    def is_user_turn(self, message: Any) -> bool:
+        # Pivot example: {'role': 'user', 'parts': [{'text': '...'}]}
+        if not isinstance(message, dict) or message.get("role") != "user":
+            return False
+        parts = message.get("parts")
+        return isinstance(parts, list) and len(parts) > 0 and "text" in parts[0]
+
+    def inject_system_prompt(
+        self, payload: dict[str, Any], data: str, create: bool = False
+    ):
+        # REST API accepts both camelCase and snake_case field names
+        key = "systemInstruction"
+        if key not in payload and "system_instruction" in payload:
+            key = "system_instruction"
+        system_instruction = payload.get(key)
+        if not isinstance(system_instruction, dict):
+            system_instruction = {}
+        parts = system_instruction.get("parts")
+        if not isinstance(parts, list):
+            parts = []
+        if len(parts) > 0 and isinstance(parts[0], dict) and "text" in parts[0]:
+            first_part, *other_parts = parts
+            parts = [{**first_part, "text": first_part["text"] + data}, *other_parts]
+        elif create:
+            parts = [{"text": data.strip()}, *parts]
+        else:
+            return
+        payload[key] = {**system_instruction, "parts": parts}
+
+    def get_tool_outputs(self, message: Any) -> list[Any]:
+        # Tool output example: {'functionResponse': {'name': '...', 'response': {}}}
+        if not isinstance(message, dict) or not isinstance(message.get("parts"), list):
+            return []
+        return [
+            part["functionResponse"].get("response")
+            for part in message["parts"]
+            if self._is_function_response(part)
+        ]
+
+    def set_tool_outputs(self, message: Any, outputs: list[Any]) -> Any:
+        output_iterator = iter(outputs)
+        parts = []
+        for part in message["parts"]:
+            if self._is_function_response(part):
+                response = next(output_iterator)
+                if not isinstance(response, dict):
+                    # Function response must be an object
+                    response = {"content": response}
+                part = {
+                    **part,
+                    "functionResponse": {
+                        **part["functionResponse"],
+                        "response": response,
+                    },
+                }
+            parts.append(part)
+        return {**message, "parts": parts}
+
+    def _is_function_response(self, part: Any) -> bool:
+        return isinstance(part, dict) and isinstance(part.get("functionResponse"), dict)
+
+
+class OpenAIAdapter(MessageAdapter):
+    """
+    OpenAI chat completion payload:
+    {"messages": [{"role": "system", ...}, {"role": "user", ...}, ...]}
+    Leading system (or developer) messages are the system prompt, they are
+    not part of the conversation.
+    """
+
+    def get_conversation(self, payload: dict[str, Any]) -> list[Any] | None:
+        messages = payload.get("messages")
+        if not isinstance(messages, list):
+            return None
+        return messages[self._get_system_message_count(messages) :]
+
+    def set_conversation(self, payload: dict[str, Any], conversation: list[Any]):
+        messages = payload["messages"]
+        system_messages = messages[: self._get_system_message_count(messages)]
+        payload["messages"] = [*system_messages, *conversation]
+
+    def is_user_turn(self, message: Any) -> bool:
+        # Pivot example: {'role': 'user', 'content': '...'}
+        if not isinstance(message, dict) or message.get("role") != "user":
+            return False
+        content = message.get("content")
+        if isinstance(content, str):
+            return True
+        return (
+            isinstance(content, list)
+            and len(content) > 0
+            and isinstance(content[0], dict)
+            and content[0].get("type") == "text"
+        )
+
+    def inject_system_prompt(
+        self, payload: dict[str, Any], data: str, create: bool = False
+    ):
+        messages = payload.get("messages")
+        if not isinstance(messages, list):
+            return
+        if self._get_system_message_count(messages) > 0:
+            first_message, *other_messages = messages
+            content = first_message.get("content")
+            if isinstance(content, str):
+                first_message = {**first_message, "content": content + data}
+                payload["messages"] = [first_message, *other_messages]
+                return
+            if (
+                isinstance(content, list)
+                and len(content) > 0
+                and isinstance(content[0], dict)
+                and "text" in content[0]
+            ):
+                first_part, *other_parts = content
+                first_message = {
+                    **first_message,
+                    "content": [
+                        {**first_part, "text": first_part["text"] + data},
+                        *other_parts,
+                    ],
+                }
+                payload["messages"] = [first_message, *other_messages]
+                return
+        if not create:
+            return
+        payload["messages"] = [{"role": "system", "content": data.strip()}, *messages]
+
+    def get_tool_outputs(self, message: Any) -> list[Any]:
+        # Tool output example: {'role': 'tool', 'tool_call_id': '...', 'content': '...'}
+        if not isinstance(message, dict) or message.get("role") != "tool":
+            return []
+        return [message.get("content")]
+
+    def set_tool_outputs(self, message: Any, outputs: list[Any]) -> Any:
+        return {**message, "content": outputs[0]}
+
+    def _get_system_message_count(self, messages: list[Any]) -> int:
+        count = 0
+        for message in messages:
+            if not isinstance(message, dict):
+                break
+            if message.get("role") not in ("system", "developer"):
+                break
+            count += 1
+        return count
+
+
+gemini_adapter = GeminiAdapter()
+openai_adapter = OpenAIAdapter()
+
+
+def get_message_adapter(path: str) -> MessageAdapter | None:
+    if LLM_API_URL.startswith(
+        "https://generativelanguage.googleapis.com"
+    ) and path.startswith("v1beta/models"):
+        return gemini_adapter
+    if path.startswith("v1/chat/completions"):
+        return openai_adapter
+    return None
@@ -0,0 +1,218 @@
+import bisect
+import time
+from typing import Callable
+
+from config import METRICS_ENABLED
+
+Labels = tuple[str, ...]
+
+_DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+class Metric:
+    """
+    Metrics are only updated from the event loop thread, so plain
+    dictionary updates are safe and no lock is needed.
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, description: str, label_names: Labels = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self.render_samples(),
+        ]
+
+    def render_samples(self) -> list[str]:
+        return []
+
+    def format_labels(self, labels: Labels, extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.label_names, labels)
+        ]
+        if extra != "":
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join(pairs) + "}"
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, description: str, label_names: Labels = ()):
+        super().__init__(name, description, label_names)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, labels: Labels = ()):
+        if METRICS_ENABLED:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render_samples(self) -> list[str]:
+        return [
+            f"{self.name}{self.format_labels(labels)} {value}"
+            for labels, value in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, labels: Labels = ()):
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Labels = (),
+        buckets: tuple[float, ...] = _DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, description, label_names)
+        self.buckets = buckets
+        # labels -> count per bucket (the last one is +Inf)
+        self.bucket_counts: dict[Labels, list[int]] = {}
+        self.sums: dict[Labels, float] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        if not METRICS_ENABLED:
+            return
+        if labels not in self.bucket_counts:
+            self.bucket_counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        self.bucket_counts[labels][bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def render_samples(self) -> list[str]:
+        lines = []
+        for labels, bucket_counts in self.bucket_counts.items():
+            total = self.sums[labels]
+            count = sum(bucket_counts)
+            cumulative_count = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative_count += bucket_count
+                bucket_labels = self.format_labels(labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative_count}")
+            bucket_labels = self.format_labels(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{self.format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{self.format_labels(labels)} {count}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Metric whose values are read from other components on scrape."""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label_names: Labels,
+        callback: Callable[[], dict[Labels, float]],
+        type_name: str = "gauge",
+    ):
+        super().__init__(name, description, label_names)
+        self.callback = callback
+        self.type_name = type_name
+
+    def render_samples(self) -> list[str]:
+        return [
+            f"{self.name}{self.format_labels(labels)} {value}"
+            for labels, value in self.callback().items()
+        ]
+
+
+_registry: list[Metric] = []
+
+
+def register(metric: Metric) -> Metric:
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def observe_stage(stage: str, start_time: float) -> float:
+    """Record duration of a request stage, return current time."""
+    now = time.perf_counter()
+    stage_duration.observe(now - start_time, (stage,))
+    return now
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_duration = register(
+    Histogram(
+        "proxy_stage_duration_seconds",
+        "Duration of request processing stages",
+        ("stage",),
+    )
+)
+upstream_responses = register(
+    Counter(
+        "proxy_upstream_responses_total",
+        "Upstream responses by status code",
+        ("status_code",),
+    )
+)
+active_streams = register(Gauge("proxy_active_streams", "Streams being forwarded"))
+summarizer_calls = register(
+    Counter("proxy_summarizer_calls_total", "Summarizer LLM calls")
+)
+summarizer_tokens = register(
+    Counter("proxy_summarizer_tokens_total", "Summarizer LLM tokens", ("type",))
+)
+tool_output_tokens = register(
+    Counter(
+        "proxy_tool_output_tokens_total",
+        "Estimated tokens of compressed tool outputs, before and after compression",
+        ("type",),
+    )
+)
+context_cache_tokens = register(
+    Counter(
+        "proxy_context_cache_tokens_total",
+        "Estimated prompt tokens of requests using upstream cached contents",
+        ("type",),
+    )
+)
+admission_wait = register(
+    Histogram(
+        "proxy_admission_wait_seconds",
+        "Time spent waiting for an upstream slot",
+        ("priority",),
+    )
+)
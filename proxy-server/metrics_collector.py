@@ -0,0 +1,165 @@
+from admission_control import rate_limiter, upstream_limiter
+from cache.factory import get_async_cache
+from config import SEMANTIC_CACHE_ENABLED
+from context_cache import get_context_cache_manager
+from embedding_batcher import get_embedding_batcher
+from hedging import get_hedge_stats
+from metrics import CallbackMetric, Labels, register
+from payload_util import summarization_flight
+from response_cache import get_response_cache_stats
+from semantic_cache import get_semantic_cache
+from summarizer import get_summarizer
+from summary_tree import summary_node_flight
+from traffic_capture import get_traffic_capture
+from upstream_pool import get_upstream_pool
+
+# Summary cache stats, read from a worker thread before every scrape
+_summary_cache_stats: dict[str, int] = {}
+
+
+def register_collectors():
+    """Expose stats of proxy components, read on every scrape."""
+    register(
+        CallbackMetric(
+            "proxy_cache_stat",
+            "Cache statistics (hits, misses, evictions, entries, bytes)",
+            ("cache", "stat"),
+            _get_cache_stats,
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_cache_hit_ratio",
+            "Cache hits divided by cache lookups",
+            ("cache",),
+            _get_cache_hit_ratios,
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_summarization_flight",
+            "Summarization calls, deduplicated calls and calls in flight",
+            ("stat",),
+            lambda: _to_samples(summarization_flight.get_stats()),
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_summary_node_flight",
+            "Segment and merge summarizations, deduplicated and in flight",
+            ("stat",),
+            lambda: _to_samples(summary_node_flight.get_stats()),
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_summarizer",
+            "Summarizer calls in flight, timeouts, errors and fallbacks",
+            ("stat",),
+            lambda: _to_samples(get_summarizer().get_stats()),
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_context_cache",
+            "Upstream cached contents, hits, creations, renewals and evictions",
+            ("stat",),
+            lambda: _to_samples(get_context_cache_manager().get_stats()),
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_admission",
+            "Upstream admission queue depth, calls in flight and rejections",
+            ("stat",),
+            _get_admission_stats,
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_hedge",
+            "Hedge delay (seconds), requests, hedges fired, won and over budget",
+            ("route", "stat"),
+            _get_hedge_stats,
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_traffic_capture",
+            "Captured requests written to the trace file and dropped",
+            ("stat",),
+            lambda: _to_samples(get_traffic_capture().get_stats()),
+        )
+    )
+    register(
+        CallbackMetric(
+            "proxy_upstream_stat",
+            "Upstream EWMA latency (seconds), EWMA error rate and availability",
+            ("upstream", "stat"),
+            _get_upstream_stats,
+        )
+    )
+
+
+async def collect_cache_stats():
+    """
+    Read summary cache stats once per scrape, off the event loop and under
+    the lock of the cache (the disk tier is a SQLite connection).
+    """
+    global _summary_cache_stats
+    _summary_cache_stats = await get_async_cache().get_stats()
+
+
+def _get_all_cache_stats() -> dict[str, dict[str, int]]:
+    cache_stats = {"summary": _summary_cache_stats}
+    for route, stats in get_response_cache_stats().items():
+        cache_stats[f"response_{route}"] = stats
+    if SEMANTIC_CACHE_ENABLED:
+        cache_stats["semantic"] = get_semantic_cache().get_stats()
+    cache_stats["embedding"] = get_embedding_batcher().get_stats()
+    return cache_stats
+
+
+def _get_cache_stats() -> dict[Labels, float]:
+    return {
+        (cache_name, stat): value
+        for cache_name, stats in _get_all_cache_stats().items()
+        for stat, value in stats.items()
+    }
+
+
+def _get_cache_hit_ratios() -> dict[Labels, float]:
+    ratios = {}
+    for cache_name, stats in _get_all_cache_stats().items():
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        if lookups > 0:
+            ratios[(cache_name,)] = stats.get("hits", 0) / lookups
+    return ratios
+
+
+def _get_admission_stats() -> dict[Labels, float]:
+    samples = _to_samples(upstream_limiter.get_stats())
+    samples[("rate_limited_count",)] = rate_limiter.rejected_count
+    return samples
+
+
+def _get_upstream_stats() -> dict[Labels, float]:
+    samples = {}
+    for index, stats in enumerate(get_upstream_pool().get_stats()):
+        upstream = str(index)
+        samples[(upstream, "ewma_latency")] = stats["ewma_latency"]
+        samples[(upstream, "ewma_error_rate")] = stats["ewma_error_rate"]
+        samples[(upstream, "is_available")] = int(stats["is_available"])
+    return samples
+
+
+def _get_hedge_stats() -> dict[Labels, float]:
+    return {
+        (route, stat): value
+        for route, stats in get_hedge_stats().items()
+        for stat, value in stats.items()
+    }
+
+
+def _to_samples(stats: dict[str, float]) -> dict[Labels, float]:
+    return {(stat,): value for stat, value in stats.items()}
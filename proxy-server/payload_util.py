@@ -1,165 +1,315 @@
-import hashlib
-import json
-import re
-from copy import deepcopy
 from typing import Any
 
-from cache.factory import get_cache
+from cache.factory import get_async_cache
 from config import (
     LLM_ALIGNMENT,
-    LLM_API_KEY,
-    LLM_API_URL,
-    LLM_MODEL,
-    SUMMARIZATION_MODEL,
-    SUMMARIZATION_SYSTEM_PROMPT,
-    SUMMARIZATION_THRESHOLD,
+    SUMMARIZATION_MAX_PARALLEL_CALLS,
+    SUMMARIZATION_MERGE_FANOUT,
+    SUMMARIZATION_MODE,
+    SUMMARIZATION_RETAINED_TOKENS,
+    SUMMARIZATION_SEGMENT_TOKENS,
+    SUMMARIZATION_TOKEN_THRESHOLD,
+    TOOL_OUTPUT_COMPRESSION_ENABLED,
 )
-from log_util import logger
-from pydantic_ai import Agent
-from pydantic_ai.models.gemini import GeminiModel
-from pydantic_ai.providers.google_gla import GoogleGLAProvider
-from pydantic_ai.usage import Usage
+from log_util import LazyJson, logger
+from message_adapter import MessageAdapter, gemini_adapter, get_message_adapter
+from prefix_index import PrefixIndex, get_prefix_index
+from single_flight import SingleFlight
+from summarization_queue import get_summarization_queue
+from summary_tree import SummaryTree
+from token_util import estimate_conversation_tokens, estimate_text_tokens
+from tool_output_compressor import compress_tool_outputs
+
+summarization_flight = SingleFlight()
 
 
 async def alter_payload(path: str, original_payload: Any) -> Any:
+    """
+    Return the original payload if no alteration applies.
+    Otherwise, return a shallow copy: altered parts (system prompt and
+    conversation) are replaced, never mutated in place.
+    """
     if not isinstance(original_payload, dict):
         return original_payload
-    if LLM_API_URL.startswith(
-        "https://generativelanguage.googleapis.com"
-    ) and path.startswith("v1beta/models"):
-        payload = deepcopy(original_payload)
-        payload = maybe_inject_alignment(payload)
-        payload = await maybe_inject_summarization(payload)
-        return payload
-    return original_payload
+    adapter = get_message_adapter(path)
+    if adapter is None:
+        return original_payload
+    payload = dict(original_payload)
+    payload = maybe_inject_alignment(payload, adapter)
+    payload = await maybe_inject_summarization(payload, adapter)
+    payload = await maybe_compress_tool_outputs(payload, adapter)
+    if payload.keys() == original_payload.keys() and all(
+        value is original_payload[key] for key, value in payload.items()
+    ):
+        # Nothing replaced, so the original bytes can be forwarded
+        return original_payload
+    return payload
 
 
-def maybe_inject_alignment(payload: dict[str, Any]) -> dict[str, Any]:
-    return maybe_inject_system_prompt(payload, LLM_ALIGNMENT)
+def maybe_inject_alignment(
+    payload: dict[str, Any], adapter: MessageAdapter = gemini_adapter
+) -> dict[str, Any]:
+    if LLM_ALIGNMENT == "":
+        return payload
+    return maybe_inject_system_prompt(payload, LLM_ALIGNMENT, adapter)
 
 
-async def maybe_inject_summarization(payload: dict[str, Any]):
-    if "contents" not in payload:
+async def maybe_inject_summarization(
+    payload: dict[str, Any], adapter: MessageAdapter = gemini_adapter
+) -> dict[str, Any]:
+    conversation = adapter.get_conversation(payload)
+    if conversation is None:
         return payload
-    previous_summary, retained_conversation = extract_previous_summary(
-        payload["contents"]
-    )
-    new_summary, retained_conversation = await maybe_summarize(
-        previous_summary, retained_conversation
+    prefix_index = get_prefix_index(conversation)
+    previous_summary, recent_conversation = await extract_previous_summary(
+        conversation, prefix_index
     )
+    recent_message_tokens = get_recent_message_tokens(recent_conversation, prefix_index)
+    if SUMMARIZATION_MODE == "background":
+        # Forward with the best cached summary, the new one is for the next turn
+        if should_summarize(recent_conversation, recent_message_tokens, adapter):
+            get_summarization_queue().submit(
+                lambda: summarize_and_store(
+                    previous_summary, recent_conversation, prefix_index, adapter
+                )
+            )
+        new_summary, retained_conversation = previous_summary, recent_conversation
+    else:
+        new_summary, retained_conversation = await summarize_and_store(
+            previous_summary, recent_conversation, prefix_index, adapter
+        )
+    if new_summary == "<Empty>" and len(retained_conversation) == len(conversation):
+        # Short conversation, nothing summarized yet
+        return payload
+    # The summary replaces the summarized conversation, it must not be lost
     payload = maybe_inject_system_prompt(
-        payload, f"\n#Previous conversation: {new_summary}"
+        payload, f"\n#Previous conversation: {new_summary}", adapter, create=True
     )
-    payload["contents"] = retained_conversation
+    adapter.set_conversation(payload, retained_conversation)
+    log_token_saving(prefix_index, new_summary, retained_conversation)
     return payload
 
 
-async def maybe_summarize(
-    previous_summary: str, recent_conversation: list[str]
-) -> tuple[str, list[str]]:
-    to_be_summarized_conversation, retained_conversation = split_conversation(
-        recent_conversation
+async def maybe_compress_tool_outputs(
+    payload: dict[str, Any], adapter: MessageAdapter = gemini_adapter
+) -> dict[str, Any]:
+    if not TOOL_OUTPUT_COMPRESSION_ENABLED:
+        return payload
+    conversation = adapter.get_conversation(payload)
+    if conversation is None:
+        return payload
+    compressed_conversation = await compress_tool_outputs(conversation, adapter)
+    if compressed_conversation is not conversation:
+        adapter.set_conversation(payload, compressed_conversation)
+    return payload
+
+
+def get_recent_message_tokens(
+    recent_conversation: list[Any], prefix_index: PrefixIndex
+) -> list[int]:
+    return prefix_index.message_tokens[len(prefix_index) - len(recent_conversation) :]
+
+
+def log_token_saving(
+    prefix_index: PrefixIndex, summary: str, retained_conversation: list[Any]
+):
+    original_tokens = prefix_index.get_token_count()
+    retained_tokens = prefix_index.get_token_count(
+        len(prefix_index) - len(retained_conversation)
     )
-    if len(to_be_summarized_conversation) == 0:
+    summary_tokens = estimate_text_tokens(summary)
+    logger.info(
+        LazyJson(
+            {
+                "event": "summarization_token_saving",
+                "data": {
+                    "original_tokens": original_tokens,
+                    "retained_tokens": retained_tokens,
+                    "summary_tokens": summary_tokens,
+                    "saved_tokens": original_tokens - retained_tokens - summary_tokens,
+                },
+            }
+        )
+    )
+
+
+async def summarize_and_store(
+    previous_summary: str,
+    recent_conversation: list[Any],
+    prefix_index: PrefixIndex,
+    adapter: MessageAdapter = gemini_adapter,
+) -> tuple[str, list[Any]]:
+    recent_message_tokens = get_recent_message_tokens(recent_conversation, prefix_index)
+    if not should_summarize(recent_conversation, recent_message_tokens, adapter):
         return previous_summary, recent_conversation
-    if len(json.dumps(recent_conversation)) < SUMMARIZATION_THRESHOLD:
+    _, retained_conversation = split_conversation(
+        recent_conversation, recent_message_tokens, adapter
+    )
+    summary_key = prefix_index.get_key(len(prefix_index) - len(retained_conversation))
+    # Concurrent requests sharing the same prefix await a single summarization.
+    # Only the summary is shared, their tails (e.g., last user turn) may differ.
+    new_summary = await summarization_flight.run(
+        summary_key,
+        lambda: _summarize_and_store(
+            previous_summary, recent_conversation, prefix_index, summary_key, adapter
+        ),
+    )
+    if new_summary is None:
         return previous_summary, recent_conversation
-    to_be_summarized_conversation_str = json.dumps(to_be_summarized_conversation)
-    if LLM_API_URL.startswith("https://generativelanguage.googleapis.com"):
-        agent = Agent(
-            model=GeminiModel(
-                model_name=SUMMARIZATION_MODEL,
-                provider=GoogleGLAProvider(api_key=LLM_API_KEY),
-            ),
-            system_prompt=SUMMARIZATION_SYSTEM_PROMPT,
+    return new_summary, retained_conversation
+
+
+async def _summarize_and_store(
+    previous_summary: str,
+    recent_conversation: list[Any],
+    prefix_index: PrefixIndex,
+    summary_key: str,
+    adapter: MessageAdapter,
+) -> str | None:
+    """Return the summary of the prefix, None if it is not summarized."""
+    # Background jobs queued by earlier turns may have summarized it already
+    cached_summary = await get_async_cache().get(summary_key)
+    if cached_summary is not None:
+        return cached_summary
+    new_summary, retained_conversation, is_fallback = await maybe_summarize(
+        previous_summary, recent_conversation, prefix_index, adapter
+    )
+    if len(retained_conversation) == len(recent_conversation):
+        return None
+    if not is_fallback:
+        # Store the new summary under the prefix it covers, so the next turn
+        # can pick it up from the cache. Extracts are only a stopgap, the
+        # next turn summarizes the prefix again.
+        await get_async_cache().set(summary_key, new_summary)
+    return new_summary
+
+
+def should_summarize(
+    recent_conversation: list[Any],
+    recent_message_tokens: list[int] | None = None,
+    adapter: MessageAdapter = gemini_adapter,
+) -> bool:
+    if recent_message_tokens is None:
+        recent_message_tokens = estimate_conversation_tokens(recent_conversation)
+    to_be_summarized_conversation, _ = split_conversation(
+        recent_conversation, recent_message_tokens, adapter
+    )
+    if len(to_be_summarized_conversation) == 0:
+        return False
+    return sum(recent_message_tokens) >= SUMMARIZATION_TOKEN_THRESHOLD
+
+
+async def maybe_summarize(
+    previous_summary: str,
+    recent_conversation: list[Any],
+    prefix_index: PrefixIndex,
+    adapter: MessageAdapter = gemini_adapter,
+) -> tuple[str, list[Any], bool]:
+    """
+    Summarize everything before the retained conversation into a new summary.
+    Long unsummarized conversations are summarized segment by segment (see
+    SummaryTree).
+    Return the summary, the retained conversation, and whether the summary
+    is an extract (the summarizer failed).
+    """
+    recent_message_tokens = get_recent_message_tokens(recent_conversation, prefix_index)
+    if not should_summarize(recent_conversation, recent_message_tokens, adapter):
+        return previous_summary, recent_conversation, False
+    _, retained_conversation = split_conversation(
+        recent_conversation, recent_message_tokens, adapter
+    )
+    summary_tree = SummaryTree(
+        prefix_index,
+        SUMMARIZATION_SEGMENT_TOKENS,
+        SUMMARIZATION_MERGE_FANOUT,
+        SUMMARIZATION_MAX_PARALLEL_CALLS,
+    )
+    try:
+        new_summary, is_fallback = await summary_tree.summarize(
+            previous_summary,
+            len(prefix_index) - len(recent_conversation),
+            len(prefix_index) - len(retained_conversation),
         )
-        agent_run_result = await agent.run(
-            user_prompt=(
-                f"Previous conversation: {previous_summary}",
-                f"Recent conversation: {to_be_summarized_conversation_str}",
-                "Summarize the conversation into a single paragraph, retain important contexts so that the main assistant can continue the conversation",  # noqa
-            )
+    except Exception as e:
+        # Forwarding the whole conversation is better than failing the request
+        logger.warning(
+            LazyJson({"event": "summarization_error", "data": {"error": str(e)}})
         )
-        logger.info(
-            json.dumps(
-                {
-                    "event": "finish_summarization",
-                    "data": {
-                        "usage": usage_to_dict(agent_run_result.usage()),
-                        "new_summary": agent_run_result.output,
-                        "retained_conversation": retained_conversation,
-                    },
-                }
-            )
+        return previous_summary, recent_conversation, False
+    logger.info(
+        LazyJson(
+            {
+                "event": "finish_summarization",
+                "data": {
+                    "usage": summary_tree.usage,
+                    "new_summary": new_summary,
+                    "retained_conversation": retained_conversation,
+                },
+            }
         )
-        return agent_run_result.output, retained_conversation
-    return previous_summary, recent_conversation
-
-
-def usage_to_dict(usage: Usage) -> dict[str, Any]:
-    return {
-        "request_tokens": usage.request_tokens,
-        "response_tokens": usage.response_tokens,
-        "total_tokens": usage.total_tokens,
-        "details": usage.details,
-    }
+    )
+    return new_summary, retained_conversation, is_fallback
 
 
-def split_conversation(conversation: list[str]) -> tuple[list[str], list[str]]:
+def split_conversation(
+    conversation: list[Any],
+    message_tokens: list[int] | None = None,
+    adapter: MessageAdapter = gemini_adapter,
+) -> tuple[list[Any], list[Any]]:
     """
     Split conversation into two parts:
     - conversation to be summarized
     - conversation should be retained
-    We need to retain last part of conversation
+    We need to retain last part of conversation, starting from a user's chat,
+    and containing at least SUMMARIZATION_RETAINED_TOKENS tokens
     """
     if len(conversation) < 2:
         return [], conversation
-    # Pivot example: {'role': 'user', 'parts': [{'text': '...'}]}
+    if message_tokens is None:
+        message_tokens = estimate_conversation_tokens(conversation)
+    retained_tokens = message_tokens[-1]
     pivot = len(conversation) - 2
     while pivot > 0:
-        has_role = "role" in conversation[pivot]
-        is_user_role = has_role and conversation[pivot]["role"] == "user"
-        has_parts = is_user_role and "parts" in conversation[pivot]
-        has_part_list = has_parts and len(conversation[pivot]["parts"]) > 0
-        has_text = has_part_list and "text" in conversation[pivot]["parts"][0]
-        if has_text:
+        retained_tokens += message_tokens[pivot]
+        is_user_turn = adapter.is_user_turn(conversation[pivot])
+        if is_user_turn and retained_tokens >= SUMMARIZATION_RETAINED_TOKENS:
             return conversation[:pivot], conversation[pivot:]
         pivot -= 1
     return [], conversation
 
 
-def maybe_inject_system_prompt(payload: dict[str, Any], data: str) -> str:
-    has_system_instruction = "systemInstruction" in payload
-    has_parts = has_system_instruction and "parts" in payload["systemInstruction"]
-    has_parts_list = has_parts and len(payload["systemInstruction"]["parts"]) > 0
-    has_text = has_parts_list and "text" in payload["systemInstruction"]["parts"][0]
-    if has_text:
-        payload["systemInstruction"]["parts"][0]["text"] += data
+def maybe_inject_system_prompt(
+    payload: dict[str, Any],
+    data: str,
+    adapter: MessageAdapter = gemini_adapter,
+    create: bool = False,
+) -> dict[str, Any]:
+    adapter.inject_system_prompt(payload, data, create)
     return payload
 
 
-def extract_previous_summary(contents: list[Any]) -> tuple[str, list[Any]]:
-    pivot = get_summarization_pivot(contents)
+async def extract_previous_summary(
+    contents: list[Any], prefix_index: PrefixIndex | None = None
+) -> tuple[str, list[Any]]:
+    if prefix_index is None:
+        prefix_index = PrefixIndex(contents)
+    pivot = await get_summarization_pivot(contents, prefix_index)
     recent_conversation = contents[pivot:]
-    previous_summarization_key = get_summarization_key(contents[:pivot])
-    cache = get_cache()
-    if cache.key_exists(previous_summarization_key):
-        return cache.get(previous_summarization_key), recent_conversation
-    return "<Empty>", recent_conversation
+    if pivot == 0:
+        return "<Empty>", recent_conversation
+    previous_summary = await get_async_cache().get(prefix_index.get_key(pivot))
+    if previous_summary is None:
+        return "<Empty>", recent_conversation
+    return previous_summary, recent_conversation
 
 
-def get_summarization_pivot(contents: list[Any]):
-    pivot = len(contents)
-    cache = get_cache()
-    while pivot > 0:
-        if cache.key_exists(get_summarization_key(contents[:pivot])):
-            return pivot
-        pivot -= 1
-    return pivot
+async def get_summarization_pivot(
+    contents: list[Any], prefix_index: PrefixIndex | None = None
+) -> int:
+    if prefix_index is None:
+        prefix_index = PrefixIndex(contents)
+    return await prefix_index.find_longest_cached_prefix_async(get_async_cache())
 
 
-def get_summarization_key(contents: list[Any]):
-    content_str = json.dumps(contents)
-    hash_object = hashlib.md5(content_str.encode("utf-8"))
-    md5_hash = hash_object.hexdigest()
-    return md5_hash
+def get_summarization_key(contents: list[Any]) -> str:
+    return PrefixIndex(contents).get_key(len(contents))
@@ -0,0 +1,97 @@
+import hashlib
+import json
+from contextvars import ContextVar
+from typing import Any
+
+from cache.any_async_cache import AnyAsyncCache
+from cache.any_cache import AnyCache
+from token_util import estimate_message_tokens
+
+
+class PrefixIndex:
+    """
+    Rolling prefix hash over a conversation.
+    Every message is serialized and hashed exactly once, then chained into
+    the previous prefix digest, so `keys[i]` identifies `contents[:i]`.
+    Estimated tokens of every message are memoized by its digest.
+    Messages of `base` (the same objects, e.g., the retained part of a
+    summarized conversation) are not serialized again.
+    """
+
+    def __init__(self, contents: list[Any], base: "PrefixIndex | None" = None):
+        known_digests = {}
+        if base is not None:
+            # base keeps its messages alive, so their ids are not reused
+            known_digests = {
+                id(message): digest
+                for message, digest in zip(base.contents, base.message_digests)
+            }
+        self.contents = contents
+        self.message_digests: list[bytes] = []
+        self.message_tokens: list[int] = []
+        self.keys: list[str] = []
+        # token_prefix_sums[i] is the number of tokens in `contents[:i]`
+        self.token_prefix_sums: list[int] = [0]
+        prefix_digest = hashlib.md5(b"").digest()
+        self.keys.append(prefix_digest.hex())
+        for message in contents:
+            message_digest = known_digests.get(id(message))
+            if message_digest is None:
+                message_digest = get_message_digest(message)
+            message_tokens = estimate_message_tokens(message, message_digest)
+            self.message_digests.append(message_digest)
+            self.message_tokens.append(message_tokens)
+            self.token_prefix_sums.append(self.token_prefix_sums[-1] + message_tokens)
+            prefix_digest = hashlib.md5(prefix_digest + message_digest).digest()
+            self.keys.append(prefix_digest.hex())
+
+    def __len__(self) -> int:
+        return len(self.message_digests)
+
+    def get_key(self, length: int) -> str:
+        return self.keys[length]
+
+    def get_token_count(self, start: int = 0, end: int | None = None) -> int:
+        if end is None:
+            end = len(self.message_tokens)
+        return self.token_prefix_sums[end] - self.token_prefix_sums[start]
+
+    def find_longest_cached_prefix(self, cache: AnyCache) -> int:
+        return self._get_longest_pivot(cache.key_exists_many(self.keys[1:]))
+
+    async def find_longest_cached_prefix_async(self, cache: AnyAsyncCache) -> int:
+        return self._get_longest_pivot(await cache.key_exists_many(self.keys[1:]))
+
+    def _get_longest_pivot(self, existing_prefixes: list[bool]) -> int:
+        # existing_prefixes[i] tells whether contents[:i + 1] is cached
+        pivot = len(existing_prefixes)
+        while pivot > 0:
+            if existing_prefixes[pivot - 1]:
+                return pivot
+            pivot -= 1
+        return pivot
+
+
+# Last index built while serving the current request (asyncio tasks have
+# their own context), reused by later stages and hedged attempts
+_request_prefix_index: ContextVar[PrefixIndex | None] = ContextVar(
+    "request_prefix_index", default=None
+)
+
+
+def get_prefix_index(contents: list[Any]) -> PrefixIndex:
+    """
+    Index contents, reusing the digests of messages already indexed while
+    serving the current request (e.g., by alter_payload).
+    """
+    previous = _request_prefix_index.get()
+    if previous is not None and previous.contents is contents:
+        return previous
+    prefix_index = PrefixIndex(contents, previous)
+    _request_prefix_index.set(prefix_index)
+    return prefix_index
+
+
+def get_message_digest(message: Any) -> bytes:
+    message_str = json.dumps(message)
+    return hashlib.md5(message_str.encode("utf-8")).digest()
@@ -1,5 +1,6 @@
 from typing import Any
 
+from compression_util import get_accept_encoding
 from config import (
     ALLOW_CUSTOM_LLM,
     EMBEDDING_API_URL,
@@ -8,38 +9,55 @@ from config import (
     LLM_MODEL,
 )
 from fastapi import Request
+from httpx import URL
+from json_util import loads
 from starlette.datastructures import QueryParams
+from upstream_pool import Upstream
 
 
-async def get_incoming_payload(request: Request) -> dict[str, Any]:
+def get_incoming_payload(body: bytes) -> Any:
+    """Return parsed JSON body, or None if the body is empty or not JSON."""
+    if len(body) == 0:
+        return None
     try:
-        return await request.json()
-    except Exception:
-        return {}
+        return loads(body)
+    except ValueError:
+        return None
 
 
-def get_outgoing_request_header(path: str, request: Request):
-    # Note: Force no compression by setting Accept-Encoding to identity.
+def get_outgoing_request_header(
+    path: str, request: Request, upstream: Upstream | None = None
+):
+    api_key = LLM_API_KEY if upstream is None else upstream.api_key
+    # Compressed responses are forwarded as they are, so only accept
+    # encodings the client accepts as well
+    accept_encoding = get_accept_encoding(request.headers)
     if LLM_API_URL.startswith(
         "https://generativelanguage.googleapis.com"
     ) and path.startswith("v1beta/models"):
         return {
-            "X-Goog-Api-Key": LLM_API_KEY,
-            "Accept-Encoding": "identity",
+            "X-Goog-Api-Key": api_key,
+            "Accept-Encoding": accept_encoding,
         }
     elif path.startswith("v1/chat/completions"):
         return {
-            "Authorization": f"Bearer {LLM_API_KEY}",
-            "Accept-Encoding": "identity",
+            "Authorization": f"Bearer {api_key}",
+            "Accept-Encoding": accept_encoding,
         }
     elif path.startswith("v1/embeddings"):
         return {
-            "Accept-Encoding": "identity",
+            "Accept-Encoding": accept_encoding,
         }
-    return dict(request.headers)
+    # The body may be altered or decoded, the client computes its length again
+    return {
+        key: value
+        for key, value in request.headers.items()
+        if key.lower() not in ("content-length", "content-encoding")
+    }
 
 
-def get_outgoing_url(path: str) -> str:
+def get_outgoing_url(path: str, upstream: Upstream | None = None) -> str:
+    api_url = LLM_API_URL if upstream is None else upstream.url
     if LLM_API_URL.startswith(
         "https://generativelanguage.googleapis.com"
     ) and path.startswith("v1beta/models"):
@@ -54,28 +72,49 @@ def get_outgoing_url(path: str) -> str:
                 segment = ":".join(segment_parts)
                 path_parts[2] = segment
                 path = "/".join(path_parts)
-        return f"https://generativelanguage.googleapis.com/{path}"
+        # Path already contains API version (i.e., v1beta)
+        api_origin = URL(api_url).copy_with(path="/", query=None)
+        return f"{str(api_origin).rstrip('/')}/{path}"
     elif path.startswith("v1/chat/completions"):
-        return f"{LLM_API_URL}/chat/completions"
+        return f"{api_url}/chat/completions"
     elif path.startswith("v1/embeddings"):
         return f"{EMBEDDING_API_URL}/embeddings"
-    return f"{LLM_API_URL}/{path}"
+    return f"{api_url}/{path}"
 
 
 def get_outgoing_query_params(
-    request: Request, path: str
+    request: Request, path: str, upstream: Upstream | None = None
 ) -> QueryParams | dict[str, str] | None:
+    api_key = LLM_API_KEY if upstream is None else upstream.api_key
     query_params = request.query_params
     if LLM_API_URL.startswith(
         "https://generativelanguage.googleapis.com"
     ) and path.startswith("v1beta/models"):
         query_params = dict(query_params)
         if "key" in query_params:
-            query_params["key"] = LLM_API_KEY
+            query_params["key"] = api_key
     return query_params
 
 
-def should_stream(target_url: str, payload: dict[str, Any]) -> bool:
+def is_upstream_pool_path(path: str) -> bool:
+    """Embedding requests are not sent to LLM upstreams."""
+    return not path.startswith("v1/embeddings")
+
+
+def is_retryable_request(method: str, path: str) -> bool:
+    """
+    Whether the request can be sent again after a failed attempt, without
+    duplicating side effects (e.g., file uploads, cached contents, batches).
+    """
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return True
+    if path.startswith("v1beta/models/") and ":" in path:
+        # v1beta/models/<model-name>:generateContent
+        return path.rsplit(":", 1)[1] in ("generateContent", "countTokens")
+    return path.startswith("v1/chat/completions")
+
+
+def should_stream(target_url: str, payload: Any) -> bool:
     if ":streamGenerateContent" in target_url:
         return True
-    return bool(payload.get("stream", False))
+    return isinstance(payload, dict) and bool(payload.get("stream", False))
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import json
+from typing import Any
+
+import httpx
+from cache.any_cache import AnyCache
+from cache.memory_cache import MemoryCache
+from config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_GENERATE_MAX_BYTES,
+    RESPONSE_CACHE_GENERATE_TTL,
+    RESPONSE_CACHE_REPLAY_PACING,
+    RESPONSE_CACHE_STREAM_MAX_BYTES,
+    RESPONSE_CACHE_STREAM_TTL,
+)
+from log_util import LazyJson, logger
+
+# Order matters, ":generateContent" is not a substring of ":streamGenerateContent"
+_ROUTES = ["streamGenerateContent", "generateContent"]
+
+_route_caches: dict[str, AnyCache] = {
+    "generateContent": MemoryCache(
+        RESPONSE_CACHE_GENERATE_MAX_BYTES, RESPONSE_CACHE_GENERATE_TTL
+    ),
+    "streamGenerateContent": MemoryCache(
+        RESPONSE_CACHE_STREAM_MAX_BYTES, RESPONSE_CACHE_STREAM_TTL
+    ),
+}
+
+
+class ReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: list[tuple[float, str]], pacing: bool):
+        # Chunks are stored as text, so cache entries are JSON serializable
+        self.chunks = chunks
+        self.pacing = pacing
+
+    async def __aiter__(self):
+        for delay, chunk in self.chunks:
+            if self.pacing and delay > 0:
+                await asyncio.sleep(delay)
+            yield chunk.encode("utf-8")
+
+
+def get_response_cache_key(
+    method: str, outgoing_url: str, query_params: Any, payload: Any
+) -> str | None:
+    """
+    Return cache key of a generateContent/streamGenerateContent request,
+    or None if the request should not be cached.
+    """
+    if not RESPONSE_CACHE_ENABLED or method != "POST":
+        return None
+    route = _get_route(outgoing_url)
+    if route is None:
+        return None
+    normalized_query_params = sorted(
+        (k, v) for k, v in dict(query_params or {}).items() if k != "key"
+    )
+    normalized_request = json.dumps(
+        [outgoing_url, normalized_query_params, payload], sort_keys=True
+    )
+    request_hash = hashlib.md5(normalized_request.encode("utf-8")).hexdigest()
+    return f"{route}:{request_hash}"
+
+
+def get_cached_response(key: str | None) -> httpx.Response | None:
+    if key is None:
+        return None
+    entry = _get_route_cache(key).get(key)
+    if entry is None:
+        return None
+    logger.info(LazyJson({"event": "response_cache_hit", "data": {"key": key}}))
+    return create_response_from_entry(entry)
+
+
+def store_unstreamed_response(
+    key: str | None, response: httpx.Response, content: bytes
+):
+    if key is None:
+        return
+    entry = create_response_entry(response, content=content)
+    if entry is not None:
+        _get_route_cache(key).set(key, entry)
+
+
+def store_streamed_response(
+    key: str | None, response: httpx.Response, chunks: list[tuple[float, bytes]]
+):
+    if key is None:
+        return
+    entry = create_response_entry(response, chunks=chunks)
+    if entry is not None:
+        _get_route_cache(key).set(key, entry)
+
+
+def create_response_entry(
+    response: httpx.Response,
+    content: bytes | None = None,
+    chunks: list[tuple[float, bytes]] | None = None,
+) -> dict[str, Any] | None:
+    """
+    Turn a response into a JSON serializable cache entry.
+    Return None if the response should not be cached.
+    """
+    # Never cache errors
+    if not 200 <= response.status_code < 300:
+        return None
+    # The content is decoded, so its original encoding and length are dropped
+    headers = {
+        key: value
+        for key, value in response.headers.items()
+        if key.lower() not in ("content-encoding", "content-length")
+    }
+    entry = {"status_code": response.status_code, "headers": headers}
+    try:
+        if chunks is not None:
+            entry["chunks"] = [
+                (delay, chunk.decode("utf-8")) for delay, chunk in chunks
+            ]
+        else:
+            entry["content"] = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    return entry
+
+
+def create_response_from_entry(entry: dict[str, Any]) -> httpx.Response:
+    if "chunks" in entry:
+        return httpx.Response(
+            status_code=entry["status_code"],
+            headers=entry["headers"],
+            stream=ReplayStream(entry["chunks"], RESPONSE_CACHE_REPLAY_PACING),
+        )
+    return httpx.Response(
+        status_code=entry["status_code"],
+        headers=entry["headers"],
+        content=entry["content"].encode("utf-8"),
+    )
+
+
+def get_response_cache_stats() -> dict[str, dict[str, int]]:
+    return {route: cache.get_stats() for route, cache in _route_caches.items()}
+
+
+def _get_route(outgoing_url: str) -> str | None:
+    for route in _ROUTES:
+        if f":{route}" in outgoing_url:
+            return route
+    return None
+
+
+def _get_route_cache(key: str) -> AnyCache:
+    return _route_caches[key.split(":", 1)[0]]
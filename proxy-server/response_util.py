@@ -1,50 +1,114 @@
-from typing import Any
+import time
+from typing import Any, AsyncIterator, Callable
 
 import httpx
-import json
+from compression_util import (
+    ContentDecoder,
+    decode_content,
+    decode_content_prefix,
+    get_content_encoding,
+)
+from config import (
+    LOG_PAYLOAD_MAX_BYTES,
+    STREAM_DISCONNECT_CHECK_INTERVAL,
+    STREAM_LOG_MAX_BYTES,
+)
 from fastapi import Request
 from fastapi.responses import Response, StreamingResponse
-from log_util import logger
+from log_util import LazyJson, logger
+from metrics import active_streams, observe_stage
+
+# Flush incomplete server-sent event when it gets too large
+_MAX_SSE_BUFFER_BYTES = 1024 * 1024
 
 
 async def create_streamed_response(
-    request: Request, original_response: Response
+    request: Request,
+    original_response: Response,
+    on_complete: Callable[[list[tuple[float, bytes]]], None] | None = None,
+    on_close: Callable[[], None] | None = None,
 ) -> Response:
+    """
+    on_complete is called with (delay since previous chunk, chunk) pairs
+    once the whole stream has been forwarded to the client.
+    on_close is called once the upstream response is closed, even when the
+    stream is interrupted.
+    Compressed streams are forwarded as they are, chunks are only decoded
+    for logging and on_complete.
+    """
+    encoding = get_content_encoding(original_response.headers)
+
     async def content_stream():
-        full_content = ""
+        logged_content = bytearray()
+        is_logged_content_truncated = False
+        chunks: list[tuple[float, bytes]] = []
+        is_complete = False
+        # Compressed chunks are decoded as long as logging or on_complete needs them
+        decoder = None if encoding == "identity" else ContentDecoder(encoding)
+        is_decoder_failed = False
+        is_cacheable = on_complete is not None
+        stream_start_time = time.perf_counter()
+        active_streams.inc()
         try:
-            logger.info({"event": "stream_started"})
-            async for chunk in original_response.aiter_text(chunk_size=10):
+            logger.info(LazyJson({"event": "stream_started"}))
+            previous_chunk_time = time.monotonic()
+            previous_disconnect_check_time = previous_chunk_time
+            async for chunk in _iter_stream_chunks(original_response):
                 yield chunk
-                logger.debug(
-                    json.dumps(
-                        {
-                            "event": "stream_chunk",
-                            "chunk": chunk,
-                        }
-                    )
-                )
-                full_content += chunk
-                if await request.is_disconnected():
-                    logger.info({"event": "client_disconnected"})
-                    break
+                now = time.monotonic()
+                remaining_log_bytes = STREAM_LOG_MAX_BYTES - len(logged_content)
+                if decoder is not None:
+                    is_needed = is_cacheable or remaining_log_bytes > 0
+                    try:
+                        is_needed = is_needed and not is_decoder_failed
+                        chunk = decoder.decode(chunk) if is_needed else b""
+                    except Exception as e:
+                        logger.warning(
+                            LazyJson({"event": "stream_decode_error", "error": str(e)})
+                        )
+                        is_decoder_failed, is_cacheable, chunk = True, False, b""
+                if is_cacheable:
+                    chunks.append((now - previous_chunk_time, chunk))
+                previous_chunk_time = now
+                logger.debug(LazyJson({"event": "stream_chunk", "chunk": chunk}))
+                if len(chunk) > remaining_log_bytes:
+                    is_logged_content_truncated = True
+                if remaining_log_bytes > 0:
+                    logged_content += chunk[:remaining_log_bytes]
+                if (
+                    now - previous_disconnect_check_time
+                    >= STREAM_DISCONNECT_CHECK_INTERVAL
+                ):
+                    previous_disconnect_check_time = now
+                    if await request.is_disconnected():
+                        logger.info(LazyJson({"event": "client_disconnected"}))
+                        break
+            else:
+                is_complete = True
         except (
             httpx.ReadError,
             httpx.RemoteProtocolError,
             httpx.StreamClosed,
         ) as e:
-            logger.error({"event": "stream_error", "error": str(e)})
+            logger.error(LazyJson({"event": "stream_error", "error": str(e)}))
         finally:
             await original_response.aclose()
+            active_streams.dec()
+            observe_stage("stream", stream_start_time)
+            if on_close is not None:
+                on_close()
             logger.info(
-                json.dumps(
+                LazyJson(
                     {
                         "event": "stream_closed",
-                        "content": full_content,
+                        "content": bytes(logged_content),
+                        "is_content_truncated": is_logged_content_truncated,
                         "headers": _get_streaming_header(original_response),
                     }
                 )
             )
+        if is_complete and is_cacheable:
+            on_complete(chunks)
 
     return StreamingResponse(
         content_stream(),
@@ -53,6 +117,42 @@ async def create_streamed_response(
     )
 
 
+async def _iter_stream_chunks(original_response: Response) -> AsyncIterator[bytes]:
+    """
+    Forward upstream bytes as they are, without decoding them.
+    Uncompressed server-sent events are forwarded on event boundaries, so
+    every write carries one or more complete events.
+    """
+    content_type = original_response.headers.get("Content-Type", "")
+    is_compressed = get_content_encoding(original_response.headers) != "identity"
+    if not content_type.startswith("text/event-stream") or is_compressed:
+        async for chunk in original_response.aiter_raw():
+            yield chunk
+        return
+    buffer = bytearray()
+    async for chunk in original_response.aiter_raw():
+        buffer += chunk
+        boundary = _find_last_sse_boundary(buffer)
+        if boundary == 0 and len(buffer) < _MAX_SSE_BUFFER_BYTES:
+            continue
+        if boundary == 0:
+            boundary = len(buffer)
+        yield bytes(buffer[:boundary])
+        del buffer[:boundary]
+    if len(buffer) > 0:
+        yield bytes(buffer)
+
+
+def _find_last_sse_boundary(buffer: bytearray) -> int:
+    """Return the end position of the last complete event, or 0 if none."""
+    lf_position = buffer.rfind(b"\n\n")
+    crlf_position = buffer.rfind(b"\r\n\r\n")
+    return max(
+        lf_position + 2 if lf_position >= 0 else 0,
+        crlf_position + 4 if crlf_position >= 0 else 0,
+    )
+
+
 def _get_streaming_header(original_response: Response) -> dict[str, Any]:
     return {
         "Content-Type": original_response.headers.get(
@@ -62,24 +162,43 @@ def _get_streaming_header(original_response: Response) -> dict[str, Any]:
         **{
             k: v
             for k, v in original_response.headers.items()
-            if k.lower() not in ["connection", "content-encoding"]
+            if k.lower() != "connection"
         },
     }
 
 
-async def create_unstreamed_response(original_response: Response) -> Response:
-    content = await original_response.aread()
+async def create_unstreamed_response(
+    original_response: Response,
+    on_complete: Callable[[bytes], None] | None = None,
+) -> Response:
+    """
+    Compressed content is forwarded as it is, it is only decoded for logging
+    and on_complete.
+    """
+    if original_response.is_stream_consumed:
+        # e.g., cached responses, their content is already decoded
+        content, encoding = original_response.content, "identity"
+    else:
+        content = b"".join([chunk async for chunk in original_response.aiter_raw()])
+        encoding = get_content_encoding(original_response.headers)
     logger.info(
-        ijson.dumps(
+        LazyJson(
             {
                 "event": "full_response_body",
                 "status_code": original_response.status_code,
                 "headers": dict(original_response.headers),
-                "content": content,
+                "content": decode_content_prefix(
+                    content, encoding, LOG_PAYLOAD_MAX_BYTES
+                ),
             }
         )
     )
     await original_response.aclose()
+    if on_complete is not None:
+        try:
+            on_complete(decode_content(content, encoding))
+        except Exception as e:
+            logger.warning(LazyJson({"event": "decode_error", "error": str(e)}))
     return Response(
         content=content,
         status_code=original_response.status_code,
@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, Any
+
+import httpx
+from config import (
+    SEMANTIC_CACHE_CAPACITY,
+    SEMANTIC_CACHE_DIR,
+    SEMANTIC_CACHE_EMBEDDING_MODEL,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    WORKERS,
+)
+from embedding_batcher import EmbeddingError, get_embedding_batcher
+from log_util import LazyJson, logger
+from response_cache import create_response_entry, create_response_from_entry
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+class SemanticCacheQuery:
+    """
+    Final user turn embedding, together with the key of everything else in
+    the request (route, system prompt, previous turns, generation config).
+    Only requests sharing the same context can share a response.
+    """
+
+    def __init__(self, context_key: str, vector: "np.ndarray"):
+        self.context_key = context_key
+        self.vector = vector
+
+
+class SemanticCache:
+    def __init__(self, capacity: int, threshold: float, directory: str = ""):
+        # numpy is only imported when the semantic cache is used
+        from vector_index import VectorIndex
+
+        self.threshold = threshold
+        self.directory = directory
+        matrix_path = None
+        if directory != "":
+            matrix_path = os.path.join(directory, "vectors.npy")
+        self.index = VectorIndex(capacity, matrix_path)
+        self.rows: list[dict[str, Any] | None] = [None] * capacity
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def get(self, query: SemanticCacheQuery) -> dict[str, Any] | None:
+        for row, score in self.index.search(query.vector, self.threshold):
+            data = self.rows[row]
+            if data is not None and data["context_key"] == query.context_key:
+                self.hits += 1
+                self.index.touch(row)
+                logger.info(
+                    LazyJson({"event": "semantic_cache_hit", "data": {"score": score}})
+                )
+                return data["entry"]
+        self.misses += 1
+        return None
+
+    def set(self, query: SemanticCacheQuery, entry: dict[str, Any]):
+        row = self.index.add(query.vector)
+        self.rows[row] = {
+            "context_key": query.context_key,
+            "checksum": self.index.get_checksum(row),
+            "entry": entry,
+        }
+
+    def save(self):
+        if self.directory == "" or self.index.matrix is None:
+            return
+        self.index.flush()
+        with open(self._get_rows_path(), "w") as f:
+            json.dump(
+                {
+                    "size": self.index.size,
+                    "clock": self.index.clock,
+                    "last_used": self.index.last_used.tolist(),
+                    "rows": self.rows,
+                },
+                f,
+            )
+
+    def get_stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": self.index.size}
+
+    def _load(self):
+        if self.index.matrix is None or not os.path.isfile(self._get_rows_path()):
+            return
+        with open(self._get_rows_path()) as f:
+            state = json.load(f)
+        if len(state["rows"]) != len(self.rows):
+            return
+        # Reused rows are overwritten in the memory-mapped file right away, but
+        # rows.json is only written on shutdown. After a crash, a row holding
+        # another vector than its saved entry's is dropped.
+        rows = state["rows"]
+        for row, data in enumerate(rows):
+            if data is None or data.get("checksum") == self.index.get_checksum(row):
+                continue
+            rows[row] = None
+        self.rows = rows
+        self.index.size = state["size"]
+        self.index.clock = state["clock"]
+        self.index.last_used[:] = state["last_used"]
+
+    def _get_rows_path(self) -> str:
+        return os.path.join(self.directory, "rows.json")
+
+
+_semantic_cache: SemanticCache | None = None
+
+
+def get_semantic_cache() -> SemanticCache:
+    global _semantic_cache
+    if _semantic_cache is None:
+        # Workers can not share the memory-mapped index, keep it in memory
+        directory = SEMANTIC_CACHE_DIR if WORKERS == 1 else ""
+        _semantic_cache = SemanticCache(
+            SEMANTIC_CACHE_CAPACITY, SEMANTIC_CACHE_THRESHOLD, directory
+        )
+    return _semantic_cache
+
+
+async def get_semantic_cache_query(
+    client: httpx.AsyncClient, method: str, outgoing_url: str, payload: Any
+) -> SemanticCacheQuery | None:
+    """
+    Embed the final user turn of a chat/generateContent request.
+    Return None if the request should not go through the semantic cache.
+    """
+    if not SEMANTIC_CACHE_ENABLED or method != "POST":
+        return None
+    if not _is_semantic_cache_route(outgoing_url) or not isinstance(payload, dict):
+        return None
+    split_result = _split_final_user_turn(payload)
+    if split_result is None:
+        return None
+    final_user_text, context = split_result
+    vector = await _embed(client, final_user_text)
+    if vector is None:
+        return None
+    context_str = json.dumps([outgoing_url, context], sort_keys=True)
+    context_key = hashlib.md5(context_str.encode("utf-8")).hexdigest()
+    return SemanticCacheQuery(context_key, vector)
+
+
+def get_semantic_cached_response(
+    query: SemanticCacheQuery | None,
+) -> httpx.Response | None:
+    if query is None:
+        return None
+    entry = get_semantic_cache().get(query)
+    if entry is None:
+        return None
+    return create_response_from_entry(entry)
+
+
+def store_semantic_unstreamed_response(
+    query: SemanticCacheQuery | None, response: httpx.Response, content: bytes
+):
+    if query is None:
+        return
+    entry = create_response_entry(response, content=content)
+    if entry is not None:
+        get_semantic_cache().set(query, entry)
+
+
+def store_semantic_streamed_response(
+    query: SemanticCacheQuery | None,
+    response: httpx.Response,
+    chunks: list[tuple[float, bytes]],
+):
+    if query is None:
+        return
+    entry = create_response_entry(response, chunks=chunks)
+    if entry is not None:
+        get_semantic_cache().set(query, entry)
+
+
+async def warm_up_semantic_cache():
+    """Import numpy and load the index before the first request."""
+    if SEMANTIC_CACHE_ENABLED:
+        await asyncio.to_thread(get_semantic_cache)
+
+
+def save_semantic_cache():
+    if SEMANTIC_CACHE_ENABLED:
+        get_semantic_cache().save()
+
+
+def _is_semantic_cache_route(outgoing_url: str) -> bool:
+    if ":generateContent" in outgoing_url:
+        return True
+    if ":streamGenerateContent" in outgoing_url:
+        return True
+    return outgoing_url.endswith("/chat/completions")
+
+
+def _split_final_user_turn(payload: dict[str, Any]) -> tuple[str, Any] | None:
+    """
+    Return the final user turn text and the rest of the payload.
+    Return None if the final turn is not a plain user text.
+    """
+    if "contents" in payload:
+        conversation_key = "contents"
+        final_turn = _get_final_turn(payload["contents"])
+        if final_turn is None or final_turn.get("role", "user") != "user":
+            return None
+        texts = [part.get("text") for part in final_turn.get("parts", [])]
+    elif "messages" in payload:
+        conversation_key = "messages"
+        final_turn = _get_final_turn(payload["messages"])
+        if final_turn is None or final_turn.get("role") != "user":
+            return None
+        content = final_turn.get("content")
+        if isinstance(content, str):
+            texts = [content]
+        elif isinstance(content, list):
+            texts = [part.get("text") for part in content if isinstance(part, dict)]
+        else:
+            return None
+    else:
+        return None
+    if len(texts) == 0 or any(not isinstance(text, str) for text in texts):
+        return None
+    context = {**payload, conversation_key: payload[conversation_key][:-1]}
+    return "\n".join(texts), context
+
+
+def _get_final_turn(conversation: Any) -> dict[str, Any] | None:
+    if not isinstance(conversation, list) or len(conversation) == 0:
+        return None
+    if not isinstance(conversation[-1], dict):
+        return None
+    return conversation[-1]
+
+
+async def _embed(client: httpx.AsyncClient, text: str) -> "np.ndarray | None":
+    import numpy as np
+
+    try:
+        embeddings = await get_embedding_batcher().embed(
+            client, SEMANTIC_CACHE_EMBEDDING_MODEL, [text]
+        )
+    except EmbeddingError as e:
+        logger.warning(
+            LazyJson(
+                {"event": "semantic_cache_embedding_error", "data": {"error": str(e)}}
+            )
+        )
+        return None
+    return np.asarray(embeddings[0], dtype=np.float32)
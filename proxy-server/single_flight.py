@@ -0,0 +1,33 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls sharing the same key into a single execution.
+    Callers arriving while a call is in flight await its result instead of
+    starting their own.
+    """
+
+    def __init__(self):
+        self.in_flight: dict[str, asyncio.Future] = {}
+        self.calls = 0
+        self.deduplicated = 0
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if key in self.in_flight:
+            self.deduplicated += 1
+            return await asyncio.shield(self.in_flight[key])
+        self.calls += 1
+        task = asyncio.ensure_future(fn())
+        self.in_flight[key] = task
+        task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # Shield the shared task, so one cancelled caller doesn't cancel the others
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "calls": self.calls,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self.in_flight),
+        }
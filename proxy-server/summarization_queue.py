@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+from config import SUMMARIZATION_QUEUE_SIZE, SUMMARIZATION_WORKER_COUNT
+from log_util import LazyJson, logger
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class SummarizationQueue:
+    """
+    Bounded queue of summarization jobs processed by background workers.
+    Jobs submitted while the queue is full are dropped, the next turn will
+    submit them again.
+    """
+
+    def __init__(self, worker_count: int, max_size: int):
+        self.worker_count = worker_count
+        self.queue: asyncio.Queue[Job] = asyncio.Queue(maxsize=max_size)
+        self.workers: list[asyncio.Task] = []
+        self.dropped = 0
+
+    def start(self):
+        if len(self.workers) > 0:
+            return
+        self.workers = [
+            asyncio.create_task(self._work()) for _ in range(self.worker_count)
+        ]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(self, job: Job) -> bool:
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(
+                LazyJson(
+                    {
+                        "event": "summarization_job_dropped",
+                        "data": {"queue_size": self.queue.qsize()},
+                    }
+                )
+            )
+            return False
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(
+                    LazyJson(
+                        {"event": "summarization_job_error", "data": {"error": str(e)}}
+                    )
+                )
+            finally:
+                self.queue.task_done()
+
+
+_summarization_queue: SummarizationQueue | None = None
+
+
+def get_summarization_queue() -> SummarizationQueue:
+    global _summarization_queue
+    if _summarization_queue is None:
+        _summarization_queue = SummarizationQueue(
+            SUMMARIZATION_WORKER_COUNT, SUMMARIZATION_QUEUE_SIZE
+        )
+    return _summarization_queue
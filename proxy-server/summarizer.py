@@ -0,0 +1,209 @@
+import asyncio
+import threading
+from typing import TYPE_CHECKING, Any
+
+import httpx
+from config import (
+    SUMMARIZATION_API_KEY,
+    SUMMARIZATION_API_URL,
+    SUMMARIZATION_MODEL,
+    SUMMARIZATION_SYSTEM_PROMPT,
+    SUMMARIZER_FALLBACK_TOKENS,
+    SUMMARIZER_MAX_CONCURRENCY,
+    SUMMARIZER_TIMEOUT,
+)
+from log_util import LazyJson, logger
+from metrics import summarizer_calls, summarizer_tokens
+from text_digest import create_extractive_digest
+
+if TYPE_CHECKING:
+    from pydantic_ai import Agent
+    from pydantic_ai.models import Model
+    from pydantic_ai.usage import Usage
+
+
+class Summarizer:
+    """
+    Long-lived summarization agent.
+    At most max_concurrency calls run at once, and every call (waiting for
+    a slot included) must finish within `timeout` seconds. When the
+    summarizer is slow, saturated or failing, a deterministic extractive
+    summary is returned instead, so requests are never stalled.
+    pydantic_ai takes most of the proxy import time, so the agent is only
+    created by warm_up (in the background) or the first call.
+    """
+
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient,
+        max_concurrency: int,
+        timeout: float,
+        fallback_tokens: int,
+    ):
+        self.http_client = http_client
+        self.agent: Agent | None = None
+        self.agent_lock = threading.Lock()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.timeout = timeout
+        self.fallback_tokens = fallback_tokens
+        self.in_flight = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.fallbacks = 0
+
+    async def summarize(
+        self,
+        user_prompt: tuple[str, ...],
+        fallback_text: str,
+        fallback_tokens: int | None = None,
+    ) -> tuple[str, dict[str, Any]]:
+        """
+        Return the summary and token usage. Usage contains `fallback: True`
+        if the summary is an extract of fallback_text.
+        """
+        try:
+            agent_run_result = await asyncio.wait_for(
+                self._run(user_prompt), self.timeout
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return self._fallback("timeout", fallback_text, fallback_tokens)
+        except Exception as e:
+            self.errors += 1
+            return self._fallback(str(e), fallback_text, fallback_tokens)
+        usage = usage_to_dict(agent_run_result.usage())
+        summarizer_calls.inc()
+        summarizer_tokens.inc(usage["request_tokens"] or 0, ("request",))
+        summarizer_tokens.inc(usage["response_tokens"] or 0, ("response",))
+        return agent_run_result.output, usage
+
+    async def warm_up(self):
+        """
+        Create the agent and open a connection to the summarization API
+        before the first call.
+        """
+        await asyncio.to_thread(self._get_agent)
+        try:
+            await self.http_client.get(SUMMARIZATION_API_URL, timeout=self.timeout)
+        except httpx.HTTPError as e:
+            logger.warning(
+                LazyJson(
+                    {"event": "summarizer_warm_up_error", "data": {"error": str(e)}}
+                )
+            )
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+        }
+
+    async def _run(self, user_prompt: tuple[str, ...]) -> Any:
+        agent = self.agent
+        if agent is None:
+            # Imported on a thread, so other requests are still served
+            agent = await asyncio.to_thread(self._get_agent)
+        async with self.semaphore:
+            self.in_flight += 1
+            try:
+                return await agent.run(user_prompt=user_prompt)
+            finally:
+                self.in_flight -= 1
+
+    def _get_agent(self) -> "Agent":
+        with self.agent_lock:
+            if self.agent is None:
+                from pydantic_ai import Agent
+
+                self.agent = Agent(
+                    model=create_summarization_model(self.http_client),
+                    system_prompt=SUMMARIZATION_SYSTEM_PROMPT,
+                )
+            return self.agent
+
+    def _fallback(
+        self, error: str, fallback_text: str, fallback_tokens: int | None
+    ) -> tuple[str, dict[str, Any]]:
+        self.fallbacks += 1
+        logger.warning(
+            LazyJson({"event": "summarizer_fallback", "data": {"error": error}})
+        )
+        if fallback_tokens is None:
+            fallback_tokens = self.fallback_tokens
+        summary = create_extractive_digest(fallback_text, fallback_tokens)
+        usage = {
+            "request_tokens": 0,
+            "response_tokens": 0,
+            "total_tokens": 0,
+            "details": None,
+            "fallback": True,
+        }
+        return summary, usage
+
+
+_summarizer: Summarizer | None = None
+
+
+def create_summarizer(
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> Summarizer:
+    """
+    Create the summarizer, calls go through the given transport (i.e., the
+    connection pool of upstream requests).
+    The summarizer has its own client, since providers set their base URL and
+    authentication headers on it.
+    """
+    global _summarizer
+    _summarizer = Summarizer(
+        httpx.AsyncClient(transport=transport, timeout=SUMMARIZER_TIMEOUT),
+        SUMMARIZER_MAX_CONCURRENCY,
+        SUMMARIZER_TIMEOUT,
+        SUMMARIZER_FALLBACK_TOKENS,
+    )
+    return _summarizer
+
+
+def get_summarizer() -> Summarizer:
+    if _summarizer is None:
+        # Outside of the proxy lifespan (e.g., benchmarks)
+        return create_summarizer()
+    return _summarizer
+
+
+def create_summarization_model(http_client: httpx.AsyncClient) -> "Model":
+    """
+    Gemini API is used through its native client, any other URL is
+    considered an OpenAI compatible endpoint (e.g., OpenAI, Ollama, vLLM).
+    """
+    if SUMMARIZATION_API_URL.startswith("https://generativelanguage.googleapis.com"):
+        from pydantic_ai.models.gemini import GeminiModel
+        from pydantic_ai.providers.google_gla import GoogleGLAProvider
+
+        return GeminiModel(
+            model_name=SUMMARIZATION_MODEL,
+            provider=GoogleGLAProvider(
+                api_key=SUMMARIZATION_API_KEY, http_client=http_client
+            ),
+        )
+    from pydantic_ai.models.openai import OpenAIModel
+    from pydantic_ai.providers.openai import OpenAIProvider
+
+    return OpenAIModel(
+        model_name=SUMMARIZATION_MODEL,
+        provider=OpenAIProvider(
+            base_url=SUMMARIZATION_API_URL,
+            api_key=SUMMARIZATION_API_KEY,
+            http_client=http_client,
+        ),
+    )
+
+
+def usage_to_dict(usage: "Usage") -> dict[str, Any]:
+    return {
+        "request_tokens": usage.request_tokens,
+        "response_tokens": usage.response_tokens,
+        "total_tokens": usage.total_tokens,
+        "details": usage.details,
+    }
@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import json
+
+from cache.factory import get_async_cache
+from prefix_index import PrefixIndex
+from single_flight import SingleFlight
+from summarizer import get_summarizer
+
+# Hard limit of summarizer input, for segments made of a single huge message
+_CHARS_PER_TOKEN = 4
+
+summary_node_flight = SingleFlight()
+
+
+class SummaryTree:
+    """
+    Incremental, hierarchical summary of a conversation.
+    The conversation since the previous summary is split into consecutive
+    segments of about segment_tokens tokens. Every complete segment is
+    summarized on its own (in parallel), and every complete group of
+    `fanout` consecutive summaries is merged into a summary of the next
+    level. These summaries are cached by content hash, so a segment is only
+    sent to the summarizer once.
+    The new summary combines the previous summary, the summaries that are
+    not merged yet (at most fanout - 1 per level), and the last segment.
+    The input of every summarizer call is bounded, no matter how long the
+    conversation since the previous summary is.
+    """
+
+    def __init__(
+        self,
+        prefix_index: PrefixIndex,
+        segment_tokens: int,
+        fanout: int,
+        max_parallel_calls: int,
+    ):
+        self.prefix_index = prefix_index
+        self.segment_tokens = segment_tokens
+        self.fanout = max(fanout, 2)
+        self.semaphore = asyncio.Semaphore(max_parallel_calls)
+        self.usage = {
+            "calls": 0,
+            "fallbacks": 0,
+            "request_tokens": 0,
+            "response_tokens": 0,
+            "max_call_request_tokens": 0,
+        }
+
+    def get_segments(self, start: int, end: int) -> list[tuple[int, int]]:
+        """
+        Split contents[start:end] into (start, stop) segments. Boundaries only
+        depend on previous messages, so they are stable as the conversation
+        grows (only the last segment changes).
+        """
+        segments = []
+        tokens = 0
+        for index in range(start, end):
+            message_tokens = self.prefix_index.message_tokens[index]
+            if index > start and tokens + message_tokens > self.segment_tokens:
+                segments.append((start, index))
+                start, tokens = index, 0
+            tokens += message_tokens
+        if start < end:
+            segments.append((start, end))
+        return segments
+
+    async def summarize(
+        self, previous_summary: str, start: int, end: int
+    ) -> tuple[str, bool]:
+        """
+        Summarize contents[:end], previous_summary covers contents[:start].
+        Return the summary, and whether it is (or is built on) an extract.
+        """
+        *complete_segments, (tail_start, tail_stop) = self.get_segments(start, end)
+        nodes = await asyncio.gather(
+            *[self._summarize_segment(start, stop) for start, stop in complete_segments]
+        )
+        is_degraded = any(is_fallback for _, _, is_fallback in nodes)
+        # Summaries that are not merged yet, oldest first
+        summaries = []
+        while len(nodes) >= self.fanout:
+            merged_length = len(nodes) - len(nodes) % self.fanout
+            summaries = [summary for _, summary, _ in nodes[merged_length:]] + summaries
+            groups = [
+                nodes[index : index + self.fanout]
+                for index in range(0, merged_length, self.fanout)
+            ]
+            nodes = await asyncio.gather(*[self._merge(group) for group in groups])
+            is_degraded = is_degraded or any(is_fallback for _, _, is_fallback in nodes)
+        summaries = [summary for _, summary, _ in nodes] + summaries
+        if start > 0 and previous_summary != "<Empty>":
+            summaries = [previous_summary, *summaries]
+        previous_summaries_str = "<Empty>"
+        if len(summaries) > 0:
+            previous_summaries_str = self._get_summaries_str(summaries)
+        summary, is_fallback = await self._summarize(
+            (
+                f"Previous conversation: {previous_summaries_str}",
+                f"Recent conversation: {self._get_segment_str(tail_start, tail_stop)}",
+                "Summarize the conversation into a single paragraph, retain important contexts so that the main assistant can continue the conversation",  # noqa
+            ),
+            "\n".join([*summaries, self._get_segment_lines(tail_start, tail_stop)]),
+        )
+        return summary, is_fallback or is_degraded
+
+    async def _summarize_segment(self, start: int, stop: int) -> tuple[str, str, bool]:
+        digests = self.prefix_index.message_digests[start:stop]
+        key = hashlib.md5(b"segment" + b"".join(digests)).hexdigest()
+        user_prompt = (
+            f"Conversation segment: {self._get_segment_str(start, stop)}",
+            "Summarize the conversation segment into a single paragraph, retain important contexts so that the main assistant can continue the conversation",  # noqa
+        )
+        fallback_text = self._get_segment_lines(start, stop)
+        summary, is_fallback = await self._get_or_summarize(
+            key, user_prompt, fallback_text
+        )
+        return key, summary, is_fallback
+
+    async def _merge(self, group: list[tuple[str, str, bool]]) -> tuple[str, str, bool]:
+        child_keys = ",".join(child_key for child_key, _, _ in group)
+        key = hashlib.md5(f"merge{child_keys}".encode("utf-8")).hexdigest()
+        summaries = [summary for _, summary, _ in group]
+        summaries_str = self._get_summaries_str(summaries)
+        user_prompt = (
+            f"Consecutive summaries, oldest first:\n{summaries_str}",
+            "Merge the summaries into a single paragraph, retain important contexts so that the main assistant can continue the conversation",  # noqa
+        )
+        fallback_text = "\n".join(summaries)
+        is_degraded = any(is_fallback for _, _, is_fallback in group)
+        summary, is_fallback = await self._get_or_summarize(
+            key, user_prompt, fallback_text, is_degraded
+        )
+        return key, summary, is_fallback
+
+    async def _get_or_summarize(
+        self,
+        key: str,
+        user_prompt: tuple[str, ...],
+        fallback_text: str,
+        is_degraded: bool = False,
+    ) -> tuple[str, bool]:
+        # Concurrent requests sharing a segment await a single summarization
+        return await summary_node_flight.run(
+            key,
+            lambda: self._load_or_summarize(
+                key, user_prompt, fallback_text, is_degraded
+            ),
+        )
+
+    async def _load_or_summarize(
+        self,
+        key: str,
+        user_prompt: tuple[str, ...],
+        fallback_text: str,
+        is_degraded: bool,
+    ) -> tuple[str, bool]:
+        """
+        Return the summary, and whether it is an extract. A summary of
+        extracts (is_degraded) counts as an extract.
+        """
+        summary = await get_async_cache().get(key)
+        if summary is not None:
+            return summary, False
+        summary, is_fallback = await self._summarize(user_prompt, fallback_text)
+        is_fallback = is_fallback or is_degraded
+        # Extracts are only a stopgap, the summarizer gets another chance
+        if not is_fallback:
+            await get_async_cache().set(key, summary)
+        return summary, is_fallback
+
+    async def _summarize(
+        self, user_prompt: tuple[str, ...], fallback_text: str
+    ) -> tuple[str, bool]:
+        async with self.semaphore:
+            summary, usage = await get_summarizer().summarize(
+                user_prompt, fallback_text
+            )
+        is_fallback = usage.get("fallback", False)
+        self.usage["calls"] += 1
+        self.usage["fallbacks"] += 1 if is_fallback else 0
+        self.usage["request_tokens"] += usage["request_tokens"] or 0
+        self.usage["response_tokens"] += usage["response_tokens"] or 0
+        self.usage["max_call_request_tokens"] = max(
+            self.usage["max_call_request_tokens"], usage["request_tokens"] or 0
+        )
+        return summary, is_fallback
+
+    def _get_segment_str(self, start: int, stop: int) -> str:
+        return self._limit(json.dumps(self.prefix_index.contents[start:stop]))
+
+    def _get_segment_lines(self, start: int, stop: int) -> str:
+        # One message per line, so extracts keep whole messages
+        return "\n".join(
+            json.dumps(message) for message in self.prefix_index.contents[start:stop]
+        )
+
+    def _get_summaries_str(self, summaries: list[str]) -> str:
+        if len(summaries) == 1:
+            return self._limit(summaries[0])
+        return self._limit(
+            "\n".join(
+                f"Summary {index + 1}: {summary}"
+                for index, summary in enumerate(summaries)
+            )
+        )
+
+    def _limit(self, text: str) -> str:
+        max_chars = self.segment_tokens * _CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        return text[:max_chars] + " ...(truncated)"
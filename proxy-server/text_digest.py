@@ -0,0 +1,71 @@
+# Digest sizes are estimated from characters
+_CHARS_PER_TOKEN = 4
+
+
+def create_extractive_digest(text: str, max_tokens: int) -> str:
+    """
+    Deterministic digest: trailing spaces are removed, runs of repeated lines
+    are collapsed, overly long lines are cut, then the first and last lines
+    are kept within max_tokens.
+    """
+    max_chars = max_tokens * _CHARS_PER_TOKEN
+    original_lines = text.splitlines()
+    lines = [
+        _limit_line(line, max_chars // 4)
+        for line in _collapse_repeated_lines(original_lines)
+    ]
+    head_length, tail_length = 0, 0
+    used_chars = 0
+    # Alternate between head and tail, so both ends are represented
+    while head_length + tail_length < len(lines):
+        if head_length <= tail_length:
+            line = lines[head_length]
+        else:
+            line = lines[len(lines) - 1 - tail_length]
+        if used_chars + len(line) + 1 > max_chars:
+            break
+        used_chars += len(line) + 1
+        if head_length <= tail_length:
+            head_length += 1
+        else:
+            tail_length += 1
+    header = (
+        f"[Compressed by proxy, originally {len(original_lines)} "
+        f"lines and {len(text)} characters]"
+    )
+    omitted_length = len(lines) - head_length - tail_length
+    if omitted_length == 0:
+        return "\n".join([header, *lines])
+    return "\n".join(
+        [
+            header,
+            *lines[:head_length],
+            f"[... {omitted_length} lines omitted ...]",
+            *lines[len(lines) - tail_length :],
+        ]
+    )
+
+
+def _collapse_repeated_lines(lines: list[str]) -> list[str]:
+    collapsed_lines = []
+    previous_line = None
+    repeat_count = 0
+    for line in lines:
+        line = line.rstrip()
+        if line == previous_line:
+            repeat_count += 1
+            continue
+        if repeat_count > 0:
+            collapsed_lines.append(f"[previous line repeated {repeat_count} times]")
+        collapsed_lines.append(line)
+        previous_line = line
+        repeat_count = 0
+    if repeat_count > 0:
+        collapsed_lines.append(f"[previous line repeated {repeat_count} times]")
+    return collapsed_lines
+
+
+def _limit_line(line: str, max_chars: int) -> str:
+    if len(line) <= max_chars:
+        return line
+    return f"{line[:max_chars]} [... {len(line) - max_chars} characters omitted]"
@@ -0,0 +1,69 @@
+import math
+import re
+from collections import OrderedDict
+from typing import Any
+
+# Words, digit runs, and single symbols
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+_WORD_CHARS_PER_TOKEN = 4
+_NON_ASCII_WORD_CHARS_PER_TOKEN = 2
+_DIGITS_PER_TOKEN = 3
+# Role and structure overhead of every message
+_MESSAGE_OVERHEAD_TOKENS = 4
+_MEMO_CAPACITY = 10000
+
+_message_token_memo: OrderedDict[bytes, int] = OrderedDict()
+
+
+def estimate_text_tokens(text: str) -> int:
+    """
+    Fast local approximation of LLM tokenizers (no vocabulary needed).
+    Long words are split into several tokens, non-ASCII words (e.g., CJK)
+    are split more aggressively.
+    """
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        part = match.group()
+        if part.isdigit():
+            tokens += math.ceil(len(part) / _DIGITS_PER_TOKEN)
+        elif len(part) == 1:
+            tokens += 1
+        elif part.isascii():
+            tokens += math.ceil(len(part) / _WORD_CHARS_PER_TOKEN)
+        else:
+            tokens += math.ceil(len(part) / _NON_ASCII_WORD_CHARS_PER_TOKEN)
+    return tokens
+
+
+def estimate_message_tokens(message: Any, digest: bytes | None = None) -> int:
+    """
+    Estimate tokens of a conversation message.
+    When digest is given, the result is memoized, so every message is only
+    tokenized once across requests.
+    """
+    if digest is None:
+        return _MESSAGE_OVERHEAD_TOKENS + _estimate_value_tokens(message)
+    if digest in _message_token_memo:
+        _message_token_memo.move_to_end(digest)
+        return _message_token_memo[digest]
+    tokens = _MESSAGE_OVERHEAD_TOKENS + _estimate_value_tokens(message)
+    _message_token_memo[digest] = tokens
+    if len(_message_token_memo) > _MEMO_CAPACITY:
+        _message_token_memo.popitem(last=False)
+    return tokens
+
+
+def estimate_conversation_tokens(conversation: list[Any]) -> list[int]:
+    return [estimate_message_tokens(message) for message in conversation]
+
+
+def _estimate_value_tokens(value: Any) -> int:
+    if isinstance(value, str):
+        return estimate_text_tokens(value)
+    if isinstance(value, dict):
+        return sum(_estimate_value_tokens(item) for item in value.values())
+    if isinstance(value, list):
+        return sum(_estimate_value_tokens(item) for item in value)
+    if value is None or isinstance(value, bool):
+        return 1
+    return estimate_text_tokens(str(value))
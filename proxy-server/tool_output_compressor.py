@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import json
+from typing import Any
+
+from cache.factory import get_async_cache
+from config import (
+    SUMMARIZATION_SEGMENT_TOKENS,
+    TOOL_OUTPUT_COMPRESSION_MODE,
+    TOOL_OUTPUT_DIGEST_TOKENS,
+    TOOL_OUTPUT_KEEP_RECENT,
+    TOOL_OUTPUT_MAX_TOKENS,
+)
+from message_adapter import MessageAdapter
+from metrics import tool_output_tokens
+from summarizer import get_summarizer
+from text_digest import create_extractive_digest
+
+# Sizes are estimated from characters, tool outputs are never tokenized
+_CHARS_PER_TOKEN = 4
+
+
+async def compress_tool_outputs(
+    conversation: list[Any], adapter: MessageAdapter
+) -> list[Any]:
+    """
+    Replace oversized tool outputs with compact digests, except the
+    TOOL_OUTPUT_KEEP_RECENT most recent ones.
+    Return the original conversation if nothing is compressed, otherwise a
+    new list (compressed messages are copies).
+    """
+    tool_message_indexes = [
+        index
+        for index, message in enumerate(conversation)
+        if len(adapter.get_tool_outputs(message)) > 0
+    ]
+    old_length = max(len(tool_message_indexes) - TOOL_OUTPUT_KEEP_RECENT, 0)
+    old_indexes = tool_message_indexes[:old_length]
+    outputs_list = [adapter.get_tool_outputs(conversation[i]) for i in old_indexes]
+    # Compressed concurrently: the summarizer bounds its concurrent calls, and
+    # its deadline includes waiting for a slot, so a request waits for about
+    # one summarizer timeout, no matter how many outputs are compressed
+    new_outputs_list = await asyncio.gather(
+        *[
+            asyncio.gather(*[compress_tool_output(output) for output in outputs])
+            for outputs in outputs_list
+        ]
+    )
+    new_conversation = conversation
+    for index, outputs, new_outputs in zip(old_indexes, outputs_list, new_outputs_list):
+        message = conversation[index]
+        if all(new is old for new, old in zip(new_outputs, outputs)):
+            continue
+        if new_conversation is conversation:
+            new_conversation = list(conversation)
+        new_conversation[index] = adapter.set_tool_outputs(message, new_outputs)
+    return new_conversation
+
+
+async def compress_tool_output(output: Any) -> Any:
+    """Return the output as it is if it is small, otherwise its digest."""
+    text = _get_text(output)
+    if text is None or len(text) <= TOOL_OUTPUT_MAX_TOKENS * _CHARS_PER_TOKEN:
+        return output
+    key_data = f"{TOOL_OUTPUT_COMPRESSION_MODE}:{TOOL_OUTPUT_DIGEST_TOKENS}\n{text}"
+    key = hashlib.md5(key_data.encode("utf-8")).hexdigest()
+    cache = get_async_cache()
+    digest = await cache.get(key)
+    if digest is None:
+        digest, is_fallback = await _create_digest(text)
+        # Summarizer failures are retried, extractive digests are deterministic
+        if not is_fallback:
+            await cache.set(key, digest)
+    tool_output_tokens.inc(len(text) // _CHARS_PER_TOKEN, ("original",))
+    tool_output_tokens.inc(len(digest) // _CHARS_PER_TOKEN, ("compressed",))
+    return _replace_text(output, digest)
+
+
+async def _create_digest(text: str) -> tuple[str, bool]:
+    """
+    Return the digest, and whether it is an extract made because the
+    summarizer failed.
+    """
+    if TOOL_OUTPUT_COMPRESSION_MODE != "summarizer":
+        return create_extractive_digest(text, TOOL_OUTPUT_DIGEST_TOKENS), False
+    # The summarizer input is bounded as well
+    summarizer_input = create_extractive_digest(text, SUMMARIZATION_SEGMENT_TOKENS)
+    digest, usage = await get_summarizer().summarize(
+        (
+            f"Tool output: {summarizer_input}",
+            f"Compress the tool output into at most {TOOL_OUTPUT_DIGEST_TOKENS} tokens, keep names, paths, identifiers, numbers, and errors the main assistant may need later",  # noqa
+        ),
+        text,
+        TOOL_OUTPUT_DIGEST_TOKENS,
+    )
+    if usage.get("fallback", False):
+        return digest, True
+    return f"[Tool output summarized by proxy]\n{digest}", False
+
+
+def _get_text(output: Any) -> str | None:
+    if isinstance(output, str):
+        return output
+    if isinstance(output, dict) and len(output) == 1:
+        # E.g., {'output': '...'}
+        value = next(iter(output.values()))
+        if isinstance(value, str):
+            return value
+    if isinstance(output, (dict, list)):
+        return json.dumps(output, indent=1)
+    return None
+
+
+def _replace_text(output: Any, digest: str) -> Any:
+    if isinstance(output, dict) and len(output) == 1:
+        key, value = next(iter(output.items()))
+        if isinstance(value, str):
+            return {key: digest}
+    return digest
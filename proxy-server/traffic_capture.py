@@ -0,0 +1,268 @@
+import gzip
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator
+
+import httpx
+import json_util
+from admission_control import get_caller_id
+from config import (
+    CLIENT_ID_HEADER,
+    PRIORITY_HEADER,
+    TRAFFIC_CAPTURE_FLUSH_INTERVAL,
+    TRAFFIC_CAPTURE_PATH,
+    TRAFFIC_CAPTURE_QUEUE_SIZE,
+)
+from fastapi import Request
+from log_util import LazyJson, is_redacted_key, logger, redact_secrets
+
+# Only these request headers are captured, others may carry credentials
+_CAPTURED_HEADERS = ("content-type", "accept", "user-agent", PRIORITY_HEADER.lower())
+# Records written at once, even before the flush interval
+_MAX_BATCH_SIZE = 1000
+
+
+class TrafficRecord:
+    """
+    A captured request: when it arrived, what it carried, and how the
+    upstream answered (time to first byte, duration, size).
+    The caller is captured as the hash used for rate limiting, so a replay
+    keeps requests of the same caller together.
+    """
+
+    def __init__(self, request: Request, path: str, body: bytes, stream: bool):
+        self.time = time.time()
+        self.start_time = time.perf_counter()
+        self.method = request.method
+        self.path = path
+        self.query_params = {
+            key: value
+            for key, value in request.query_params.items()
+            if not is_redacted_key(key)
+        }
+        self.headers = {
+            key: value
+            for key, value in request.headers.items()
+            if key.lower() in _CAPTURED_HEADERS
+        }
+        self.headers[CLIENT_ID_HEADER] = get_caller_id(request)
+        self.body = body
+        self.stream = stream
+        self.source: str | None = None
+        self.status_code: int | None = None
+        self.duration: float | None = None
+        self.upstream: dict[str, Any] | None = None
+
+    def finish(self, source: str, status_code: int):
+        if self.source is not None:
+            return
+        self.source = source
+        self.status_code = status_code
+        self.duration = time.perf_counter() - self.start_time
+        get_traffic_capture().submit(self)
+
+    def to_json(self) -> bytes:
+        return json_util.dumps(
+            {
+                "time": self.time,
+                "method": self.method,
+                "path": self.path,
+                "route": get_traffic_route(self.path, self.stream),
+                "query_params": self.query_params,
+                "headers": self.headers,
+                "body": redact_secrets(self.body.decode("utf-8", errors="replace")),
+                "source": self.source,
+                "status_code": self.status_code,
+                "duration": self.duration,
+                "upstream": self.upstream,
+            }
+        )
+
+
+class _CapturingStream(httpx.AsyncByteStream):
+    """Measure the upstream response, and finish the record once it is closed."""
+
+    def __init__(self, stream: Any, record: TrafficRecord, upstream_start_time: float):
+        self.stream = stream
+        self.record = record
+        self.upstream_start_time = upstream_start_time
+        self.chunk_count = 0
+        self.response_bytes = 0
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            self.chunk_count += 1
+            self.response_bytes += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self.record.upstream["duration"] = (
+                time.perf_counter() - self.upstream_start_time
+            )
+            self.record.upstream["chunks"] = self.chunk_count
+            self.record.upstream["response_bytes"] = self.response_bytes
+            self.record.finish("upstream", self.record.upstream["status_code"])
+
+
+class TrafficCapture:
+    """
+    Append captured requests to a trace file from a background thread.
+    Every write appends a gzip member of JSON lines, so the file stays
+    readable when the proxy is killed, and workers can share the file.
+    Records are dropped when the queue is full instead of blocking requests.
+    """
+
+    def __init__(self, path: str, flush_interval: float, max_queue_size: int):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue[TrafficRecord | None] = queue.Queue(max_queue_size)
+        self.thread: threading.Thread | None = None
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        if self.thread is not None or self.path == "":
+            return
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Write pending records and stop the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def submit(self, record: TrafficRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def get_stats(self) -> dict[str, int]:
+        return {"written": self.written, "dropped": self.dropped}
+
+    def _run(self):
+        records = []
+        deadline = time.monotonic() + self.flush_interval
+        is_stopped = False
+        while not is_stopped:
+            try:
+                record = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                if record is None:
+                    is_stopped = True
+                else:
+                    records.append(record)
+            except queue.Empty:
+                pass
+            if (
+                is_stopped
+                or len(records) >= _MAX_BATCH_SIZE
+                or time.monotonic() >= deadline
+            ):
+                self._write(records)
+                records = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, records: list[TrafficRecord]):
+        if len(records) == 0:
+            return
+        try:
+            content = b"".join(record.to_json() + b"\n" for record in records)
+            # One write per member, appended after the other workers' members
+            with open(self.path, "ab", buffering=0) as f:
+                f.write(gzip.compress(content, compresslevel=6))
+            self.written += len(records)
+        except Exception as e:
+            self.dropped += len(records)
+            logger.error(
+                LazyJson({"event": "traffic_capture_error", "data": {"error": str(e)}})
+            )
+
+
+_traffic_capture: TrafficCapture | None = None
+
+
+def get_traffic_capture() -> TrafficCapture:
+    global _traffic_capture
+    if _traffic_capture is None:
+        _traffic_capture = TrafficCapture(
+            TRAFFIC_CAPTURE_PATH,
+            TRAFFIC_CAPTURE_FLUSH_INTERVAL,
+            TRAFFIC_CAPTURE_QUEUE_SIZE,
+        )
+    return _traffic_capture
+
+
+def create_traffic_record(
+    request: Request, path: str, body: bytes, stream: bool
+) -> TrafficRecord | None:
+    """Return None if traffic is not captured."""
+    if TRAFFIC_CAPTURE_PATH == "":
+        return None
+    return TrafficRecord(request, path, body, stream)
+
+
+def capture_traffic(record: TrafficRecord | None, source: str, status_code: int):
+    """Capture a request answered without the upstream (e.g., cache hit)."""
+    if record is None:
+        return
+    record.finish(source, status_code)
+
+
+def capture_upstream_traffic(
+    record: TrafficRecord | None,
+    response: httpx.Response,
+    request_bytes: int,
+    upstream_start_time: float,
+):
+    """
+    Capture a request answered by the upstream, once its response is closed.
+    Time to first byte includes the whole body of non-streamed responses.
+    """
+    if record is None:
+        return
+    record.upstream = {
+        "status_code": response.status_code,
+        "request_bytes": request_bytes,
+        "ttfb": time.perf_counter() - upstream_start_time,
+    }
+    response.stream = _CapturingStream(response.stream, record, upstream_start_time)
+
+
+def get_traffic_route(path: str, stream: bool) -> str:
+    if path.startswith("v1beta/models/") and ":" in path:
+        # v1beta/models/<model-name>:streamGenerateContent
+        return path.rsplit(":", 1)[1]
+    if path.startswith("v1/chat/completions"):
+        return "chat_completions_stream" if stream else "chat_completions"
+    if path.startswith("v1/embeddings"):
+        return "embeddings"
+    return "other"
+
+
+def read_traffic_records(path: str) -> list[dict[str, Any]]:
+    """
+    Read captured requests in arrival order. A member cut short (e.g., the
+    proxy was killed while writing) ends the trace.
+    """
+    records = []
+    try:
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                records.append(json_util.loads(line))
+    except (EOFError, gzip.BadGzipFile, ValueError) as e:
+        logger.warning(
+            LazyJson({"event": "traffic_trace_truncated", "data": {"error": str(e)}})
+        )
+    records.sort(key=_get_time)
+    return records
+
+
+def _get_time(record: dict[str, Any]) -> float:
+    return record["time"]
@@ -0,0 +1,132 @@
+import random
+import time
+from typing import Any
+
+from config import (
+    LLM_UPSTREAMS,
+    UPSTREAM_COOLDOWN,
+    UPSTREAM_FAILURE_THRESHOLD,
+    UPSTREAM_SELECTION_STRATEGY,
+)
+
+# Weight of the latest observation in moving averages
+_EWMA_ALPHA = 0.2
+# Latency (in seconds) an upstream is penalized with for a 100% error rate
+_ERROR_PENALTY = 10
+
+
+class Upstream:
+    def __init__(self, url: str, api_key: str | None, weight: float = 1):
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.weight = weight
+        self.ewma_latency = 0.0
+        self.ewma_error_rate = 0.0
+        self.request_count = 0
+        self.error_count = 0
+        self.rate_limited_count = 0
+        self.consecutive_failures = 0
+        # Circuit is open (upstream is skipped) until this time
+        self.unavailable_until = 0.0
+        self.last_failure_time = 0.0
+
+    def is_available(self, now: float) -> bool:
+        return self.unavailable_until <= now
+
+    def record_success(self, latency: float):
+        self.request_count += 1
+        self.consecutive_failures = 0
+        if self.request_count == 1:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency += _EWMA_ALPHA * (latency - self.ewma_latency)
+        self.ewma_error_rate *= 1 - _EWMA_ALPHA
+
+    def record_failure(self, status_code: int | None, retry_after: float | None):
+        """
+        status_code is None for connection errors and timeouts.
+        A 429 takes the upstream out of rotation for retry_after seconds,
+        other errors open the circuit after consecutive failures.
+        """
+        now = time.monotonic()
+        self.last_failure_time = now
+        self.request_count += 1
+        self.error_count += 1
+        self.consecutive_failures += 1
+        self.ewma_error_rate += _EWMA_ALPHA * (1 - self.ewma_error_rate)
+        if status_code == 429:
+            self.rate_limited_count += 1
+            cooldown = retry_after if retry_after is not None else UPSTREAM_COOLDOWN
+            self.unavailable_until = now + cooldown
+        elif self.consecutive_failures >= UPSTREAM_FAILURE_THRESHOLD:
+            self.unavailable_until = now + UPSTREAM_COOLDOWN
+
+    def get_error_rate(self, now: float) -> float:
+        # Halve the error rate every cooldown period without failure,
+        # so upstreams that stopped failing are eventually tried again
+        elapsed = now - self.last_failure_time
+        return self.ewma_error_rate * 0.5 ** (elapsed / UPSTREAM_COOLDOWN)
+
+    def get_score(self, now: float) -> float:
+        # Lower is better, penalize upstreams that have been failing recently
+        return self.ewma_latency + _ERROR_PENALTY * self.get_error_rate(now)
+
+    def get_stats(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "ewma_latency": self.ewma_latency,
+            "ewma_error_rate": self.ewma_error_rate,
+            "request_count": self.request_count,
+            "error_count": self.error_count,
+            "rate_limited_count": self.rate_limited_count,
+            "is_available": self.is_available(time.monotonic()),
+        }
+
+
+class UpstreamPool:
+    def __init__(self, upstreams: list[Upstream], strategy: str = "least_latency"):
+        self.upstreams = upstreams
+        self.strategy = strategy
+
+    def select(self, excluded: list[Upstream] | None = None) -> Upstream | None:
+        """
+        Pick an available upstream that is not excluded.
+        When every upstream is unavailable, the one that recovers first is
+        picked (half-open), so requests are never rejected by the pool alone.
+        """
+        excluded = excluded or []
+        candidates = [u for u in self.upstreams if u not in excluded]
+        if len(candidates) == 0:
+            return None
+        now = time.monotonic()
+        available = [u for u in candidates if u.is_available(now)]
+        if len(available) == 0:
+            return min(candidates, key=lambda u: u.unavailable_until)
+        if self.strategy == "weighted":
+            weights = [u.weight * (1 - u.get_error_rate(now)) + 1e-6 for u in available]
+            return random.choices(available, weights=weights)[0]
+        # Upstreams without any sample get a score of 0, so they are explored
+        return min(available, key=lambda u: u.get_score(now))
+
+    def get_stats(self) -> list[dict[str, Any]]:
+        return [upstream.get_stats() for upstream in self.upstreams]
+
+
+_upstream_pool: UpstreamPool | None = None
+
+
+def get_upstream_pool() -> UpstreamPool:
+    global _upstream_pool
+    if _upstream_pool is None:
+        _upstream_pool = UpstreamPool(
+            [
+                Upstream(
+                    url=upstream["url"],
+                    api_key=upstream.get("api_key"),
+                    weight=float(upstream.get("weight", 1)),
+                )
+                for upstream in LLM_UPSTREAMS
+            ],
+            UPSTREAM_SELECTION_STRATEGY,
+        )
+    return _upstream_pool
@@ -0,0 +1,369 @@
+import asyncio
+import time
+from typing import Any
+
+import httpx
+import json_util
+from compression_util import decode_content_prefix, get_content_encoding
+from config import UPSTREAM_MAX_RETRIES
+from context_cache import get_context_cache_manager
+from fastapi import HTTPException, Request
+from hedging import RouteHedgePolicy, get_route_hedge_policy
+from log_util import LazyJson, logger
+from metrics import upstream_responses
+from request_util import (
+    get_outgoing_query_params,
+    get_outgoing_request_header,
+    get_outgoing_url,
+    is_retryable_request,
+    is_upstream_pool_path,
+)
+from upstream_pool import Upstream, get_upstream_pool
+
+# Bytes of an error response searched for its cause
+_MAX_ERROR_BYTES = 64 * 1024
+
+
+async def send_upstream_request(
+    client: httpx.AsyncClient,
+    request: Request,
+    path: str,
+    content: str | bytes,
+    stream: bool,
+    payload: Any = None,
+) -> httpx.Response:
+    """
+    Send request to the best upstream in the pool.
+    Non-streamed idempotent requests (see is_retryable_request) are retried on
+    another upstream when the upstream is unreachable, rate limited, or
+    returns a server error. Other requests are sent once.
+    payload (the parsed content) lets the request reference upstream cached
+    contents.
+    Generation requests may be hedged (see _send_hedged).
+    """
+    if not is_upstream_pool_path(path):
+        return await _send(client, request, path, content, stream, None)
+    upstream_pool = get_upstream_pool()
+    hedge_policy = get_route_hedge_policy(path, stream)
+    max_attempts = 1
+    if not stream and is_retryable_request(request.method, path):
+        max_attempts += UPSTREAM_MAX_RETRIES
+    tried_upstreams: list[Upstream] = []
+    for attempt in range(max_attempts):
+        upstream = upstream_pool.select(tried_upstreams)
+        if upstream is None:
+            break
+        tried_upstreams.append(upstream)
+        is_last_attempt = attempt == max_attempts - 1 or len(tried_upstreams) == len(
+            upstream_pool.upstreams
+        )
+        start_time = time.monotonic()
+        try:
+            response, upstream = await _send_hedged(
+                client,
+                request,
+                path,
+                content,
+                stream,
+                upstream,
+                payload,
+                hedge_policy,
+                tried_upstreams,
+            )
+        except HTTPException:
+            upstream.record_failure(None, None)
+            _log_upstream_failure(upstream, None)
+            if is_last_attempt:
+                raise
+            continue
+        if not _is_upstream_failure(response.status_code):
+            upstream.record_success(time.monotonic() - start_time)
+            return response
+        upstream.record_failure(response.status_code, _get_retry_after(response))
+        _log_upstream_failure(upstream, response.status_code)
+        if is_last_attempt:
+            return response
+        await response.aclose()
+    raise HTTPException(status_code=503, detail="Service unavailable")
+
+
+async def warm_up_upstreams(client: httpx.AsyncClient):
+    """
+    Open a connection (DNS, TCP, TLS) to every upstream before the first
+    request. Any response, even an error, leaves the connection in the pool.
+    """
+    urls = {upstream.url for upstream in get_upstream_pool().upstreams}
+    await asyncio.gather(*[_warm_up_upstream(client, url) for url in urls])
+
+
+async def _warm_up_upstream(client: httpx.AsyncClient, url: str):
+    try:
+        await client.get(url)
+    except httpx.HTTPError as e:
+        logger.warning(
+            LazyJson(
+                {
+                    "event": "upstream_warm_up_error",
+                    "data": {"url": url, "error": str(e)},
+                }
+            )
+        )
+
+
+async def _send_hedged(
+    client: httpx.AsyncClient,
+    request: Request,
+    path: str,
+    content: str | bytes,
+    stream: bool,
+    upstream: Upstream,
+    payload: Any,
+    hedge_policy: RouteHedgePolicy | None,
+    tried_upstreams: list[Upstream],
+) -> tuple[httpx.Response, Upstream]:
+    """
+    When the upstream has not sent the response headers (and the first chunk
+    of a stream) within the hedge delay, send the same request to another
+    upstream (or the same one if there is no other), and use whichever
+    answers first. The other request is cancelled.
+    Return the response and the upstream that sent it.
+    """
+    if hedge_policy is None:
+        response = await _send_with_context_cache(
+            client, request, path, content, stream, upstream, payload
+        )
+        return response, upstream
+    delay = hedge_policy.get_delay()
+    attempts: dict[asyncio.Task, tuple[Upstream, float]] = {}
+
+    def start_attempt(attempt_upstream: Upstream) -> asyncio.Task:
+        task = asyncio.ensure_future(
+            _send_first_byte(
+                client, request, path, content, stream, attempt_upstream, payload
+            )
+        )
+        attempts[task] = (attempt_upstream, time.monotonic())
+        return task
+
+    primary = start_attempt(upstream)
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if len(done) == 0 and hedge_policy.try_fire():
+                hedge_upstream = get_upstream_pool().select(tried_upstreams)
+                start_attempt(hedge_upstream or upstream)
+        winner = await _wait_for_winner(list(attempts))
+    except BaseException:
+        for task in attempts:
+            _discard_attempt(task)
+        raise
+    for task in attempts:
+        if task is not winner:
+            _discard_attempt(task)
+    winner_upstream, start_time = attempts[winner]
+    hedge_policy.record_first_byte(time.monotonic() - start_time)
+    if winner is not primary:
+        hedge_policy.won += 1
+        logger.info(
+            LazyJson({"event": "hedge_won", "data": {"url": winner_upstream.url}})
+        )
+    return winner.result(), winner_upstream
+
+
+async def _wait_for_winner(tasks: list[asyncio.Task]) -> asyncio.Task:
+    """
+    Return the first attempt that got a successful response, or the last one
+    to finish if none did.
+    """
+    pending = set(tasks)
+    while True:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None and not _is_upstream_failure(
+                task.result().status_code
+            ):
+                return task
+        if len(pending) == 0:
+            return done.pop()
+
+
+def _discard_attempt(task: asyncio.Task):
+    if not task.done():
+        task.cancel()
+        return
+    if task.cancelled() or task.exception() is not None:
+        return
+    # The response is not used, release its connection
+    asyncio.ensure_future(task.result().aclose())
+
+
+async def _send_first_byte(
+    client: httpx.AsyncClient,
+    request: Request,
+    path: str,
+    content: str | bytes,
+    stream: bool,
+    upstream: Upstream,
+    payload: Any,
+) -> httpx.Response:
+    """Send the request, and wait for the first chunk if it is streamed."""
+    response = await _send_with_context_cache(
+        client, request, path, content, stream, upstream, payload
+    )
+    if not stream or _is_upstream_failure(response.status_code):
+        return response
+    try:
+        await _prefetch_first_chunk(response)
+    except httpx.TransportError:
+        await response.aclose()
+        raise HTTPException(status_code=503, detail="Service unavailable")
+    except BaseException:
+        await response.aclose()
+        raise
+    return response
+
+
+async def _prefetch_first_chunk(response: httpx.Response):
+    iterator = response.stream.__aiter__()
+    try:
+        first_chunk = await iterator.__anext__()
+    except StopAsyncIteration:
+        first_chunk = None
+    response.stream = _PrefetchedStream(response.stream, iterator, first_chunk)
+
+
+class _PrefetchedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: Any, iterator: Any, first_chunk: bytes | None):
+        self.stream = stream
+        self.iterator = iterator
+        self.first_chunk = first_chunk
+
+    async def __aiter__(self):
+        if self.first_chunk is None:
+            return
+        yield self.first_chunk
+        async for chunk in self.iterator:
+            yield chunk
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+async def _send_with_context_cache(
+    client: httpx.AsyncClient,
+    request: Request,
+    path: str,
+    content: str | bytes,
+    stream: bool,
+    upstream: Upstream,
+    payload: Any,
+) -> httpx.Response:
+    lease = get_context_cache_manager().acquire(
+        client, upstream, get_outgoing_url(path, upstream), payload
+    )
+    if lease is None:
+        return await _send(client, request, path, content, stream, upstream)
+    try:
+        response = await _send(
+            client, request, path, json_util.dumps(lease.payload), stream, upstream
+        )
+    except BaseException:
+        lease.release()
+        raise
+    if await _is_cached_content_error(response):
+        # The cached content may have expired or been deleted upstream
+        await response.aclose()
+        lease.invalidate()
+        return await _send(client, request, path, content, stream, upstream)
+    if stream:
+        lease.release_on_close(response)
+    else:
+        lease.release()
+    return response
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    request: Request,
+    path: str,
+    content: str | bytes,
+    stream: bool,
+    upstream: Upstream | None,
+) -> httpx.Response:
+    try:
+        req = client.build_request(
+            method=request.method,
+            url=get_outgoing_url(path, upstream),
+            headers=get_outgoing_request_header(path, request, upstream),
+            content=content,
+            params=get_outgoing_query_params(request, path, upstream),
+        )
+        response = await client.send(req, stream=True)
+        if not stream:
+            await _read_raw_content(response)
+    except httpx.TransportError:
+        # Unreachable, timed out, or dropped the connection while responding
+        raise HTTPException(status_code=503, detail="Service unavailable")
+    upstream_responses.inc(labels=(str(response.status_code),))
+    return response
+
+
+async def _read_raw_content(response: httpx.Response):
+    """
+    Read the whole response without decoding it, so compressed content can be
+    forwarded as it is.
+    """
+    try:
+        content = b"".join([chunk async for chunk in response.stream])
+    finally:
+        await response.stream.aclose()
+    response.stream = _RawContentStream(content)
+
+
+async def _is_cached_content_error(response: httpx.Response) -> bool:
+    """
+    Whether the upstream rejected the cachedContent reference. Other client
+    errors (e.g., an invalid request) are returned to the client as they are.
+    """
+    if response.status_code not in (400, 403, 404):
+        return False
+    if not isinstance(response.stream, _RawContentStream):
+        # Error bodies are small, they are still forwarded after being read
+        await _read_raw_content(response)
+    content = decode_content_prefix(
+        response.stream.content,
+        get_content_encoding(response.headers),
+        _MAX_ERROR_BYTES,
+    )
+    # E.g., "CachedContent not found (or permission denied)"
+    return b"cachedcontent" in content.lower().replace(b" ", b"")
+
+
+class _RawContentStream(httpx.AsyncByteStream):
+    def __init__(self, content: bytes):
+        self.content = content
+
+    async def __aiter__(self):
+        yield self.content
+
+
+def _is_upstream_failure(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def _get_retry_after(response: httpx.Response) -> float | None:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _log_upstream_failure(upstream: Upstream, status_code: int | None):
+    logger.warning(
+        LazyJson(
+            {
+                "event": "upstream_failure",
+                "data": {"url": upstream.url, "status_code": status_code},
+            }
+        )
+    )
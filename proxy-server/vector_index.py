@@ -0,0 +1,94 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+class VectorIndex:
+    """
+    Fixed capacity cosine similarity index.
+    Vectors are normalized and stored as rows of a float32 matrix. When a
+    path is given, the matrix is a memory-mapped .npy file, so it survives
+    restarts. When the index is full, the least recently used row is reused.
+    """
+
+    def __init__(self, capacity: int, path: str | None = None):
+        self.capacity = capacity
+        self.path = path
+        self.matrix: np.ndarray | None = None
+        self.size = 0
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.clock = 0
+        if path is not None and os.path.isfile(path):
+            self.matrix = np.lib.format.open_memmap(path, mode="r+")
+            if self.matrix.shape[0] != capacity:
+                # Capacity was changed, start over
+                self.matrix = None
+
+    def add(self, vector: np.ndarray) -> int:
+        vector = _normalize(vector)
+        self._ensure_matrix(vector.shape[0])
+        if self.size < self.capacity:
+            row = self.size
+            self.size += 1
+        else:
+            row = int(np.argmin(self.last_used))
+        self.matrix[row] = vector
+        self.touch(row)
+        return row
+
+    def get_checksum(self, row: int) -> str:
+        """Identify the vector stored in a row (e.g., to match saved metadata)."""
+        return hashlib.md5(self.matrix[row].tobytes()).hexdigest()
+
+    def touch(self, row: int):
+        self.clock += 1
+        self.last_used[row] = self.clock
+
+    def search(self, vector: np.ndarray, threshold: float) -> list[tuple[int, float]]:
+        return self.search_many(np.asarray([vector]), threshold)[0]
+
+    def search_many(
+        self, vectors: np.ndarray, threshold: float
+    ) -> list[list[tuple[int, float]]]:
+        """
+        Return rows with cosine similarity >= threshold for every vector,
+        ordered from the most similar one.
+        """
+        if self.matrix is None or self.size == 0:
+            return [[] for _ in vectors]
+        if vectors.shape[1] != self.matrix.shape[1]:
+            return [[] for _ in vectors]
+        queries = _normalize(vectors)
+        scores = queries @ self.matrix[: self.size].T
+        results = []
+        for query_scores in scores:
+            rows = np.flatnonzero(query_scores >= threshold)
+            rows = rows[np.argsort(-query_scores[rows])]
+            results.append([(int(row), float(query_scores[row])) for row in rows])
+        return results
+
+    def flush(self):
+        if isinstance(self.matrix, np.memmap):
+            self.matrix.flush()
+
+    def _ensure_matrix(self, dimension: int):
+        if self.matrix is not None and self.matrix.shape[1] == dimension:
+            return
+        # First vector, or the embedding model has changed
+        self.size = 0
+        self.last_used[:] = 0
+        shape = (self.capacity, dimension)
+        if self.path is None:
+            self.matrix = np.zeros(shape, dtype=np.float32)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.matrix = np.lib.format.open_memmap(
+            self.path, mode="w+", dtype=np.float32, shape=shape
+        )
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
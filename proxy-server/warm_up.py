@@ -0,0 +1,71 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from config import WARM_UP_TIMEOUT
+from log_util import LazyJson, logger
+
+
+class WarmUp:
+    """
+    Startup work done in the background while the proxy already serves
+    requests (e.g., loading caches, connecting to upstreams), so it delays
+    readiness but not liveness. Failed or timed out steps count as finished,
+    their work is done again by the first request that needs it.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.steps: dict[str, dict[str, Any]] = {}
+        self.duration: float | None = None
+
+    async def run(self, steps: dict[str, Callable[[], Awaitable[Any]]]):
+        start_time = time.perf_counter()
+        self.steps = {name: {"status": "pending"} for name in steps}
+        await asyncio.gather(
+            *[self._run_step(name, step) for name, step in steps.items()]
+        )
+        self.duration = time.perf_counter() - start_time
+        logger.info(LazyJson({"event": "warm_up_finished", "data": self.get_status()}))
+
+    def is_ready(self) -> bool:
+        return self.duration is not None
+
+    def get_status(self) -> dict[str, Any]:
+        return {
+            "status": "ready" if self.is_ready() else "warming_up",
+            "duration": self.duration,
+            "steps": self.steps,
+        }
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[Any]]):
+        step_start_time = time.perf_counter()
+        try:
+            await asyncio.wait_for(step(), self.timeout)
+            status = "done"
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except Exception as e:
+            status = "failed"
+            logger.warning(
+                LazyJson(
+                    {
+                        "event": "warm_up_step_failed",
+                        "data": {"step": name, "error": str(e)},
+                    }
+                )
+            )
+        self.steps[name] = {
+            "status": status,
+            "duration": time.perf_counter() - step_start_time,
+        }
+
+
+_warm_up: WarmUp | None = None
+
+
+def get_warm_up() -> WarmUp:
+    global _warm_up
+    if _warm_up is None:
+        _warm_up = WarmUp(WARM_UP_TIMEOUT)
+    return _warm_up
@@ -8,7 +8,7 @@ from pydantic_ai.models.gemini import GeminiModel
 from pydantic_ai.providers.google_gla import GoogleGLAProvider
 
 # for automation
-from zrb import CmdTask, Group, HttpCheck, LLMTask, Task, cli, llm_config
+from zrb import CmdTask, Group, HttpCheck, IntInput, LLMTask, Task, cli, llm_config
 
 load_dotenv()
 LLM_API_KEY = os.getenv("BANKAI_LLM_API_KEY", f"{getpass.getuser()}-key")
@@ -47,12 +47,18 @@ arasaka_group.add_task(
 
 start_proxy_server = CmdTask(
     name="start-proxy",
+    input=IntInput(
+        name="proxy-workers",
+        description="Number of proxy worker processes",
+        default=os.getenv("PROXY_WORKERS", "1"),
+    ),
     cwd=os.path.join(os.path.dirname(__file__), "proxy-server"),
-    cmd="python main.py",
+    cmd="PROXY_WORKERS={ctx.input.proxy_workers} python main.py",
+    # /ready waits for the proxy to warm its caches and upstream connections
     readiness_check=HttpCheck(
-        name="check-proxy", url="http://localhost:8000/health", interval=1
+        name="check-proxy", url="http://localhost:8000/ready", interval=0.2
     ),
-    readiness_check_delay=1,
+    readiness_check_delay=0.2,
 )
 
 start_mcp_server = CmdTask(
@@ -60,9 +66,9 @@ start_mcp_server = CmdTask(
     cwd=os.path.join(os.path.dirname(__file__), "mcp-server"),
     cmd="python main.py",
     readiness_check=HttpCheck(
-        name="check-mcp", url="http://localhost:8001/health", interval=1
+        name="check-mcp", url="http://localhost:8001/health", interval=0.2
     ),
-    readiness_check_delay=1,
+    readiness_check_delay=0.2,
 )
 
 arasaka_group.add_task(